@@ -41,7 +41,8 @@ def test_avatar_video_generation():
     # Step 2: Generate avatar video
     print("Step 2: Generating avatar video...")
     avatar_payload = {
-        "audio_base64": audio_base64
+        "audio_base64": audio_base64,
+        "return_base64": True
     }
     
     avatar_response = session.post(
@@ -0,0 +1,190 @@
+"""
+Asset Manifest
+Declares the rendered image assets (avatars and backgrounds) with their
+content hashes and generator parameters, so they can be validated cheaply
+at startup and rendered lazily on first use or by an explicit warm-up
+
+Usage (from the backend directory):
+    python -m lib.asset_manifest check     # report missing / changed assets
+    python -m lib.asset_manifest warm      # render every missing asset
+    python -m lib.asset_manifest rehash    # record current hashes in the manifest
+"""
+
+import hashlib
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AssetSpec:
+    """One rendered asset: where it lives, what it should contain and how to render it"""
+    path: str
+    generator: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class AssetManifest:
+    """
+    Registry of rendered assets backed by manifest.json in the assets dir.
+
+    Generators are referenced as "module:attribute.path" and called as
+    generator(output_path, **params); they are only imported when an asset
+    actually has to be rendered.
+    """
+
+    def __init__(self, assets_dir: Path, manifest_path: Optional[Path] = None):
+        self.assets_dir = Path(assets_dir)
+        self.manifest_path = Path(manifest_path) if manifest_path else self.assets_dir / "manifest.json"
+        self.assets: Dict[str, AssetSpec] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.manifest_path.exists():
+            logger.warning(f"Asset manifest not found at {self.manifest_path}")
+            return
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f).get("assets", [])
+        self.assets = {entry["path"]: AssetSpec(**entry) for entry in entries}
+
+    def save(self):
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"assets": [asdict(spec) for spec in self.assets.values()]}, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.manifest_path)
+
+    def path_for(self, relative_path: str) -> str:
+        return str(self.assets_dir / relative_path)
+
+    def validate(self) -> Dict[str, List[str]]:
+        """
+        Cheap startup check: a stat per asset, no decoding or hashing.
+
+        Missing assets are fine (they are rendered on first use); a size
+        different from the manifest means the file was changed or re-rendered.
+        """
+        report = {"missing": [], "changed": []}
+        for relative_path, spec in self.assets.items():
+            try:
+                size = (self.assets_dir / relative_path).stat().st_size
+            except FileNotFoundError:
+                report["missing"].append(relative_path)
+                continue
+            if spec.size is not None and size != spec.size:
+                report["changed"].append(relative_path)
+
+        if report["missing"] or report["changed"]:
+            logger.info(f"Asset manifest: {len(report['missing'])} missing (rendered on first use), "
+                        f"{len(report['changed'])} differ from the manifest")
+        return report
+
+    def verify(self) -> List[str]:
+        """Full check: assets whose content hash differs from the manifest"""
+        mismatched = []
+        for relative_path, spec in self.assets.items():
+            full_path = self.assets_dir / relative_path
+            if spec.sha256 and full_path.exists() and file_sha256(full_path) != spec.sha256:
+                mismatched.append(relative_path)
+        return mismatched
+
+    def fingerprint(self) -> str:
+        """Hash over the recorded content hashes of all assets; changes whenever an asset is rehashed"""
+        digest = hashlib.sha256()
+        for relative_path in sorted(self.assets):
+            spec = self.assets[relative_path]
+            digest.update(f"{relative_path}:{spec.sha256 or spec.size}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    def ensure(self, relative_path: str) -> str:
+        """Absolute path of an asset, rendering it first if it does not exist yet"""
+        full_path = self.assets_dir / relative_path
+        if full_path.exists():
+            return str(full_path)
+
+        spec = self.assets.get(relative_path)
+        if spec is None:
+            raise KeyError(f"Asset not in manifest: {relative_path}")
+
+        with self._lock_for(relative_path):
+            if not full_path.exists():
+                self._render(spec, full_path)
+        return str(full_path)
+
+    def warm(self) -> int:
+        """Render every missing asset; returns how many were rendered"""
+        missing = [path for path in self.assets if not (self.assets_dir / path).exists()]
+        for relative_path in missing:
+            self.ensure(relative_path)
+        return len(missing)
+
+    def rehash(self):
+        """Record the current size and hash of every existing asset"""
+        for relative_path, spec in self.assets.items():
+            full_path = self.assets_dir / relative_path
+            if full_path.exists():
+                spec.size = full_path.stat().st_size
+                spec.sha256 = file_sha256(full_path)
+        self.save()
+
+    def _lock_for(self, relative_path: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(relative_path, threading.Lock())
+
+    def _render(self, spec: AssetSpec, full_path: Path):
+        module_name, _, attribute_path = spec.generator.partition(":")
+        target = importlib.import_module(module_name)
+        for attribute in attribute_path.split("."):
+            target = getattr(target, attribute)
+
+        # Render next to the final path and rename, so concurrent workers never see a partial file
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = full_path.with_name(f"{full_path.stem}.{os.getpid()}.tmp{full_path.suffix}")
+        try:
+            target(str(tmp_path), **spec.params)
+            os.replace(tmp_path, full_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        logger.info(f"Rendered asset {spec.path}")
+
+
+# Global instance
+asset_manifest = AssetManifest(Path("/app/assets"))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+
+    if command == "warm":
+        print(f"Rendered {asset_manifest.warm()} missing assets")
+    elif command == "rehash":
+        asset_manifest.rehash()
+        print(f"Updated hashes for {len(asset_manifest.assets)} assets")
+    elif command == "check":
+        report = asset_manifest.validate()
+        report["hash_mismatch"] = asset_manifest.verify()
+        print(json.dumps(report, indent=2))
+    else:
+        sys.exit(f"Unknown command: {command} (expected check, warm or rehash)")
@@ -0,0 +1,87 @@
+"""
+Decoded Asset Store
+Avatar and background images decoded once into raw .npy arrays on local
+disk and memory-mapped, so every render process shares the same
+page-cache-backed pixels instead of JPEG-decoding its own copy
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class DecodedAssetStore:
+    """
+    Content-addressed cache of decoded BGR images.
+
+    Entries are named after the SHA-256 of the source file, so an edited or
+    re-rendered asset gets a new entry and stale ones are never served; the
+    cache directory can be wiped at any time. Arrays are returned as
+    read-only memory maps. Variants derived from an image (e.g. padded for
+    the sprite renderer) are stored next to it under the same hash.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, image_path: str) -> str:
+        """SHA-256 of the source file, memoized per (path, size, mtime)"""
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(key)
+        if cached is not None:
+            return cached
+
+        with open(image_path, 'rb') as f:
+            content_hash = hashlib.sha256(f.read()).hexdigest()
+        with self._lock:
+            self._hashes[key] = content_hash
+        return content_hash
+
+    def load(self, image_path: str) -> np.ndarray:
+        """Decoded image as a read-only memmap, decoding and storing it on first use"""
+        npy_path = self.cache_dir / f"{self.content_hash(image_path)}.npy"
+        if not npy_path.exists():
+            image = cv2.imread(image_path)
+            if image is None:
+                raise ValueError(f"Could not load image from {image_path}")
+            self._store(image, npy_path)
+            logger.info(f"Decoded {image_path} into {npy_path.name}")
+        return np.load(npy_path, mmap_mode='r')
+
+    def load_variant(self, image_path: str, variant: str, build: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        build(image) as a read-only memmap, building and storing it on first
+        use; `variant` names the derivation and must change with its parameters
+        """
+        npy_path = self.cache_dir / f"{self.content_hash(image_path)}.{variant}.npy"
+        if not npy_path.exists():
+            self._store(build(self.load(image_path)), npy_path)
+            logger.info(f"Stored {variant} variant of {image_path} into {npy_path.name}")
+        return np.load(npy_path, mmap_mode='r')
+
+    def _store(self, array: np.ndarray, npy_path: Path):
+        # Write under a temp name and rename so other processes never map a partial file
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = npy_path.with_name(f"{npy_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npy")
+        try:
+            np.save(tmp_path, array)
+            os.replace(tmp_path, npy_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+
+# Global instance
+decoded_asset_store = DecodedAssetStore(Path(os.environ.get("DECODED_ASSET_DIR", "/app/tmp/decoded_assets")))
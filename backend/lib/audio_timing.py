@@ -0,0 +1,299 @@
+"""
+TTS Timing Metadata
+Word-boundary timing tracks captured from edge-tts, exact MP3 duration parsing
+and the derived mouth animation / subtitle tracks used by the avatar generators
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# edge-tts reports offsets and durations in 100-nanosecond ticks
+TICKS_PER_SECOND = 10_000_000
+
+# MPEG audio header lookup tables (kbps / Hz), indexed by the header bit fields
+_BITRATES = {
+    # (mpeg1, layer) -> table
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG 1
+    2: [22050, 24000, 16000],  # MPEG 2
+    0: [11025, 12000, 8000],   # MPEG 2.5
+}
+
+_LAYERS = {3: 1, 2: 2, 1: 3}
+
+
+@dataclass
+class WordTiming:
+    """A single spoken word with its position in the audio, in seconds"""
+    word: str
+    offset: float
+    duration: float
+
+    @property
+    def end(self) -> float:
+        return self.offset + self.duration
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class SpeechTiming:
+    """Exact audio duration plus the word timing track for one TTS rendering"""
+    duration_seconds: float
+    words: List[WordTiming] = field(default_factory=list)
+
+    @classmethod
+    def from_payload(cls, audio_bytes: Optional[bytes] = None,
+                     word_timings: Optional[List[Dict[str, Any]]] = None,
+                     duration_seconds: Optional[float] = None) -> Optional["SpeechTiming"]:
+        """
+        Build timing metadata from what a client sent back with its audio.
+
+        Returns None when no reliable duration can be established, in which
+        case callers should fall back to decoding the audio.
+        """
+        words = [
+            WordTiming(word=str(t.get("word", "")), offset=float(t["offset"]), duration=float(t["duration"]))
+            for t in (word_timings or [])
+            if "offset" in t and "duration" in t
+        ]
+        words.sort(key=lambda w: w.offset)
+
+        duration = mp3_duration_seconds(audio_bytes) if audio_bytes else None
+        if duration is None:
+            duration = duration_seconds
+        if duration is None and words:
+            duration = words[-1].end
+
+        if not duration or duration <= 0:
+            return None
+        return cls(duration_seconds=float(duration), words=words)
+
+    def mouth_openness(self, fps: float) -> np.ndarray:
+        """Per-frame mouth openness in [0, 1] derived from the word track"""
+        return mouth_openness_track(self.words, self.duration_seconds, fps)
+
+
+def word_timing_from_boundary(chunk: Dict[str, Any]) -> WordTiming:
+    """Convert an edge-tts WordBoundary stream event into a WordTiming"""
+    return WordTiming(
+        word=chunk.get("text", ""),
+        offset=round(chunk["offset"] / TICKS_PER_SECOND, 3),
+        duration=round(chunk["duration"] / TICKS_PER_SECOND, 3)
+    )
+
+
+def _id3v2_size(data: bytes) -> int:
+    """Length of a leading ID3v2 tag (header included), 0 if absent"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def mp3_duration_seconds(data: bytes) -> Optional[float]:
+    """
+    Compute the exact duration of an MP3 stream by walking its frame headers.
+
+    Every frame header carries its own bitrate and sample rate, so summing the
+    samples per frame is exact for CBR and VBR streams alike without decoding
+    any audio. Returns None when no valid MPEG audio frames are found.
+    """
+    if not data:
+        return None
+
+    pos = _id3v2_size(data)
+    end = len(data)
+    if end >= 128 and data[-128:-125] == b"TAG":
+        end -= 128
+
+    total_seconds = 0.0
+    frames = 0
+
+    while pos + 4 <= end:
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            pos += 1
+            continue
+
+        version = (b1 >> 3) & 0x03
+        layer = _LAYERS.get((b1 >> 1) & 0x03)
+        bitrate_index = (b2 >> 4) & 0x0F
+        sample_rate_index = (b2 >> 2) & 0x03
+        if version == 1 or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+            pos += 1
+            continue
+
+        mpeg1 = version == 3
+        bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+        sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+        padding = (b2 >> 1) & 0x01
+
+        if layer == 1:
+            samples = 384
+            frame_length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            samples = 1152 if (layer == 2 or mpeg1) else 576
+            frame_length = (samples // 8) * bitrate // sample_rate + padding
+
+        if frame_length <= 4:
+            pos += 1
+            continue
+
+        # A leading Xing/Info frame is metadata, not audio
+        is_info_frame = frames == 0 and (
+            b"Xing" in data[pos:pos + 64] or b"Info" in data[pos:pos + 64]
+        )
+        if not is_info_frame:
+            total_seconds += samples / sample_rate
+            frames += 1
+
+        pos += frame_length
+
+    if frames == 0:
+        return None
+    return round(total_seconds, 3)
+
+
+def mouth_openness_track(words: List[WordTiming], duration_seconds: float, fps: float) -> np.ndarray:
+    """
+    Per-frame mouth openness (0 closed - 1 fully open) from word timings.
+
+    Inside a word the mouth opens and closes roughly once per syllable; between
+    words it rests closed. Computed for all frames at once with searchsorted.
+    """
+    total_frames = max(int(duration_seconds * fps), 0)
+    openness = np.zeros(total_frames, dtype=np.float32)
+    if total_frames == 0 or not words:
+        return openness
+
+    starts = np.array([w.offset for w in words], dtype=np.float64)
+    durations = np.array([max(w.duration, 1e-3) for w in words], dtype=np.float64)
+    syllables = np.array([_estimate_syllables(w.word) for w in words], dtype=np.float64)
+
+    times = np.arange(total_frames, dtype=np.float64) / fps
+    index = np.searchsorted(starts, times, side="right") - 1
+    valid = index >= 0
+    index = np.clip(index, 0, len(words) - 1)
+
+    progress = (times - starts[index]) / durations[index]
+    speaking = valid & (progress >= 0) & (progress < 1)
+
+    wave = np.abs(np.sin(np.pi * syllables[index] * progress))
+    openness[speaking] = (0.3 + 0.7 * wave[speaking]).astype(np.float32)
+    return openness
+
+
+def _estimate_syllables(word: str) -> int:
+    """Cheap vowel-group syllable estimate used to pace mouth movement"""
+    word = word.lower()
+    count = 0
+    previous_vowel = False
+    for char in word:
+        is_vowel = char in "aeiouy"
+        if is_vowel and not previous_vowel:
+            count += 1
+        previous_vowel = is_vowel
+    if word.endswith("e") and count > 1:
+        count -= 1
+    return max(count, 1)
+
+
+def sentence_timeline(sentences: List[str], duration_seconds: float,
+                      words: Optional[List[WordTiming]] = None,
+                      envelope: Optional[np.ndarray] = None, envelope_rate: float = 30.0,
+                      snap_window: float = 0.6) -> List[Tuple[float, float]]:
+    """
+    (start, end) seconds for each script sentence in the spoken audio.
+
+    With a word timing track, sentences are matched to the track word by word
+    and split in the middle of the pause before their first word. Otherwise
+    the duration is shared out by sentence length and each boundary is moved
+    to the quietest point of the loudness envelope within snap_window seconds.
+    """
+    if not sentences or duration_seconds <= 0:
+        return []
+
+    if words:
+        counts = np.array([max(len(re.findall(r"[\w']+", s)), 1) for s in sentences])
+        first_word = np.minimum(np.cumsum(counts) - counts, len(words) - 1)
+        boundaries = []
+        for index in first_word[1:]:
+            previous_end = words[index - 1].end if index > 0 else 0.0
+            boundaries.append((previous_end + words[index].offset) / 2)
+    else:
+        lengths = np.array([max(len(s), 1) for s in sentences], dtype=np.float64)
+        boundaries = list(np.cumsum(lengths)[:-1] / lengths.sum() * duration_seconds)
+        if envelope is not None and len(envelope):
+            half_window = int(snap_window * envelope_rate)
+            for i, boundary in enumerate(boundaries):
+                center = int(boundary * envelope_rate)
+                lo, hi = max(center - half_window, 0), min(center + half_window + 1, len(envelope))
+                if lo < hi:
+                    boundaries[i] = (lo + int(np.argmin(envelope[lo:hi]))) / envelope_rate
+
+    edges = [0.0] + [min(max(float(b), 0.0), duration_seconds) for b in boundaries] + [duration_seconds]
+    edges = np.maximum.accumulate(edges)
+    return [(round(float(start), 3), round(float(end), 3)) for start, end in zip(edges[:-1], edges[1:])]
+
+
+def _format_srt_time(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+
+def group_subtitle_cues(words: List[WordTiming], max_chars: int = 42,
+                        max_gap: float = 0.6) -> List[Dict[str, Any]]:
+    """Group words into subtitle cues, breaking on length or speech pauses"""
+    cues: List[Dict[str, Any]] = []
+    current: List[WordTiming] = []
+
+    for word in words:
+        if current:
+            text_length = len(" ".join(w.word for w in current)) + 1 + len(word.word)
+            gap = word.offset - current[-1].end
+            if text_length > max_chars or gap > max_gap:
+                cues.append(_make_cue(current))
+                current = []
+        current.append(word)
+
+    if current:
+        cues.append(_make_cue(current))
+    return cues
+
+
+def _make_cue(words: List[WordTiming]) -> Dict[str, Any]:
+    return {
+        "start": words[0].offset,
+        "end": words[-1].end,
+        "text": " ".join(w.word for w in words)
+    }
+
+
+def timings_to_srt(words: List[WordTiming], max_chars: int = 42) -> str:
+    """Render a word timing track as an SRT subtitle document"""
+    blocks = []
+    for number, cue in enumerate(group_subtitle_cues(words, max_chars=max_chars), start=1):
+        blocks.append(
+            f"{number}\n{_format_srt_time(cue['start'])} --> {_format_srt_time(cue['end'])}\n{cue['text']}\n"
+        )
+    return "\n".join(blocks)
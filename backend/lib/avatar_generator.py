@@ -5,36 +5,55 @@ Using free and open-source tools to create talking avatar videos
 
 import os
 import tempfile
-import subprocess
 import uuid
 from pathlib import Path
 import cv2
 import numpy as np
-from pydub import AudioSegment
 import base64
 import logging
+from lib.asset_manifest import asset_manifest
+from lib.audio_timing import SpeechTiming
+from lib.background_compositor import render_foreground_mask
+from lib.decoded_audio import DecodedAudio
+from lib.ffmpeg_renderer import FFmpegFrameWriter, ffmpeg_thread_args
+from lib.ffmpeg_runner import run_ffmpeg_for_job, media_duration_seconds
+from lib.frame_synthesis import MouthStyle, get_talking_head_sprites
+from lib.render_plans import render_plan_store
+from lib.render_quality import RenderQuality, FINAL, get_render_quality
+from lib.render_workspace import render_workspaces
+from lib.video_store import video_store, render_key
 
 logger = logging.getLogger(__name__)
 
+# Approximate mouth position and shape drawn over the avatar
+BASIC_MOUTH = MouthStyle(center=(0.5, 0.625), width=40, width_gain=40, height=15, height_gain=30,
+                         color=(150, 80, 80), start_angle=0, end_angle=180)
+
 class AvatarVideoGenerator:
     def __init__(self):
         self.assets_dir = Path("/app/assets")
-        self.temp_dir = Path("/app/tmp/avatar_videos")
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Ensure we have a default avatar image
-        self.ensure_default_avatar()
     
-    def ensure_default_avatar(self):
-        """Create a simple default avatar image if none exists"""
-        avatar_path = self.assets_dir / "default-avatar.jpg"
-        if not avatar_path.exists():
-            self.create_default_avatar(str(avatar_path))
+    def ensure_default_avatar(self) -> str:
+        """Path of the default avatar image, rendered on first use if missing"""
+        return asset_manifest.ensure("default-avatar.jpg")
     
     def create_default_avatar(self, output_path):
         """Create a simple avatar image using OpenCV"""
+        img = self.draw_default_avatar()
+        
+        # Save the image
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, img)
+        logger.info(f"Created default avatar at {output_path}")
+    
+    def create_default_avatar_mask(self, output_path):
+        """Foreground mask of the default avatar, for compositing it over backgrounds (asset manifest generator)"""
+        cv2.imwrite(output_path, render_foreground_mask(self.draw_default_avatar))
+    
+    def draw_default_avatar(self, backdrop: int = 240) -> np.ndarray:
+        """The default avatar drawn over a plain backdrop of the given grey level"""
         # Create a 512x512 image with a simple avatar
-        img = np.ones((512, 512, 3), dtype=np.uint8) * 240  # Light background
+        img = np.ones((512, 512, 3), dtype=np.uint8) * backdrop  # Light background
         
         # Draw a simple face
         center = (256, 256)
@@ -60,85 +79,47 @@ class AvatarVideoGenerator:
         
         # Mouth (closed)
         cv2.ellipse(img, (256, 320), (40, 15), 0, 0, 180, (200, 100, 100), -1)
-        
-        # Save the image
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, img)
-        logger.info(f"Created default avatar at {output_path}")
-    
-    def audio_base64_to_file(self, audio_base64: str, output_path: str):
-        """Convert base64 audio to file"""
-        try:
-            # Decode base64 audio
-            audio_data = base64.b64decode(audio_base64)
-            
-            # Write to temporary file
-            with open(output_path, 'wb') as f:
-                f.write(audio_data)
-            
-            # Convert to WAV format for better compatibility
-            wav_path = output_path.replace('.mp3', '.wav').replace('.m4a', '.wav')
-            audio = AudioSegment.from_file(output_path)
-            audio.export(wav_path, format="wav")
-            
-            return wav_path
-        except Exception as e:
-            logger.error(f"Error converting audio: {str(e)}")
-            raise
+        return img
     
-    def create_basic_talking_video(self, avatar_image_path: str, audio_path: str, output_path: str):
+    def create_basic_talking_video(self, avatar_image_path: str, audio: DecodedAudio, output_path: str,
+                                   speech_timing: SpeechTiming = None, quality: RenderQuality = FINAL):
         """Create a basic talking avatar video using simple animation"""
         try:
-            # Load the avatar image
-            avatar = cv2.imread(avatar_image_path)
-            if avatar is None:
-                raise ValueError(f"Could not load avatar image from {avatar_image_path}")
+            # Mouth keyframes are rendered once per avatar and reused across requests
+            sprites = get_talking_head_sprites(avatar_image_path, BASIC_MOUTH, max_offset=(5, 3), scale=quality.scale)
             
-            # Get audio duration
-            audio = AudioSegment.from_file(audio_path)
-            duration_seconds = len(audio) / 1000.0
+            # Get audio duration (known up front when the TTS timing track was supplied)
+            if speech_timing is not None:
+                duration_seconds = speech_timing.duration_seconds
+            else:
+                duration_seconds = audio.duration_seconds
             
             # Video parameters
-            fps = 30
+            fps = quality.frame_rate(30)
             total_frames = int(duration_seconds * fps)
-            height, width = avatar.shape[:2]
+            # Animation phase in 30 fps frames, so the motion speed does not depend on the frame rate
+            frame_nums = np.arange(total_frames) * (30 / fps)
             
-            # Create video writer
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-            
-            # Generate frames with simple mouth animation
-            for frame_num in range(total_frames):
-                current_frame = avatar.copy()
-                
-                # Simple mouth animation based on frame number
-                # This creates a basic opening/closing mouth effect
-                mouth_open_factor = abs(np.sin(frame_num * 0.5)) * 0.5 + 0.2
-                
-                # Animate mouth area (simple approach)
-                mouth_center = (width // 2, int(height * 0.625))  # Approximate mouth position
-                mouth_width = int(40 * (1 + mouth_open_factor))
-                mouth_height = int(15 * (1 + mouth_open_factor * 2))
-                
-                # Draw animated mouth
-                cv2.ellipse(current_frame, mouth_center, (mouth_width, mouth_height), 
-                           0, 0, 180, (150, 80, 80), -1)
-                
-                # Add slight head movement
-                shift_x = int(5 * np.sin(frame_num * 0.1))
-                shift_y = int(3 * np.cos(frame_num * 0.15))
-                
-                # Apply slight movement (simple translation)
-                M = np.float32([[1, 0, shift_x], [0, 1, shift_y]])
-                current_frame = cv2.warpAffine(current_frame, M, (width, height))
-                
-                video_writer.write(current_frame)
+            # Simple mouth animation based on frame number
+            # This creates a basic opening/closing mouth effect
+            if speech_timing is not None:
+                mouth_open_factor = speech_timing.mouth_openness(fps)[:total_frames] * 0.5 + 0.2
+            else:
+                mouth_open_factor = np.abs(np.sin(frame_nums * 0.5)) * 0.5 + 0.2
             
-            video_writer.release()
+            # Add slight head movement (truncated like int() to whole pixels)
+            shift_x = (5 * np.sin(frame_nums * 0.1)).astype(np.int32)
+            shift_y = (3 * np.cos(frame_nums * 0.15)).astype(np.int32)
             
-            # Combine video with audio using ffmpeg
+            # Stream frames straight into ffmpeg, which muxes the audio in the same pass
             final_output = output_path.replace('.mp4', '_final.mp4')
-            self.combine_video_audio(output_path, audio_path, final_output)
+            video_writer = FFmpegFrameWriter(final_output, sprites.width, sprites.height, fps,
+                                             audio_path=audio.source_path, **quality.encoder_settings(),
+                                             expected_frames=total_frames)
+            
+            with video_writer:
+                for frame in sprites.frames(mouth_open_factor, shift_x, shift_y):
+                    video_writer.write(frame)
             
             return final_output
             
@@ -153,68 +134,91 @@ class AvatarVideoGenerator:
                 'ffmpeg', '-y',  # -y to overwrite output file
                 '-i', video_path,
                 '-i', audio_path,
-                '-c:v', 'libx264',
+                '-c:v', 'libx264', *ffmpeg_thread_args(),
                 '-c:a', 'aac',
                 '-shortest',  # End when shortest input ends
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode != 0:
-                logger.error(f"FFmpeg error: {result.stderr}")
-                raise RuntimeError(f"FFmpeg failed: {result.stderr}")
+            run_ffmpeg_for_job(cmd, duration_seconds=media_duration_seconds(video_path), timeout=300)
             
             logger.info(f"Successfully combined video and audio: {output_path}")
             
-        except subprocess.TimeoutExpired:
-            logger.error("FFmpeg timeout")
-            raise RuntimeError("Video generation timed out")
         except Exception as e:
             logger.error(f"Error combining video and audio: {str(e)}")
             raise
     
-    def generate_avatar_video(self, audio_base64: str, avatar_image_path: str = None):
+    def generate_avatar_video(self, audio_base64: str, avatar_image_path: str = None,
+                              word_timings: list = None, audio_duration_seconds: float = None,
+                              quality: str = "final", return_base64: bool = False):
         """Main method to generate avatar video from base64 audio"""
         try:
+            render_quality = get_render_quality(quality)
+            
             # Generate unique ID for this request
             request_id = str(uuid.uuid4())[:8]
             
             # Use default avatar if none provided
             if avatar_image_path is None:
-                avatar_image_path = str(self.assets_dir / "default-avatar.jpg")
-            
-            # Create temporary files
-            temp_audio_path = str(self.temp_dir / f"audio_{request_id}.mp3")
-            temp_video_path = str(self.temp_dir / f"video_{request_id}.mp4")
+                avatar_image_path = self.ensure_default_avatar()
+            
+            # Temporary files live in the job's own directory, removed even if rendering fails
+            with render_workspaces.job(f"avatar-{request_id}") as workdir:
+                # The MP3 is muxed as-is and decoded at most once, no WAV round trip
+                audio_bytes = base64.b64decode(audio_base64)
+                audio = DecodedAudio.from_bytes(audio_bytes, str(workdir / "audio.mp3"))
+                speech_timing = None
+                if word_timings:
+                    speech_timing = SpeechTiming.from_payload(audio_bytes, word_timings, audio_duration_seconds)
+                
+                result = self.render_avatar_video(request_id, audio, avatar_image_path, speech_timing,
+                                                  render_quality, return_base64, workdir)
+                
+                # Keep the preview's inputs so it can be promoted to a final render
+                if render_quality.is_preview:
+                    render_plan_store.save_render_inputs(request_id, "avatar", audio, speech_timing,
+                                                         avatar_image_path, copy_avatar=False)
             
-            # Convert audio from base64 to file
-            wav_audio_path = self.audio_base64_to_file(audio_base64, temp_audio_path)
+            return result
             
+        except Exception as e:
+            logger.error(f"Error generating avatar video: {str(e)}")
+            raise
+    
+    def promote_avatar_video(self, request_id: str, return_base64: bool = False):
+        """Render a previewed avatar video at final quality from its saved render plan"""
+        inputs = render_plan_store.load_render_inputs(request_id)
+        if inputs is None:
+            raise KeyError(f"No render plan for preview {request_id}")
+        
+        result = self.render_avatar_video(request_id, inputs["audio"], inputs["avatar_path"],
+                                          inputs["speech_timing"], FINAL, return_base64)
+        render_plan_store.discard(request_id)
+        return result
+    
+    def render_avatar_video(self, request_id: str, audio: DecodedAudio, avatar_image_path: str,
+                            speech_timing: SpeechTiming = None, quality: RenderQuality = FINAL,
+                            return_base64: bool = False, workdir: Path = None):
+        """Render the talking video for prepared inputs into the video store (in workdir if given)"""
+        with render_workspaces.job(f"avatar-{request_id}-{quality.name}", workdir) as workdir:
             # Generate the talking video
             final_video_path = self.create_basic_talking_video(
-                avatar_image_path, wav_audio_path, temp_video_path
+                avatar_image_path, audio, str(workdir / "video.mp4"), speech_timing, quality
             )
             
-            # Get video duration before cleanup
+            # Get video duration before the file moves into the store
             duration_seconds = self.get_video_duration(final_video_path)
             
-            # Convert video to base64 for return
-            with open(final_video_path, 'rb') as video_file:
-                video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
-            
-            # Cleanup temporary files
-            self.cleanup_temp_files([temp_audio_path, wav_audio_path, temp_video_path, final_video_path])
-            
-            return {
-                "video_base64": video_base64,
-                "duration_seconds": duration_seconds,
-                "request_id": request_id
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating avatar video: {str(e)}")
-            raise
+            # Store under the hash of the render inputs; base64 only when explicitly asked for
+            video_id = render_key("avatar", audio.source_path, avatar_image_path, quality.name, speech_timing)
+            stored_video = video_store.publish(video_id, final_video_path, return_base64)
+        
+        return {
+            **stored_video,
+            "duration_seconds": duration_seconds,
+            "request_id": request_id,
+            "quality": quality.name
+        }
     
     def get_video_duration(self, video_path: str):
         """Get video duration in seconds"""
@@ -227,15 +231,6 @@ class AvatarVideoGenerator:
             return duration
         except:
             return 0
-    
-    def cleanup_temp_files(self, file_paths):
-        """Clean up temporary files"""
-        for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                logger.warning(f"Could not cleanup file {file_path}: {str(e)}")
 
 # Global instance
 avatar_generator = AvatarVideoGenerator()
\ No newline at end of file
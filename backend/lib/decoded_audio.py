@@ -0,0 +1,106 @@
+"""
+Decoded Audio
+Request audio decoded once into an in-memory mono PCM buffer that every
+stage of the video pipelines shares (duration, lip-sync envelope, WAV export)
+"""
+
+import base64
+import logging
+import subprocess
+import wave
+from functools import cached_property
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 24 kHz is the edge-tts output rate and divides evenly into 24/25/30/60 fps frames
+DEFAULT_SAMPLE_RATE = 24000
+
+
+class DecodedAudio:
+    """
+    An encoded audio file on disk plus its decoded PCM samples.
+
+    The encoded file is kept as-is for ffmpeg to mux, and is decoded at most
+    once (lazily, on first use of the samples) with a single ffmpeg call
+    into mono float32 samples in [-1, 1].
+    """
+
+    def __init__(self, source_path: str, sample_rate: int = DEFAULT_SAMPLE_RATE):
+        self.source_path = source_path
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_bytes(cls, audio_bytes: bytes, output_path: str,
+                   sample_rate: int = DEFAULT_SAMPLE_RATE) -> "DecodedAudio":
+        """Write encoded audio bytes to output_path and wrap them"""
+        with open(output_path, 'wb') as f:
+            f.write(audio_bytes)
+        return cls(output_path, sample_rate)
+
+    @classmethod
+    def from_base64(cls, audio_base64: str, output_path: str,
+                    sample_rate: int = DEFAULT_SAMPLE_RATE) -> "DecodedAudio":
+        return cls.from_bytes(base64.b64decode(audio_base64), output_path, sample_rate)
+
+    @classmethod
+    def with_samples(cls, source_path: str, samples: np.ndarray,
+                     sample_rate: int = DEFAULT_SAMPLE_RATE) -> "DecodedAudio":
+        """Wrap an encoded file whose samples were already decoded (e.g. kept from a preview render)"""
+        audio = cls(source_path, sample_rate)
+        audio.__dict__["samples"] = samples
+        return audio
+
+    @cached_property
+    def samples(self) -> np.ndarray:
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', self.source_path,
+            '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-ac', '1', '-ar', str(self.sample_rate),
+            'pipe:1'
+        ]
+        result = subprocess.run(cmd, capture_output=True, timeout=120)
+        if result.returncode != 0:
+            stderr = result.stderr.decode('utf-8', errors='replace').strip()
+            logger.error(f"FFmpeg error decoding audio: {stderr}")
+            raise RuntimeError(f"Could not decode audio {self.source_path}: {stderr}")
+
+        pcm = np.frombuffer(result.stdout, dtype=np.int16)
+        return pcm.astype(np.float32) / 32768.0
+
+    @property
+    def duration_seconds(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+    def rms_envelope(self, fps: int) -> np.ndarray:
+        """
+        Per-video-frame RMS loudness, normalized so the loudest frame is 1.0.
+
+        The samples are padded to a whole number of frames and reshaped to
+        (frames, samples_per_frame), so the whole envelope is one vectorized
+        reduction.
+        """
+        samples_per_frame = max(1, int(round(self.sample_rate / fps)))
+        total_frames = int(np.ceil(len(self.samples) / samples_per_frame))
+        if total_frames == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        padded = np.zeros(total_frames * samples_per_frame, dtype=np.float32)
+        padded[:len(self.samples)] = self.samples
+        frames = padded.reshape(total_frames, samples_per_frame)
+
+        envelope = np.sqrt(np.mean(np.square(frames), axis=1))
+        peak = envelope.max()
+        return envelope / peak if peak > 0 else envelope
+
+    def write_wav(self, output_path: str) -> str:
+        """Write the decoded samples as 16-bit mono WAV for tools that need one"""
+        pcm = np.clip(self.samples * 32768.0, -32768, 32767).astype('<i2')
+        with wave.open(output_path, 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(pcm.tobytes())
+        return output_path
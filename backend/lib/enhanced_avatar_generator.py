@@ -12,7 +12,6 @@ import uuid
 from pathlib import Path
 import cv2
 import numpy as np
-from pydub import AudioSegment
 import base64
 import logging
 from typing import Optional, Dict, Any, List
@@ -21,24 +20,52 @@ import concurrent.futures
 from PIL import Image, ImageDraw, ImageFont
 import json
 import re
+import shutil
+from functools import cached_property
+from lib.asset_manifest import asset_manifest
+from lib.audio_timing import SpeechTiming, sentence_timeline
+from lib.background_compositor import (BackgroundSegment, build_background_filter, compositing_mask, mask_path_for,
+                                       render_foreground_mask, segments_from_script)
+from lib.decoded_audio import DecodedAudio
+from lib.ffmpeg_renderer import FFmpegFrameWriter, ffmpeg_thread_args
+from lib.ffmpeg_runner import run_ffmpeg_for_job, media_duration_seconds
+from lib.frame_synthesis import MouthStyle, get_talking_head_sprites
+from lib.lipsync_worker import lipsync_worker_client
+from lib.render_plans import render_plan_store
+from lib.render_quality import RenderQuality, FINAL, get_render_quality
+from lib.render_workspace import render_workspaces
+from lib.video_store import video_store, render_key
 
 logger = logging.getLogger(__name__)
 
+# Mouth drawn over the detected face area by the fallback animation
+ENHANCED_MOUTH = MouthStyle(center=(0.5, 0.7), width=30, width_gain=30, height=12, height_gain=18,
+                            color=(120, 60, 60))
+
+# Gradient backgrounds for different contexts
+BACKGROUND_COLORS = {
+    "office": (240, 240, 255),  # Light blue
+    "nature": (200, 255, 200),  # Light green
+    "studio": (250, 250, 250),  # Light gray
+    "tech": (220, 220, 240),    # Light purple
+    "education": (255, 250, 200) # Light yellow
+}
+
 class EnhancedAvatarGenerator:
     def __init__(self):
         self.assets_dir = Path("/app/assets")
-        self.temp_dir = Path("/app/tmp/avatar_videos")
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
         self.sadtalker_dir = Path("/app/SadTalker")
         
-        # Check if SadTalker is available
-        self.sadtalker_available = self.check_sadtalker_availability()
-        
-        # Initialize AI models
-        self.setup_ai_models()
-        
-        # Ensure we have default resources
-        self.ensure_default_resources()
+        # Model availability is probed on first use, and assets are rendered on
+        # demand through the asset manifest, so constructing this is cheap
+    
+    @cached_property
+    def sadtalker_available(self) -> bool:
+        return self.check_sadtalker_availability()
+    
+    @cached_property
+    def bg_generator_available(self) -> bool:
+        return self.setup_ai_models()
     
     def check_sadtalker_availability(self) -> bool:
         """Check if SadTalker is properly installed and available"""
@@ -62,37 +89,36 @@ class EnhancedAvatarGenerator:
             logger.error(f"Error checking SadTalker availability: {str(e)}")
             return False
     
-    def setup_ai_models(self):
-        """Initialize AI models for avatar and background generation"""
+    def setup_ai_models(self) -> bool:
+        """Initialize AI models for avatar and background generation; returns whether they are usable"""
         try:
             # Try to import and setup diffusion models for background generation
             try:
                 from diffusers import StableDiffusionPipeline
                 # We'll implement this later when we have the models
-                self.bg_generator_available = False
                 logger.info("Background generation models not yet initialized")
+                return False
             except ImportError:
-                self.bg_generator_available = False
                 logger.warning("Diffusion models not available, using fallback background generation")
+                return False
                 
         except Exception as e:
             logger.error(f"Error setting up AI models: {str(e)}")
-            self.bg_generator_available = False
-    
-    def ensure_default_resources(self):
-        """Create default avatar and background resources"""
-        # Create default avatar
-        default_avatar_path = self.assets_dir / "default-avatar.jpg"
-        if not default_avatar_path.exists():
-            self.create_realistic_default_avatar(str(default_avatar_path))
-        
-        # Create default backgrounds
-        self.create_default_backgrounds()
+            return False
     
     def create_realistic_default_avatar(self, output_path: str):
         """Create a more realistic default avatar using improved graphics"""
+        img = self.draw_realistic_default_avatar()
+        
+        # Save the image
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, img)
+        logger.info(f"Created realistic default avatar at {output_path}")
+    
+    def draw_realistic_default_avatar(self, backdrop: int = 245) -> np.ndarray:
+        """The realistic default avatar drawn over a plain backdrop of the given grey level"""
         # Create a higher resolution image
-        img = np.ones((512, 512, 3), dtype=np.uint8) * 245  # Light background
+        img = np.ones((512, 512, 3), dtype=np.uint8) * backdrop  # Light background
         
         # Create a more realistic face
         center = (256, 256)
@@ -144,30 +170,11 @@ class EnhancedAvatarGenerator:
         # Hair (simple)
         hair_pts = np.array([[100, 100], [412, 100], [380, 180], [132, 180]], np.int32)
         cv2.fillPoly(img, [hair_pts], (101, 67, 33))
-        
-        # Save the image
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, img)
-        logger.info(f"Created realistic default avatar at {output_path}")
+        return img
     
-    def create_default_backgrounds(self):
-        """Create default background images for different contexts"""
-        backgrounds_dir = self.assets_dir / "backgrounds"
-        backgrounds_dir.mkdir(exist_ok=True)
-        
-        # Create different background types
-        backgrounds = {
-            "office": (240, 240, 255),  # Light blue
-            "nature": (200, 255, 200),  # Light green
-            "studio": (250, 250, 250),  # Light gray
-            "tech": (220, 220, 240),    # Light purple
-            "education": (255, 250, 200) # Light yellow
-        }
-        
-        for bg_name, color in backgrounds.items():
-            bg_path = backgrounds_dir / f"{bg_name}.jpg"
-            if not bg_path.exists():
-                self.create_gradient_background(str(bg_path), color)
+    def render_background(self, output_path: str, background_type: str):
+        """Render the gradient background for a context (asset manifest generator)"""
+        self.create_gradient_background(output_path, BACKGROUND_COLORS[background_type])
     
     def create_gradient_background(self, output_path: str, base_color: tuple):
         """Create a gradient background image"""
@@ -182,48 +189,59 @@ class EnhancedAvatarGenerator:
         cv2.imwrite(output_path, img)
         logger.info(f"Created gradient background at {output_path}")
     
-    def generate_ai_avatar_image(self, description: str = "professional person") -> str:
-        """Generate an AI avatar image (placeholder implementation)"""
+    def generate_ai_avatar_image(self, output_dir: Path, description: str = "professional person") -> str:
+        """Generate an AI avatar image in output_dir (placeholder implementation)"""
         # For now, create a variation of the default avatar
         # In a full implementation, this would use AI image generation
         
-        request_id = str(uuid.uuid4())[:8]
-        avatar_path = str(self.temp_dir / f"ai_avatar_{request_id}.jpg")
+        avatar_path = str(Path(output_dir) / "ai_avatar.jpg")
         
-        # Create a slightly different version of the default avatar
-        self.create_realistic_default_avatar(avatar_path)
-        
-        # Add some variation based on description
-        img = cv2.imread(avatar_path)
-        
-        # Simple variations based on description
-        if "professional" in description.lower():
-            # Add suit-like collar
-            cv2.rectangle(img, (200, 450), (312, 512), (50, 50, 100), -1)
-        elif "casual" in description.lower():
-            # Add casual shirt
-            cv2.rectangle(img, (200, 450), (312, 512), (100, 150, 200), -1)
+        def draw(backdrop: int = 245) -> np.ndarray:
+            # Create a slightly different version of the default avatar
+            img = self.draw_realistic_default_avatar(backdrop)
+            
+            # Simple variations based on description
+            if "professional" in description.lower():
+                # Add suit-like collar
+                cv2.rectangle(img, (200, 450), (312, 512), (50, 50, 100), -1)
+            elif "casual" in description.lower():
+                # Add casual shirt
+                cv2.rectangle(img, (200, 450), (312, 512), (100, 150, 200), -1)
+            return img
         
-        cv2.imwrite(avatar_path, img)
+        # Drawn procedurally, so it gets a foreground mask for compositing like the shipped avatars
+        cv2.imwrite(avatar_path, draw())
+        cv2.imwrite(mask_path_for(avatar_path), render_foreground_mask(draw))
         logger.info(f"Generated AI avatar at {avatar_path}")
         return avatar_path
     
-    def parse_script_for_backgrounds(self, script: str) -> List[Dict[str, Any]]:
-        """Parse script into segments and determine appropriate backgrounds"""
+    def parse_script_for_backgrounds(self, script: str, audio: Optional[DecodedAudio] = None,
+                                     speech_timing: Optional[SpeechTiming] = None) -> List[Dict[str, Any]]:
+        """Parse script into segments and determine appropriate backgrounds, timed against the spoken audio"""
         # Split script into sentences
         sentences = re.split(r'[.!?]+', script)
         sentences = [s.strip() for s in sentences if s.strip()]
         
+        # Sentence timing from the TTS word track, or from pauses in the decoded audio
+        if speech_timing is not None:
+            spans = sentence_timeline(sentences, speech_timing.duration_seconds, words=speech_timing.words)
+        elif audio is not None:
+            spans = sentence_timeline(sentences, audio.duration_seconds,
+                                      envelope=audio.rms_envelope(30), envelope_rate=30)
+        else:
+            spans = [(i * 3, i * 3 + 3) for i in range(len(sentences))]  # Approximate timing
+        
         segments = []
-        for i, sentence in enumerate(sentences):
+        for sentence, (start, end) in zip(sentences, spans):
             # Analyze sentence content to determine background
             bg_type = self.determine_background_type(sentence)
             
             segments.append({
                 "text": sentence,
                 "background_type": bg_type,
-                "start_time": i * 3,  # Approximate timing
-                "duration": 3
+                "background_path": self.generate_background_image(bg_type, sentence),
+                "start_time": start,
+                "duration": round(end - start, 3)
             })
         
         return segments
@@ -258,27 +276,35 @@ class EnhancedAvatarGenerator:
         # For now, use pre-created backgrounds
         # In a full implementation, this would use AI image generation
         
-        backgrounds_dir = self.assets_dir / "backgrounds"
-        bg_path = backgrounds_dir / f"{background_type}.jpg"
-        
-        if bg_path.exists():
-            return str(bg_path)
-        else:
+        if background_type not in BACKGROUND_COLORS:
             # Fallback to studio background
-            return str(backgrounds_dir / "studio.jpg")
+            background_type = "studio"
+        return asset_manifest.ensure(f"backgrounds/{background_type}.jpg")
     
     def create_talking_video_with_sadtalker(self, image_path: str, audio_path: str, output_path: str) -> str:
-        """Create talking video using SadTalker"""
+        """Create talking video using SadTalker (raises so the caller can fall back)"""
+        result_dir = None
         try:
             if not self.sadtalker_available:
                 raise RuntimeError("SadTalker is not available")
             
+            # The warm worker has the models loaded and the avatar's face crop cached
+            if lipsync_worker_client.available():
+                try:
+                    return lipsync_worker_client.render(image_path, audio_path, output_path)
+                except Exception as e:
+                    logger.warning(f"Lip-sync worker failed, running SadTalker directly: {str(e)}")
+            
+            # SadTalker writes into a timestamped folder under its result dir; give it a
+            # private one next to the output so concurrent jobs never see each other's results
+            result_dir = Path(tempfile.mkdtemp(prefix="sadtalker-", dir=Path(output_path).parent))
+            
             # Prepare SadTalker command
             cmd = [
                 sys.executable, "inference.py",
-                "--driven_audio", audio_path,
-                "--source_image", image_path,
-                "--result_dir", str(self.temp_dir),
+                "--driven_audio", os.path.abspath(audio_path),
+                "--source_image", os.path.abspath(image_path),
+                "--result_dir", str(result_dir.resolve()),
                 "--still",
                 "--preprocess", "crop",
                 "--size", "256"
@@ -298,185 +324,235 @@ class EnhancedAvatarGenerator:
                 raise RuntimeError(f"SadTalker failed: {result.stderr}")
             
             # Find the generated video
-            result_dirs = [d for d in self.temp_dir.iterdir() if d.is_dir()]
-            if result_dirs:
-                latest_dir = max(result_dirs, key=lambda x: x.stat().st_mtime)
-                video_files = list(latest_dir.glob("*.mp4"))
-                if video_files:
-                    generated_video = video_files[0]
-                    # Move to our output path
-                    subprocess.run(["mv", str(generated_video), output_path], check=True)
-                    return output_path
+            video_files = sorted(result_dir.rglob("*.mp4"))
+            if video_files:
+                # Move to our output path
+                shutil.move(str(video_files[0]), output_path)
+                return output_path
             
             raise RuntimeError("No video generated by SadTalker")
             
         except Exception as e:
             logger.error(f"Error with SadTalker: {str(e)}")
-            # Fallback to basic animation
-            return self.create_basic_talking_video(image_path, audio_path, output_path)
+            raise
+        finally:
+            if result_dir is not None:
+                shutil.rmtree(result_dir, ignore_errors=True)
     
-    def create_basic_talking_video(self, image_path: str, audio_path: str, output_path: str) -> str:
-        """Create basic talking video as fallback"""
+    def create_basic_talking_video(self, image_path: str, audio: DecodedAudio, output_path: str,
+                                   speech_timing: Optional[SpeechTiming] = None,
+                                   background_segments: Optional[List[BackgroundSegment]] = None,
+                                   quality: RenderQuality = FINAL, mask_path: Optional[str] = None) -> str:
+        """
+        Create basic talking video as fallback, encoded with its audio in a single ffmpeg pass.
+        With background segments and the avatar's foreground mask, the avatar is composited
+        over them in the same encode.
+        """
         try:
-            # Load the image
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError(f"Could not load image from {image_path}")
-            
-            # Get audio duration
-            audio = AudioSegment.from_file(audio_path)
-            duration_seconds = len(audio) / 1000.0
+            if mask_path is None:
+                background_segments = None
+            
+            # Mouth keyframes are rendered once per image; only shipped assets are kept cached
+            sprites = get_talking_head_sprites(image_path, ENHANCED_MOUTH, max_offset=(3, 2),
+                                               cache=Path(image_path).is_relative_to(self.assets_dir),
+                                               scale=quality.scale,
+                                               mask_path=mask_path if background_segments else None)
+            
+            # Get audio duration (known up front when the TTS timing track was supplied)
+            if speech_timing is not None:
+                duration_seconds = speech_timing.duration_seconds
+            else:
+                duration_seconds = audio.duration_seconds
             
             # Video parameters
-            fps = 30
+            fps = quality.frame_rate(30)
             total_frames = int(duration_seconds * fps)
-            height, width = img.shape[:2]
+            time_factor = np.arange(total_frames) / fps
             
-            # Create video writer
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+            # More sophisticated mouth animation
+            if speech_timing is not None:
+                mouth_open_factor = speech_timing.mouth_openness(fps)[:total_frames] * 0.6 + 0.2
+            else:
+                mouth_open_factor = np.abs(np.sin(time_factor * 8)) * 0.6 + 0.2
             
-            # Generate frames with enhanced mouth animation
-            for frame_num in range(total_frames):
-                current_frame = img.copy()
-                
-                # More sophisticated mouth animation
-                time_factor = frame_num / fps
-                mouth_open_factor = abs(np.sin(time_factor * 8)) * 0.6 + 0.2
-                
-                # Detect face area for mouth animation
-                mouth_center = (width // 2, int(height * 0.7))
-                mouth_width = int(30 * (1 + mouth_open_factor))
-                mouth_height = int(12 * (1 + mouth_open_factor * 1.5))
-                
-                # Draw animated mouth
-                cv2.ellipse(current_frame, mouth_center, (mouth_width, mouth_height), 
-                           0, 0, 360, (120, 60, 60), -1)
-                
-                # Add subtle head movement
-                shift_x = int(3 * np.sin(time_factor * 2))
-                shift_y = int(2 * np.cos(time_factor * 1.5))
-                
-                # Apply movement
-                M = np.float32([[1, 0, shift_x], [0, 1, shift_y]])
-                current_frame = cv2.warpAffine(current_frame, M, (width, height))
-                
-                video_writer.write(current_frame)
+            # Add subtle head movement (truncated like int() to whole pixels)
+            shift_x = (3 * np.sin(time_factor * 2)).astype(np.int32)
+            shift_y = (2 * np.cos(time_factor * 1.5)).astype(np.int32)
+            
+            background_inputs, background_filter = [], None
+            if background_segments:
+                background_inputs, background_filter = build_background_filter(
+                    background_segments, sprites.width, sprites.height, fps, first_input=2
+                )
+            
+            # Stream frames straight into ffmpeg, which muxes the audio in the same pass
+            video_writer = FFmpegFrameWriter(output_path, sprites.width, sprites.height, fps,
+                                             audio_path=audio.source_path, **quality.encoder_settings(),
+                                             extra_inputs=background_inputs, filter_complex=background_filter,
+                                             expected_frames=total_frames,
+                                             pixel_format="bgra" if sprites.channels == 4 else "bgr24")
+            
+            with video_writer:
+                for frame in sprites.frames(mouth_open_factor, shift_x, shift_y):
+                    video_writer.write(frame)
             
-            video_writer.release()
             return output_path
             
         except Exception as e:
             logger.error(f"Error creating basic talking video: {str(e)}")
             raise
     
-    def combine_video_with_backgrounds(self, avatar_video_path: str, audio_path: str, 
-                                     script_segments: List[Dict], output_path: str) -> str:
-        """Combine avatar video with changing backgrounds"""
+    def combine_video_with_audio(self, avatar_video_path: str, audio_path: str, output_path: str) -> str:
+        """
+        Mux the audio into the SadTalker video. Its frames come with no
+        foreground mask, so the script backgrounds are not composited under it.
+        """
         try:
-            # For now, we'll use a simple approach
-            # In a full implementation, this would composite the avatar over different backgrounds
-            
-            # Just return the avatar video for now
-            # TODO: Implement background compositing
-            
-            # Combine with audio
             final_output = output_path.replace('.mp4', '_final.mp4')
+            
             cmd = [
                 'ffmpeg', '-y',
                 '-i', avatar_video_path,
                 '-i', audio_path,
-                '-c:v', 'libx264',
+                '-c:v', 'libx264', *ffmpeg_thread_args(),
                 '-c:a', 'aac',
                 '-shortest',
                 final_output
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-            
-            if result.returncode != 0:
-                logger.error(f"FFmpeg error: {result.stderr}")
-                raise RuntimeError(f"FFmpeg failed: {result.stderr}")
+            run_ffmpeg_for_job(cmd, duration_seconds=media_duration_seconds(avatar_video_path), timeout=300)
             
             return final_output
             
         except Exception as e:
-            logger.error(f"Error combining video with backgrounds: {str(e)}")
+            logger.error(f"Error combining video with audio: {str(e)}")
             raise
     
     def generate_enhanced_avatar_video(self, audio_base64: str, avatar_option: str = "default",
-                                     user_image_base64: str = None, script_text: str = "") -> Dict[str, Any]:
+                                     user_image_base64: str = None, script_text: str = "",
+                                     word_timings: Optional[List[Dict[str, Any]]] = None,
+                                     audio_duration_seconds: Optional[float] = None,
+                                     quality: str = "final", return_base64: bool = False) -> Dict[str, Any]:
         """Main method to generate enhanced avatar video"""
         try:
+            render_quality = get_render_quality(quality)
             request_id = str(uuid.uuid4())[:8]
-            logger.info(f"Starting enhanced avatar video generation (ID: {request_id})")
-            
-            # Convert audio from base64
-            temp_audio_path = str(self.temp_dir / f"audio_{request_id}.mp3")
-            wav_audio_path = self.audio_base64_to_file(audio_base64, temp_audio_path)
-            
-            # Determine avatar image
-            if avatar_option == "upload" and user_image_base64:
-                avatar_image_path = self.save_user_image(user_image_base64, request_id)
-            elif avatar_option == "ai_generated":
-                avatar_image_path = self.generate_ai_avatar_image("professional person")
-            else:
-                avatar_image_path = str(self.assets_dir / "default-avatar.jpg")
-            
-            # Parse script for background generation
-            script_segments = self.parse_script_for_backgrounds(script_text)
+            logger.info(f"Starting enhanced avatar video generation (ID: {request_id}, quality: {quality})")
+            
+            # Temporary files (audio, uploaded or generated avatar) live in the job's own
+            # directory, removed even if rendering fails
+            with render_workspaces.job(f"enhanced-{request_id}") as workdir:
+                # Decode the audio once; the MP3 is muxed as-is and a WAV is only written for SadTalker
+                audio_bytes = base64.b64decode(audio_base64)
+                audio = DecodedAudio.from_bytes(audio_bytes, str(workdir / "audio.mp3"))
+                speech_timing = None
+                if word_timings:
+                    speech_timing = SpeechTiming.from_payload(audio_bytes, word_timings, audio_duration_seconds)
+                
+                # Determine avatar image
+                if avatar_option == "upload" and user_image_base64:
+                    avatar_image_path = self.save_user_image(user_image_base64, workdir)
+                elif avatar_option == "ai_generated":
+                    avatar_image_path = self.generate_ai_avatar_image(workdir, "professional person")
+                else:
+                    asset_manifest.ensure(mask_path_for("default-avatar.jpg"))
+                    avatar_image_path = asset_manifest.ensure("default-avatar.jpg")
+                temporary_avatar = avatar_option == "upload" or avatar_option == "ai_generated"
+                
+                # Parse script for background generation
+                script_segments = self.parse_script_for_backgrounds(script_text, audio, speech_timing)
+                
+                result = self.render_enhanced_avatar_video(request_id, audio, avatar_image_path, avatar_option,
+                                                           script_segments, speech_timing, render_quality,
+                                                           return_base64, workdir)
+                
+                # Keep the preview's inputs so it can be promoted to a final render
+                if render_quality.is_preview:
+                    render_plan_store.save_render_inputs(request_id, "enhanced", audio, speech_timing,
+                                                         avatar_image_path, copy_avatar=temporary_avatar,
+                                                         avatar_option=avatar_option,
+                                                         script_segments=script_segments)
             
-            # Generate talking video
-            temp_video_path = str(self.temp_dir / f"avatar_{request_id}.mp4")
+            return result
             
-            if self.sadtalker_available:
-                avatar_video_path = self.create_talking_video_with_sadtalker(
-                    avatar_image_path, wav_audio_path, temp_video_path
+        except Exception as e:
+            logger.error(f"Error generating enhanced avatar video: {str(e)}")
+            raise
+    
+    def promote_enhanced_avatar_video(self, request_id: str, return_base64: bool = False) -> Dict[str, Any]:
+        """Render a previewed enhanced video at final quality from its saved render plan"""
+        inputs = render_plan_store.load_render_inputs(request_id)
+        if inputs is None:
+            raise KeyError(f"No render plan for preview {request_id}")
+        
+        params = inputs["params"]
+        result = self.render_enhanced_avatar_video(request_id, inputs["audio"], inputs["avatar_path"],
+                                                   params["avatar_option"], params["script_segments"],
+                                                   inputs["speech_timing"], FINAL, return_base64)
+        render_plan_store.discard(request_id)
+        return result
+    
+    def render_enhanced_avatar_video(self, request_id: str, audio: DecodedAudio, avatar_image_path: str,
+                                     avatar_option: str, script_segments: List[Dict[str, Any]],
+                                     speech_timing: Optional[SpeechTiming] = None,
+                                     quality: RenderQuality = FINAL, return_base64: bool = False,
+                                     workdir: Optional[Path] = None) -> Dict[str, Any]:
+        """Render the talking video for prepared inputs into the video store (in workdir if given)"""
+        avatar_video_path = None
+        background_segments = segments_from_script(script_segments, "background_path")
+        
+        with render_workspaces.job(f"enhanced-{request_id}-{quality.name}", workdir) as workdir:
+            # Previews always use the fast sprite animation
+            if self.sadtalker_available and not quality.is_preview:
+                try:
+                    avatar_video_path = self.create_talking_video_with_sadtalker(
+                        avatar_image_path, audio.write_wav(str(workdir / "audio.wav")), str(workdir / "avatar.mp4")
+                    )
+                except Exception:
+                    logger.warning("SadTalker failed, falling back to basic animation")
+            
+            if avatar_video_path is not None:
+                # SadTalker output has no foreground mask to composite it with
+                if background_segments:
+                    logger.info("SadTalker video has no foreground mask, skipping background segments")
+                background_segments = []
+                final_video_path = self.combine_video_with_audio(
+                    avatar_video_path, audio.source_path, str(workdir / "final.mp4")
                 )
             else:
-                avatar_video_path = self.create_basic_talking_video(
-                    avatar_image_path, wav_audio_path, temp_video_path
+                # Only avatars with a foreground mask (not uploads) are composited over the backgrounds
+                mask_path = compositing_mask(avatar_image_path, background_segments)
+                if mask_path is None:
+                    background_segments = []
+                # The basic renderer encodes video and audio together, nothing left to mux
+                final_video_path = self.create_basic_talking_video(
+                    avatar_image_path, audio, str(workdir / "final.mp4"), speech_timing,
+                    background_segments, quality, mask_path
                 )
             
-            # Combine with backgrounds
-            final_video_path = self.combine_video_with_backgrounds(
-                avatar_video_path, wav_audio_path, script_segments, 
-                str(self.temp_dir / f"final_{request_id}.mp4")
-            )
-            
             # Get video duration
             duration_seconds = self.get_video_duration(final_video_path)
             
-            # Convert to base64
-            with open(final_video_path, 'rb') as video_file:
-                video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
-            
-            # Cleanup
-            cleanup_files = [temp_audio_path, wav_audio_path, temp_video_path, 
-                           avatar_video_path, final_video_path]
-            if avatar_option == "upload" or avatar_option == "ai_generated":
-                cleanup_files.append(avatar_image_path)
-            
-            self.cleanup_temp_files(cleanup_files)
-            
-            return {
-                "video_base64": video_base64,
-                "duration_seconds": duration_seconds,
-                "request_id": request_id,
-                "avatar_option": avatar_option,
-                "script_segments": len(script_segments),
-                "sadtalker_used": self.sadtalker_available
-            }
-            
-        except Exception as e:
-            logger.error(f"Error generating enhanced avatar video: {str(e)}")
-            raise
+            # Store under the hash of the render inputs; base64 only when explicitly asked for
+            video_id = render_key("enhanced", audio.source_path, avatar_image_path, quality.name, speech_timing,
+                                  background_segments, sadtalker=avatar_video_path is not None)
+            stored_video = video_store.publish(video_id, final_video_path, return_base64)
+        
+        return {
+            **stored_video,
+            "duration_seconds": duration_seconds,
+            "request_id": request_id,
+            "avatar_option": avatar_option,
+            "script_segments": len(script_segments),
+            "sadtalker_used": avatar_video_path is not None,
+            "quality": quality.name
+        }
     
-    def save_user_image(self, image_base64: str, request_id: str) -> str:
-        """Save user uploaded image"""
+    def save_user_image(self, image_base64: str, output_dir: Path) -> str:
+        """Save user uploaded image in output_dir"""
         try:
             image_data = base64.b64decode(image_base64)
-            image_path = str(self.temp_dir / f"user_avatar_{request_id}.jpg")
+            image_path = str(Path(output_dir) / "user_avatar.jpg")
             
             with open(image_path, 'wb') as f:
                 f.write(image_data)
@@ -487,25 +563,6 @@ class EnhancedAvatarGenerator:
             logger.error(f"Error saving user image: {str(e)}")
             raise
     
-    def audio_base64_to_file(self, audio_base64: str, output_path: str) -> str:
-        """Convert base64 audio to file"""
-        try:
-            audio_data = base64.b64decode(audio_base64)
-            
-            with open(output_path, 'wb') as f:
-                f.write(audio_data)
-            
-            # Convert to WAV for better compatibility
-            wav_path = output_path.replace('.mp3', '.wav').replace('.m4a', '.wav')
-            audio = AudioSegment.from_file(output_path)
-            audio.export(wav_path, format="wav")
-            
-            return wav_path
-            
-        except Exception as e:
-            logger.error(f"Error converting audio: {str(e)}")
-            raise
-    
     def get_video_duration(self, video_path: str) -> float:
         """Get video duration in seconds"""
         try:
@@ -517,15 +574,6 @@ class EnhancedAvatarGenerator:
             return duration
         except:
             return 0
-    
-    def cleanup_temp_files(self, file_paths: List[str]):
-        """Clean up temporary files"""
-        for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                logger.warning(f"Could not cleanup file {file_path}: {str(e)}")
 
 # Global instance
 enhanced_avatar_generator = EnhancedAvatarGenerator()
\ No newline at end of file
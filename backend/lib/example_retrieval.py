@@ -0,0 +1,159 @@
+"""
+Example Retrieval Index
+TF-IDF index over the few-shot script examples for ranking them by textual
+similarity to a prompt, persisted to disk so startup does not refit it
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import sklearn
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+logger = logging.getLogger(__name__)
+
+# Bump when the pickled layout changes; older files are refitted instead of loaded
+INDEX_FORMAT = 1
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class ExampleRetrievalIndex:
+    """
+    Sparse TF-IDF rows for the examples, one per example id.
+
+    Rows are L2-normalized, so the cosine similarity of every example to a
+    query is a single sparse matrix-vector product. sync() keeps the index
+    in line with the current example set: new examples are transformed with
+    the fitted vocabulary and appended, while a changed or removed example,
+    or more than refit_ratio new rows since the last fit (the IDF weights
+    and vocabulary drift), refits from scratch. The index is saved to `path`
+    after every change and loaded from it on construction.
+    """
+
+    def __init__(self, path: Optional[Path] = None, max_features: int = 1000, refit_ratio: float = 0.25):
+        self.path = Path(path) if path else None
+        self.max_features = max_features
+        self.refit_ratio = refit_ratio
+
+        self.vectorizer: Optional[TfidfVectorizer] = None
+        self.matrix: Optional[sparse.csr_matrix] = None
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.text_hashes: Dict[str, str] = {}
+        self.fitted_rows = 0
+        self._lock = threading.Lock()
+
+        self.load()
+
+    def load(self) -> bool:
+        """Load the persisted index; returns False if there is none or it cannot be used"""
+        if self.path is None or not self.path.exists():
+            return False
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+            if state.get("format") != INDEX_FORMAT or state.get("sklearn") != sklearn.__version__:
+                logger.info(f"Ignoring example index {self.path} written by another version")
+                return False
+            self.vectorizer = state["vectorizer"]
+            self.matrix = state["matrix"]
+            self.ids = state["ids"]
+            self.text_hashes = state["text_hashes"]
+            self.fitted_rows = state["fitted_rows"]
+            self.rows = {example_id: row for row, example_id in enumerate(self.ids)}
+            logger.info(f"Loaded example index with {len(self.ids)} examples from {self.path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error loading example index from {self.path}: {str(e)}")
+            return False
+
+    def _save(self):
+        """Atomically write the index to its path"""
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump({
+                    "format": INDEX_FORMAT,
+                    "sklearn": sklearn.__version__,
+                    "vectorizer": self.vectorizer,
+                    "matrix": self.matrix,
+                    "ids": self.ids,
+                    "text_hashes": self.text_hashes,
+                    "fitted_rows": self.fitted_rows
+                }, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving example index to {self.path}: {str(e)}")
+
+    def _fit(self, documents: Dict[str, str]):
+        vectorizer = TfidfVectorizer(max_features=self.max_features, stop_words='english')
+        ids = list(documents)
+        self.matrix = vectorizer.fit_transform([documents[example_id] for example_id in ids]).tocsr()
+        self.vectorizer = vectorizer
+        self.ids = ids
+        self.rows = {example_id: row for row, example_id in enumerate(ids)}
+        self.text_hashes = {example_id: _text_hash(documents[example_id]) for example_id in ids}
+        self.fitted_rows = len(ids)
+        logger.info(f"Fitted example index on {len(ids)} examples ({len(vectorizer.vocabulary_)} terms)")
+
+    def _add(self, documents: Dict[str, str]):
+        ids = list(documents)
+        rows = self.vectorizer.transform([documents[example_id] for example_id in ids])
+        self.matrix = sparse.vstack([self.matrix, rows], format="csr")
+        for example_id in ids:
+            self.rows[example_id] = len(self.ids)
+            self.ids.append(example_id)
+            self.text_hashes[example_id] = _text_hash(documents[example_id])
+
+    def sync(self, documents: Dict[str, str]) -> bool:
+        """
+        Bring the index in line with the examples (id -> text); returns True
+        if it changed. Safe to call from several threads.
+        """
+        with self._lock:
+            if not documents:
+                return False
+            changed = [example_id for example_id in self.ids
+                       if _text_hash(documents[example_id]) != self.text_hashes[example_id]
+                       ] if set(self.ids) <= set(documents) else None
+            added = {example_id: text for example_id, text in documents.items() if example_id not in self.rows}
+
+            if changed == [] and not added:
+                return False
+            try:
+                needs_refit = (self.vectorizer is None or changed is None or changed
+                               or len(self.ids) + len(added) > self.fitted_rows * (1 + self.refit_ratio))
+                if needs_refit:
+                    self._fit(documents)
+                else:
+                    self._add(added)
+            except ValueError as e:
+                # e.g. every example is empty or only stop words: no vocabulary to fit
+                logger.warning(f"Example index not built: {str(e)}")
+                self.vectorizer, self.matrix, self.ids, self.rows, self.text_hashes = None, None, [], {}, {}
+                return False
+            self._save()
+            return True
+
+    def similarities(self, query: str, example_ids: List[str]) -> List[float]:
+        """Cosine similarity of each example to the query text (0.0 for examples not in the index)"""
+        with self._lock:
+            if self.vectorizer is None or not query:
+                return [0.0] * len(example_ids)
+            query_vector = self.vectorizer.transform([query])
+            scores = np.asarray((self.matrix @ query_vector.T).todense()).ravel()
+            return [float(scores[self.rows[example_id]]) if example_id in self.rows else 0.0
+                    for example_id in example_ids]
@@ -13,6 +13,7 @@ Key Features:
 
 import json
 import re
+import hashlib
 import logging
 from typing import Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass, asdict
@@ -25,15 +26,32 @@ from pathlib import Path
 import spacy
 from collections import Counter, defaultdict
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 # Database and AI imports
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DeleteMany, UpdateOne
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
+from .mongo_indexes import index_registry
+from .few_shot_store import FewShotStore
+from .example_retrieval import ExampleRetrievalIndex
+
 logger = logging.getLogger(__name__)
 
+# Examples are matched on any subset of video type, industry and platform; patterns on their contexts
+index_registry.index("script_examples", [("video_type", ASCENDING), ("industry", ASCENDING),
+                                         ("platform", ASCENDING)])
+index_registry.index("script_examples", [("industry", ASCENDING)])
+index_registry.index("script_examples", [("platform", ASCENDING)])
+index_registry.index("pattern_templates", [("applicable_contexts", ASCENDING)])
+
+index_registry.query("script_examples.context_match", "script_examples",
+                     {"video_type": "educational", "industry": "technology", "platform": "youtube"}, limit=10)
+index_registry.query("script_examples.by_industry", "script_examples", {"industry": "technology"})
+index_registry.query("script_examples.by_platform", "script_examples", {"platform": "youtube"})
+index_registry.query("pattern_templates.by_context", "pattern_templates",
+                     {"applicable_contexts": {"$in": ["youtube", "educational", "technology", "general"]}})
+
 @dataclass
 class ScriptExample:
     """High-performing script example with metadata"""
@@ -64,6 +82,13 @@ class PatternTemplate:
     usage_guidelines: Dict[str, str]
     created_at: datetime
 
+# Namespace of the pattern ids, which are derived from the pattern type and template name
+PATTERN_ID_NAMESPACE = uuid.UUID("6f1c2d0e-5b8a-4c3e-9a7d-2e4f8b1c6a90")
+
+def pattern_id(pattern_type: str, template_name: str) -> str:
+    """Stable id of a pattern, so re-extracting it updates the stored template instead of duplicating it"""
+    return str(uuid.uuid5(PATTERN_ID_NAMESPACE, f"{pattern_type}/{template_name}"))
+
 @dataclass
 class ContextProfile:
     """Context profile for dynamic example selection"""
@@ -86,18 +111,28 @@ class FewShotScriptGenerator:
     4. Applying learned patterns to new script generation
     """
     
-    def __init__(self, db: AsyncIOMotorDatabase, gemini_api_key: str):
+    def __init__(self, db: AsyncIOMotorDatabase, gemini_api_key: str, retrieval_index_path: Optional[Path] = None):
         self.db = db
         self.gemini_api_key = gemini_api_key
         self.nlp = None  # Will be loaded when needed
-        self.vectorizer = TfidfVectorizer(max_features=1000, stop_words='english')
         self.pattern_cache = {}
-        self.example_embeddings = {}
+        
+        # TF-IDF index of the example texts; prompt similarity (0-1) is weighted into the relevance score
+        self.retrieval_index = ExampleRetrievalIndex(retrieval_index_path)
+        self.prompt_similarity_weight = 5.0
+        self._retrieval_snapshot = None
         
         # Initialize collections
         self.examples_collection = db.script_examples
         self.patterns_collection = db.pattern_templates
         self.performance_collection = db.script_performance
+        self.metadata_collection = db.few_shot_metadata
+        
+        # In-memory copy of the examples and patterns that few-shot selection reads
+        self.store = FewShotStore(self.examples_collection, self.patterns_collection,
+                                  to_example=self._example_from_document,
+                                  to_pattern=self._pattern_from_document,
+                                  performance_score=self._performance_score)
         
     async def initialize(self):
         """Initialize the few-shot learning system"""
@@ -509,6 +544,7 @@ The smartest people I know don't have all the answers. They just ask questions t
             await self.examples_collection.insert_one(asdict(script_example))
             inserted_count += 1
         
+        await self.store.refresh()
         logger.info(f"✅ Successfully built example database with {inserted_count} high-performing scripts")
         
         return {
@@ -592,50 +628,50 @@ The smartest people I know don't have all the answers. They just ask questions t
             "complexity_level": "simple" if avg_sentence_length < 15 else "medium" if avg_sentence_length < 25 else "complex"
         }
     
-    async def select_relevant_examples(self, context: ContextProfile, limit: int = 5) -> List[ScriptExample]:
+    async def select_relevant_examples(self, context: ContextProfile, limit: int = 5,
+                                       prompt: Optional[str] = None) -> List[ScriptExample]:
         """
         Select most relevant examples based on context using intelligent matching
         
         Uses a combination of exact matching and similarity scoring to find
-        the best examples for the given context.
+        the best examples for the given context; with a prompt, candidates
+        also score by the TF-IDF cosine similarity of their text to it.
         """
-        # Build query for exact matches
-        query = {}
+        # Filters for exact matches
+        filters = {}
         
         # Primary matching criteria
         if context.video_type != "general":
-            query["video_type"] = context.video_type
+            filters["video_type"] = context.video_type
             
         if context.industry != "general":
-            query["industry"] = context.industry
+            filters["industry"] = context.industry
             
         if context.platform != "general":
-            query["platform"] = context.platform
+            filters["platform"] = context.platform
             
-        # Get examples from database
-        cursor = self.examples_collection.find(query).limit(limit * 2)  # Get more for scoring
-        examples = await cursor.to_list(length=None)
+        # Look up candidates in the in-memory store
+        snapshot = await self.store.get_snapshot()
+        positions = await self.store.find_examples(filters)
         
-        if not examples:
+        if not positions:
             # Fallback to broader search if no exact matches
-            cursor = self.examples_collection.find({}).limit(limit * 2)
-            examples = await cursor.to_list(length=None)
-        
-        # Convert to ScriptExample objects
-        script_examples = []
-        for example_data in examples:
-            # Handle MongoDB _id field - create a copy to avoid modifying original
-            example_copy = example_data.copy()
-            if '_id' in example_copy:
-                example_copy['id'] = str(example_copy['_id'])
-                del example_copy['_id']
-            script_example = ScriptExample(**example_copy)
-            script_examples.append(script_example)
-        
-        # Score examples based on context relevance
+            positions = await self.store.find_examples({})
+        
+        # Prompt similarity of every candidate, from one sparse matrix-vector product
+        similarities = [0.0] * len(positions)
+        if prompt:
+            await self._sync_retrieval_index(snapshot)
+            similarities = self.retrieval_index.similarities(
+                prompt, [snapshot.examples[position].id for position in positions]
+            )
+        
+        # Score examples based on context relevance (performance part precomputed at load)
         scored_examples = []
-        for example in script_examples:
-            score = self._calculate_relevance_score(example, context)
+        for position, similarity in zip(positions, similarities):
+            example = snapshot.examples[position]
+            score = self._calculate_relevance_score(example, context, snapshot.performance_scores[position])
+            score += similarity * self.prompt_similarity_weight
             scored_examples.append((example, score))
         
         # Sort by relevance score and return top examples
@@ -646,7 +682,41 @@ The smartest people I know don't have all the answers. They just ask questions t
         
         return top_examples
     
-    def _calculate_relevance_score(self, example: ScriptExample, context: ContextProfile) -> float:
+    async def _sync_retrieval_index(self, snapshot):
+        """Update the retrieval index once per store snapshot (fitting and saving run off the event loop)"""
+        if snapshot is self._retrieval_snapshot:
+            return
+        documents = {example.id: f"{example.title}\n{example.script_content}" for example in snapshot.examples}
+        await asyncio.get_running_loop().run_in_executor(None, self.retrieval_index.sync, documents)
+        self._retrieval_snapshot = snapshot
+    
+    def _example_from_document(self, example_data: Dict[str, Any]) -> ScriptExample:
+        # Handle MongoDB _id field - create a copy to avoid modifying original
+        example_copy = example_data.copy()
+        if '_id' in example_copy:
+            example_copy['id'] = str(example_copy['_id'])
+            del example_copy['_id']
+        return ScriptExample(**example_copy)
+    
+    def _pattern_from_document(self, pattern_data: Dict[str, Any]) -> PatternTemplate:
+        # Handle MongoDB _id field - create a copy to avoid modifying original
+        pattern_copy = pattern_data.copy()
+        if '_id' in pattern_copy:
+            pattern_copy['id'] = str(pattern_copy['_id'])
+            del pattern_copy['_id']
+        return PatternTemplate(**pattern_copy)
+    
+    def _performance_score(self, example: ScriptExample) -> float:
+        """Relevance bonus from an example's own performance metrics (independent of the context)"""
+        avg_performance = (
+            example.performance_metrics.get("engagement_rate", 0) +
+            example.performance_metrics.get("viral_score", 0) +
+            example.performance_metrics.get("retention_rate", 0) / 10  # Scale retention to 0-10
+        ) / 3
+        return avg_performance * 0.5
+    
+    def _calculate_relevance_score(self, example: ScriptExample, context: ContextProfile,
+                                   performance_score: Optional[float] = None) -> float:
         """Calculate relevance score for example based on context"""
         score = 0.0
         
@@ -661,12 +731,7 @@ The smartest people I know don't have all the answers. They just ask questions t
             score += 1.5
             
         # Performance metrics bonus
-        avg_performance = (
-            example.performance_metrics.get("engagement_rate", 0) +
-            example.performance_metrics.get("viral_score", 0) +
-            example.performance_metrics.get("retention_rate", 0) / 10  # Scale retention to 0-10
-        ) / 3
-        score += avg_performance * 0.5
+        score += self._performance_score(example) if performance_score is None else performance_score
         
         # Complexity matching
         if hasattr(context, 'complexity_level'):
@@ -681,42 +746,58 @@ The smartest people I know don't have all the answers. They just ask questions t
         
         return score
     
-    async def extract_patterns(self) -> Dict[str, Any]:
+    async def extract_patterns(self, force: bool = False) -> Dict[str, Any]:
         """
         Extract successful patterns from high-performing examples
         
         Analyzes structural, engagement, and platform-specific patterns
-        that contribute to script success.
+        that contribute to script success. Skipped when the examples are
+        unchanged since the last extraction (unless force is set); otherwise
+        every pattern is upserted under its stable id in one bulk write, and
+        patterns the examples no longer support are removed.
         """
-        logger.info("🔍 Extracting patterns from high-performing examples...")
-        
         # Get all examples from database
-        cursor = self.examples_collection.find({})
+        cursor = self.examples_collection.find({}).sort("_id", ASCENDING)
         examples = await cursor.to_list(length=None)
         
         if not examples:
             logger.warning("No examples found for pattern extraction")
             return {"status": "no_examples"}
         
-        patterns_extracted = 0
+        examples_hash = self._examples_hash(examples)
+        state = await self.metadata_collection.find_one({"_id": "pattern_extraction"})
+        if not force and state and state.get("examples_hash") == examples_hash:
+            logger.info("📚 Examples unchanged since the last pattern extraction, skipping")
+            return {"status": "unchanged", "patterns_extracted": 0}
         
-        # Extract structural patterns
-        structural_patterns = await self._extract_structural_patterns(examples)
-        for pattern in structural_patterns:
-            await self.patterns_collection.insert_one(asdict(pattern))
-            patterns_extracted += 1
+        logger.info("🔍 Extracting patterns from high-performing examples...")
         
-        # Extract engagement patterns
+        structural_patterns = await self._extract_structural_patterns(examples)
         engagement_patterns = await self._extract_engagement_patterns(examples)
-        for pattern in engagement_patterns:
-            await self.patterns_collection.insert_one(asdict(pattern))
-            patterns_extracted += 1
-        
-        # Extract platform-specific patterns
         platform_patterns = await self._extract_platform_patterns(examples)
-        for pattern in platform_patterns:
-            await self.patterns_collection.insert_one(asdict(pattern))
-            patterns_extracted += 1
+        patterns = structural_patterns + engagement_patterns + platform_patterns
+        
+        operations = []
+        for pattern in patterns:
+            document = asdict(pattern)
+            created_at = document.pop("created_at")
+            operations.append(UpdateOne(
+                {"_id": pattern.id},
+                {"$set": document, "$setOnInsert": {"created_at": created_at}},
+                upsert=True
+            ))
+        # Also clears duplicates stored under random ids by earlier versions
+        operations.append(DeleteMany({"_id": {"$nin": [pattern.id for pattern in patterns]}}))
+        await self.patterns_collection.bulk_write(operations, ordered=False)
+        await self.store.refresh()
+        
+        await self.metadata_collection.update_one(
+            {"_id": "pattern_extraction"},
+            {"$set": {"examples_hash": examples_hash, "patterns": len(patterns),
+                      "extracted_at": datetime.utcnow()}},
+            upsert=True
+        )
+        patterns_extracted = len(patterns)
         
         logger.info(f"✅ Extracted {patterns_extracted} patterns from examples")
         
@@ -730,6 +811,13 @@ The smartest people I know don't have all the answers. They just ask questions t
             }
         }
     
+    def _examples_hash(self, examples: List[Dict]) -> str:
+        """Content hash of the example set that patterns are extracted from"""
+        digest = hashlib.sha256()
+        for example in examples:
+            digest.update(json.dumps(example, sort_keys=True, default=str).encode("utf-8"))
+        return digest.hexdigest()
+    
     async def _extract_structural_patterns(self, examples: List[Dict]) -> List[PatternTemplate]:
         """Extract structural patterns from examples"""
         patterns = []
@@ -750,7 +838,7 @@ The smartest people I know don't have all the answers. They just ask questions t
                 effectiveness = self._calculate_pattern_effectiveness(example_ids, examples)
                 
                 pattern = PatternTemplate(
-                    id=str(uuid.uuid4()),
+                    id=pattern_id("structural", f"hook_{hook_type}"),
                     pattern_type="structural",
                     template_name=f"hook_{hook_type}",
                     template_structure={
@@ -789,7 +877,7 @@ The smartest people I know don't have all the answers. They just ask questions t
                 effectiveness = self._calculate_pattern_effectiveness(example_ids, examples)
                 
                 pattern = PatternTemplate(
-                    id=str(uuid.uuid4()),
+                    id=pattern_id("engagement", f"engagement_{technique}"),
                     pattern_type="engagement",
                     template_name=f"engagement_{technique}",
                     template_structure={
@@ -831,7 +919,7 @@ The smartest people I know don't have all the answers. They just ask questions t
                 common_characteristics = self._extract_common_characteristics(platform_examples)
                 
                 pattern = PatternTemplate(
-                    id=str(uuid.uuid4()),
+                    id=pattern_id("platform_specific", f"platform_{platform}"),
                     pattern_type="platform_specific",
                     template_name=f"platform_{platform}",
                     template_structure={
@@ -1018,7 +1106,7 @@ The smartest people I know don't have all the answers. They just ask questions t
         
         # Get relevant examples if not provided
         if not selected_examples:
-            selected_examples = await self.select_relevant_examples(context, limit=3)
+            selected_examples = await self.select_relevant_examples(context, limit=3, prompt=base_prompt)
         
         # Get relevant pattern templates
         relevant_patterns = await self._get_relevant_patterns(context)
@@ -1044,28 +1132,10 @@ The smartest people I know don't have all the answers. They just ask questions t
         }
     
     async def _get_relevant_patterns(self, context: ContextProfile) -> List[PatternTemplate]:
-        """Get pattern templates relevant to the context"""
-        # Query patterns collection
-        cursor = self.patterns_collection.find({
-            "applicable_contexts": {"$in": [context.platform, context.video_type, context.industry, "general"]}
-        })
-        patterns_data = await cursor.to_list(length=None)
-        
-        # Convert to PatternTemplate objects
-        patterns = []
-        for pattern_data in patterns_data:
-            # Handle MongoDB _id field - create a copy to avoid modifying original
-            pattern_copy = pattern_data.copy()
-            if '_id' in pattern_copy:
-                pattern_copy['id'] = str(pattern_copy['_id'])
-                del pattern_copy['_id']
-            pattern = PatternTemplate(**pattern_copy)
-            patterns.append(pattern)
-        
-        # Sort by effectiveness score
-        patterns.sort(key=lambda p: p.effectiveness_score, reverse=True)
-        
-        return patterns[:10]  # Return top 10 patterns
+        """Get pattern templates relevant to the context (top 10 by effectiveness score)"""
+        return await self.store.find_patterns(
+            [context.platform, context.video_type, context.industry, "general"], limit=10
+        )
     
     async def _generate_pattern_enhanced_prompt(self,
                                               context: ContextProfile,
@@ -0,0 +1,170 @@
+"""
+Few-Shot Example Store
+In-memory copy of the curated script examples and pattern templates with
+inverted indexes on their context fields, so few-shot selection is a
+dictionary lookup instead of database round trips
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Example fields with an inverted index
+EXAMPLE_INDEX_FIELDS = ("video_type", "industry", "platform", "duration")
+
+
+@dataclass
+class StoreSnapshot:
+    """One consistent load of both collections; replaced as a whole on refresh"""
+    examples: List[Any] = field(default_factory=list)
+    performance_scores: List[float] = field(default_factory=list)
+    example_index: Dict[str, Dict[str, Set[int]]] = field(default_factory=dict)
+    patterns: List[Any] = field(default_factory=list)  # best effectiveness_score first
+    pattern_index: Dict[str, Set[int]] = field(default_factory=dict)
+
+
+class FewShotStore:
+    """
+    Serves script examples and pattern templates from memory.
+
+    Both collections are loaded whole (they hold curated data, not user
+    history) and indexed by value: examples on video type, industry, platform
+    and duration, patterns on their applicable contexts, with the patterns
+    kept sorted by effectiveness and each example's performance bonus
+    precomputed. A reload builds a new snapshot and swaps it in, so readers
+    never see a half-built index.
+
+    Writers in this process call refresh() after changing either collection.
+    Changes made elsewhere arrive through a change stream when the server
+    is a replica set, and otherwise through a periodic reload.
+    """
+
+    def __init__(self, examples_collection, patterns_collection,
+                 to_example: Callable[[Dict[str, Any]], Any],
+                 to_pattern: Callable[[Dict[str, Any]], Any],
+                 performance_score: Callable[[Any], float],
+                 reload_interval_seconds: float = 300):
+        self.examples_collection = examples_collection
+        self.patterns_collection = patterns_collection
+        self.to_example = to_example
+        self.to_pattern = to_pattern
+        self.performance_score = performance_score
+        self.reload_interval_seconds = reload_interval_seconds
+
+        self.snapshot: Optional[StoreSnapshot] = None
+        self._load_lock = asyncio.Lock()
+        self._watch_tasks: List[asyncio.Task] = []
+
+    async def refresh(self) -> StoreSnapshot:
+        """Reload both collections and swap in the new snapshot"""
+        async with self._load_lock:
+            example_docs = await self.examples_collection.find({}).to_list(length=None)
+            pattern_docs = await self.patterns_collection.find({}).to_list(length=None)
+            snapshot = StoreSnapshot()
+
+            for example_doc in example_docs:
+                try:
+                    example = self.to_example(example_doc)
+                except TypeError as e:
+                    # Examples added through the API are stored as given
+                    logger.warning(f"Skipping malformed script example {example_doc.get('_id')}: {str(e)}")
+                    continue
+                position = len(snapshot.examples)
+                snapshot.examples.append(example)
+                snapshot.performance_scores.append(self.performance_score(example))
+                for name in EXAMPLE_INDEX_FIELDS:
+                    snapshot.example_index.setdefault(name, {}) \
+                        .setdefault(getattr(example, name), set()).add(position)
+
+            patterns = []
+            for pattern_doc in pattern_docs:
+                try:
+                    patterns.append(self.to_pattern(pattern_doc))
+                except TypeError as e:
+                    logger.warning(f"Skipping malformed pattern template {pattern_doc.get('_id')}: {str(e)}")
+            snapshot.patterns = sorted(patterns, key=lambda p: p.effectiveness_score, reverse=True)
+            for position, pattern in enumerate(snapshot.patterns):
+                for context in pattern.applicable_contexts:
+                    snapshot.pattern_index.setdefault(context, set()).add(position)
+
+            self.snapshot = snapshot
+            logger.info(f"Few-shot store loaded {len(snapshot.examples)} examples "
+                        f"and {len(snapshot.patterns)} patterns")
+            return snapshot
+
+    async def get_snapshot(self) -> StoreSnapshot:
+        """The current snapshot, loading it on first use"""
+        if self.snapshot is None:
+            await self.refresh()
+        return self.snapshot
+
+    async def find_examples(self, filters: Dict[str, str]) -> List[int]:
+        """Positions of the examples matching every filter field exactly, in load order"""
+        snapshot = await self.get_snapshot()
+        matches: Optional[Set[int]] = None
+        for name, value in filters.items():
+            positions = snapshot.example_index.get(name, {}).get(value, set())
+            matches = positions if matches is None else matches & positions
+        if matches is None:
+            return list(range(len(snapshot.examples)))
+        return sorted(matches)
+
+    async def find_patterns(self, contexts: Iterable[str], limit: int = 10) -> List[Any]:
+        """The most effective patterns applicable to any of the contexts"""
+        snapshot = await self.get_snapshot()
+        positions: Set[int] = set()
+        for context in contexts:
+            positions |= snapshot.pattern_index.get(context, set())
+        return [snapshot.patterns[position] for position in sorted(positions)[:limit]]
+
+    def start(self):
+        """Load the store and follow changes in the background (call from the running event loop)"""
+        if not self._watch_tasks:
+            self._watch_tasks = [asyncio.create_task(self._follow_changes())]
+
+    async def stop(self):
+        for task in self._watch_tasks:
+            if not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._watch_tasks = []
+
+    async def _follow_changes(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Error loading few-shot store: {str(e)}")
+
+        try:
+            # Any change to either collection reloads both; they are small
+            async with self.examples_collection.database.watch(
+                [{"$match": {"ns.coll": {"$in": [self.examples_collection.name,
+                                                 self.patterns_collection.name]}}}]
+            ) as stream:
+                async for _ in stream:
+                    try:
+                        await self.refresh()
+                    except Exception as e:
+                        # Keep following; the next change (or a later event) reloads again
+                        logger.error(f"Error reloading few-shot store: {str(e)}")
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone servers have no change streams
+            logger.info(f"Few-shot store reloading every {self.reload_interval_seconds:.0f}s "
+                        f"(change stream unavailable: {str(e)})")
+
+        while True:
+            await asyncio.sleep(self.reload_interval_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error reloading few-shot store: {str(e)}")
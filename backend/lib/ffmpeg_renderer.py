@@ -0,0 +1,174 @@
+"""
+Single-Pass FFmpeg Frame Renderer
+Streams raw BGR frames straight into one ffmpeg process that encodes H.264
+and muxes the audio track, producing the final MP4 in a single encode
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Optional, List
+
+import numpy as np
+
+from lib.ffmpeg_runner import kill_process_group
+from lib.render_scheduler import check_cancelled, report_progress
+
+logger = logging.getLogger(__name__)
+
+
+def ffmpeg_thread_args() -> List[str]:
+    """Encoder thread cap for the current render job (set by the render worker pool)"""
+    threads = os.environ.get("RENDER_THREADS")
+    return ['-threads', threads] if threads else []
+
+
+class FFmpegFrameWriter:
+    """
+    Drop-in replacement for the cv2.VideoWriter + ffmpeg re-encode pattern.
+
+    Frames are written as raw bgr24 (bgra for frames with an alpha channel
+    to composite) to ffmpeg's stdin while the audio file is read as a second
+    input, so there is no intermediate video file and no decode/re-encode
+    cycle. Use as a context manager: leaving the block
+    normally finalizes the file, leaving it with an exception kills ffmpeg.
+
+    With expected_frames, every write reports the encode progress to the
+    current render job; a cancelled job stops at its next frame.
+    """
+
+    def __init__(self, output_path: str, width: int, height: int, fps: float,
+                 audio_path: Optional[str] = None, preset: str = "medium", crf: int = 23,
+                 audio_bitrate: str = "128k", timeout: float = 300,
+                 extra_output_args: Optional[List[str]] = None,
+                 extra_inputs: Optional[List[str]] = None, filter_complex: Optional[str] = None,
+                 expected_frames: Optional[int] = None, stage: str = "encode", pixel_format: str = "bgr24"):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.preset = preset
+        self.crf = crf
+        self.audio_bitrate = audio_bitrate
+        self.timeout = timeout
+        self.extra_output_args = extra_output_args or []
+        # Further inputs (numbered after the frames and the audio) and a graph producing [v]
+        self.extra_inputs = extra_inputs or []
+        self.filter_complex = filter_complex
+        self.expected_frames = expected_frames
+        self.stage = stage
+        self.pixel_format = pixel_format
+
+        self.process: Optional[subprocess.Popen] = None
+        self.frames_written = 0
+        self._stderr = None
+
+    def build_command(self) -> List[str]:
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', self.pixel_format,
+            '-s', f'{self.width}x{self.height}',
+            '-r', str(self.fps),
+            '-i', 'pipe:0'
+        ]
+        if self.audio_path:
+            cmd += ['-i', self.audio_path]
+        cmd += self.extra_inputs
+
+        if self.filter_complex:
+            cmd += ['-filter_complex', self.filter_complex, '-map', '[v]']
+        else:
+            cmd += ['-map', '0:v:0']
+        if self.audio_path:
+            cmd += ['-map', '1:a:0']
+
+        # libx264 with yuv420p needs even dimensions
+        if not self.filter_complex and (self.width % 2 or self.height % 2):
+            cmd += ['-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2']
+
+        cmd += [
+            '-c:v', 'libx264',
+            '-preset', self.preset,
+            '-crf', str(self.crf),
+            '-pix_fmt', 'yuv420p',
+            *ffmpeg_thread_args()
+        ]
+        if self.audio_path:
+            cmd += ['-c:a', 'aac', '-b:a', self.audio_bitrate, '-shortest']
+
+        cmd += ['-movflags', '+faststart']
+        cmd += self.extra_output_args
+        cmd.append(self.output_path)
+        return cmd
+
+    def start(self):
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self.build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr,
+            start_new_session=True
+        )
+        return self
+
+    def write(self, frame: np.ndarray):
+        """Write one BGR (or BGRA) frame of the configured size"""
+        check_cancelled()
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame, dtype=np.uint8).data)
+            self.frames_written += 1
+            if self.expected_frames:
+                report_progress(self.frames_written * 100 / self.expected_frames, self.stage)
+        except BrokenPipeError:
+            self.process.wait()
+            raise RuntimeError(f"FFmpeg failed: {self._read_stderr()}")
+
+    def close(self) -> str:
+        """Finish the stream and wait for ffmpeg to finalize the file"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+
+        try:
+            returncode = self.process.wait(timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(self.process.pid)
+            self.process.wait()
+            logger.error("FFmpeg timeout")
+            raise RuntimeError("Video generation timed out")
+
+        if returncode != 0:
+            stderr = self._read_stderr()
+            logger.error(f"FFmpeg error: {stderr}")
+            raise RuntimeError(f"FFmpeg failed: {stderr}")
+
+        self._stderr.close()
+        logger.info(f"Encoded {self.frames_written} frames to {self.output_path}")
+        return self.output_path
+
+    def abort(self):
+        """Kill ffmpeg without finalizing the output"""
+        if self.process and self.process.poll() is None:
+            kill_process_group(self.process.pid)
+            self.process.wait()
+        if self._stderr:
+            self._stderr.close()
+
+    def _read_stderr(self) -> str:
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', errors='replace').strip()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+            return False
+        self.close()
+        return False
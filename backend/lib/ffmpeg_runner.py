@@ -0,0 +1,130 @@
+"""
+Async FFmpeg Runner
+Runs ffmpeg commands on asyncio subprocesses, parsing -progress output into
+percent-complete updates, with timeouts and cancellation that kill the whole
+ffmpeg process group
+"""
+
+import asyncio
+import logging
+import os
+import signal
+from typing import Callable, List, Optional
+
+import cv2
+
+from lib.render_scheduler import RenderCancelled, check_cancelled, report_progress
+
+logger = logging.getLogger(__name__)
+
+# How often a running ffmpeg is checked for cancellation of its render job
+CANCEL_POLL_SECONDS = 0.25
+
+
+def media_duration_seconds(path: str) -> Optional[float]:
+    """Duration of a video file from its frame count, or None if it cannot be read"""
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frames = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        capture.release()
+    return frames / fps if fps > 0 and frames > 0 else None
+
+
+def with_progress_output(cmd: List[str]) -> List[str]:
+    """Insert the machine-readable progress flags right after the ffmpeg binary"""
+    return [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+
+
+def kill_process_group(pid: int):
+    """SIGKILL a process started with start_new_session=True together with anything it spawned"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def run_ffmpeg(cmd: List[str], duration_seconds: Optional[float] = None, timeout: float = 300,
+                     on_progress: Optional[Callable[[float], None]] = None,
+                     is_cancelled: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Run an ffmpeg command to completion.
+
+    With duration_seconds (the expected output length), the out_time values
+    from -progress are turned into a 0-100 percentage for on_progress. The
+    process runs in its own session; on timeout or when is_cancelled()
+    returns True its process group is killed and RuntimeError or
+    RenderCancelled is raised. A non-zero exit raises RuntimeError with
+    ffmpeg's stderr.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *with_progress_output(cmd),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+
+    async def read_progress():
+        async for raw_line in process.stdout:
+            key, _, value = raw_line.decode('utf-8', errors='replace').strip().partition('=')
+            if on_progress is None:
+                continue
+            if key in ('out_time_us', 'out_time_ms') and duration_seconds and value.isdigit():
+                # Both keys are in microseconds (out_time_ms is a long-standing misnomer)
+                on_progress(min(100.0, int(value) / 1e6 / duration_seconds * 100))
+            elif key == 'progress' and value == 'end':
+                on_progress(100.0)
+
+    async def watch_cancellation():
+        while not is_cancelled():
+            await asyncio.sleep(CANCEL_POLL_SECONDS)
+
+    stderr_task = asyncio.ensure_future(process.stderr.read())
+    done_task = asyncio.ensure_future(asyncio.gather(read_progress(), process.wait()))
+    cancel_task = asyncio.ensure_future(watch_cancellation()) if is_cancelled else None
+    try:
+        waiting = {done_task} if cancel_task is None else {done_task, cancel_task}
+        done, _ = await asyncio.wait(waiting, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if done_task not in done:
+            kill_process_group(process.pid)
+            await process.wait()
+            if cancel_task in done:
+                raise RenderCancelled("FFmpeg was cancelled")
+            logger.error("FFmpeg timeout")
+            raise RuntimeError("Video generation timed out")
+        done_task.result()
+    except asyncio.CancelledError:
+        kill_process_group(process.pid)
+        raise
+    finally:
+        if cancel_task is not None:
+            cancel_task.cancel()
+        if process.returncode is None:
+            kill_process_group(process.pid)
+            await process.wait()
+
+    stderr = (await stderr_task).decode('utf-8', errors='replace').strip()
+    if process.returncode != 0:
+        logger.error(f"FFmpeg error: {stderr}")
+        raise RuntimeError(f"FFmpeg failed: {stderr}")
+
+
+def run_ffmpeg_for_job(cmd: List[str], duration_seconds: Optional[float] = None, timeout: float = 300,
+                       stage: str = "encode") -> None:
+    """
+    run_ffmpeg() from synchronous render code: progress goes to the current
+    render job under the given stage name and the job's cancellation kills
+    ffmpeg.
+    """
+    def is_cancelled() -> bool:
+        try:
+            check_cancelled()
+        except RenderCancelled:
+            return True
+        return False
+
+    asyncio.run(run_ffmpeg(cmd, duration_seconds=duration_seconds, timeout=timeout,
+                           on_progress=lambda percent: report_progress(percent, stage),
+                           is_cancelled=is_cancelled))
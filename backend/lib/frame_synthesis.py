@@ -0,0 +1,372 @@
+"""
+Talking-Head Frame Synthesis
+Pre-rendered sprite cache for the avatar animation loops: mouth and blink
+states are quantized into a small set of keyframe patches rendered once per
+avatar, and every output frame is assembled by index lookup
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Optional, Tuple, Iterator, Union
+
+import cv2
+import numpy as np
+
+from lib.asset_store import decoded_asset_store
+
+logger = logging.getLogger(__name__)
+
+SPRITE_CACHE_SIZE = int(os.environ.get("AVATAR_SPRITE_CACHE_SIZE", "8"))
+
+
+@dataclass(frozen=True)
+class MouthStyle:
+    """
+    How a generator draws its animated mouth.
+
+    For an openness factor f the ellipse axes are
+    (width + width_gain * f, height + height_gain * f), centered at the
+    given fraction of the image size.
+    """
+    center: Tuple[float, float]
+    width: float
+    width_gain: float
+    height: float
+    height_gain: float
+    color: Tuple[int, int, int]
+    start_angle: int = 0
+    end_angle: int = 360
+
+    def axes(self, openness: float) -> Tuple[int, int]:
+        return (int(self.width + self.width_gain * openness),
+                int(self.height + self.height_gain * openness))
+
+    def scaled(self, factor: float) -> "MouthStyle":
+        return replace(self, width=self.width * factor, width_gain=self.width_gain * factor,
+                       height=self.height * factor, height_gain=self.height_gain * factor)
+
+
+@dataclass(frozen=True)
+class VisemeMouth:
+    """
+    A mouth drawn as one of a small set of viseme shapes instead of a single
+    ellipse that only opens and closes.
+
+    shapes holds one (width, height) openness pair per viseme, applied to the
+    base style's gains (negative widths purse the lips). Besides the pure
+    shapes, every ordered pair of visemes gets blend_steps intermediate
+    keyframes so transitions are cross-faded rather than cut.
+    """
+    base: MouthStyle
+    shapes: Tuple[Tuple[float, float], ...]
+    blend_steps: int = 3
+    cavity_color: Tuple[int, int, int] = (40, 20, 30)
+
+    @property
+    def center(self) -> Tuple[float, float]:
+        return self.base.center
+
+    @property
+    def keyframes(self) -> int:
+        count = len(self.shapes)
+        return count + count * count * self.blend_steps
+
+    def axes(self, shape: int) -> Tuple[int, int]:
+        width, height = self.shapes[shape]
+        return (max(1, int(self.base.width + self.base.width_gain * width)),
+                max(1, int(self.base.height + self.base.height_gain * height)))
+
+    def max_axes(self) -> Tuple[int, int]:
+        axes = [self.axes(shape) for shape in range(len(self.shapes))]
+        return max(a[0] for a in axes), max(a[1] for a in axes)
+
+    def keyframe_indices(self, from_shape: np.ndarray, to_shape: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+        """Keyframe index per frame for a blend from one viseme to the next (alpha 0 = from, 1 = to)"""
+        count = len(self.shapes)
+        from_shape = np.asarray(from_shape, dtype=np.int32)
+        to_shape = np.asarray(to_shape, dtype=np.int32)
+        step = np.rint(np.clip(alpha, 0.0, 1.0) * (self.blend_steps + 1)).astype(np.int32)
+
+        blended = count + (from_shape * count + to_shape) * self.blend_steps + np.maximum(step - 1, 0)
+        return np.where(step == 0, from_shape, np.where(step > self.blend_steps, to_shape, blended))
+
+    def scaled(self, factor: float) -> "VisemeMouth":
+        return replace(self, base=self.base.scaled(factor))
+
+
+@dataclass(frozen=True)
+class BlinkStyle:
+    """Closed-eye ellipses drawn over both eyes while blinking"""
+    eye_offset_x: int
+    eye_height: float
+    axes: Tuple[int, int]
+    color: Tuple[int, int, int]
+
+    def scaled(self, factor: float) -> "BlinkStyle":
+        return replace(self, eye_offset_x=int(round(self.eye_offset_x * factor)),
+                       axes=(max(1, int(round(self.axes[0] * factor))), max(1, int(round(self.axes[1] * factor)))))
+
+
+def scaled_max_offset(max_offset: Tuple[int, int], scale: float) -> Tuple[int, int]:
+    """Head offset bounds in the pixels of an image scaled by `scale`"""
+    if scale == 1.0:
+        return max_offset
+    return int(np.ceil(max_offset[0] * scale)), int(np.ceil(max_offset[1] * scale))
+
+
+def with_mask(image: np.ndarray, mask_path: str) -> np.ndarray:
+    """The image as BGRA, with its foreground mask as the alpha channel"""
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if mask is None or mask.shape != image.shape[:2]:
+        raise ValueError(f"Could not load a {image.shape[1]}x{image.shape[0]} mask from {mask_path}")
+    return np.dstack([image, mask])
+
+
+def pad_sprite_image(image: np.ndarray, max_offset: Tuple[int, int], border_mode: int = cv2.BORDER_CONSTANT,
+                     scale: float = 1.0) -> np.ndarray:
+    """The avatar scaled and padded for TalkingHeadSprites; max_offset is in scaled pixels"""
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    pad_x, pad_y = max_offset
+    return cv2.copyMakeBorder(image, pad_y, pad_y, pad_x, pad_x, border_mode, value=(0, 0, 0))
+
+
+class TalkingHeadSprites:
+    """
+    Keyframe patches for one avatar image.
+
+    The frame loops used to copy the full image, draw the mouth and
+    warpAffine the whole frame for every output frame. Here the avatar is
+    padded once with the same border the warp used, so a head offset is just
+    a slice of the padded image, and the mouth/blink states are small
+    patches pasted on top. Output is pixel-identical to the old warp for
+    integer offsets.
+
+    With scale < 1 the image, mouth, blink and head offsets are all scaled
+    down (for preview renders); callers keep animating in full-size pixels.
+
+    `padded` takes the output of pad_sprite_image() for the same offset,
+    border and scale instead of the image, e.g. a memmap shared between
+    render processes; frames then read from it without a private copy.
+
+    A BGRA image (see with_mask()) gives BGRA frames whose alpha follows the
+    head movement, for compositing over backgrounds; the mouth and blink
+    patches only replace the colour channels.
+    """
+
+    def __init__(self, image: Optional[np.ndarray], mouth: MouthStyle, max_offset: Tuple[int, int],
+                 levels: int = 16, blink: Optional[BlinkStyle] = None,
+                 border_mode: int = cv2.BORDER_CONSTANT, scale: float = 1.0,
+                 padded: Optional[np.ndarray] = None):
+        self.scale = scale
+        if scale != 1.0:
+            mouth = mouth.scaled(scale)
+            blink = blink.scaled(scale) if blink else None
+        max_offset = scaled_max_offset(max_offset, scale)
+
+        self.levels = levels
+        self.pad_x, self.pad_y = max_offset
+        self.padded = padded if padded is not None else pad_sprite_image(image, max_offset, border_mode, scale)
+        self.height = self.padded.shape[0] - 2 * self.pad_y
+        self.width = self.padded.shape[1] - 2 * self.pad_x
+        self.channels = self.padded.shape[2]
+        image = self.image[..., :3]
+
+        self.mouth_roi, self.mouth_patches = self._render_mouth_patches(image, mouth)
+        self.blink_roi, self.blink_patch = self._render_blink_patch(image, blink) if blink else (None, None)
+
+    def _render_mouth_patches(self, image: np.ndarray, mouth: MouthStyle):
+        center = (int(self.width * mouth.center[0]), int(self.height * mouth.center[1]))
+        max_axes = mouth.axes(1.0)
+        roi = self._clip_roi(center[0] - max_axes[0] - 2, center[1] - max_axes[1] - 2,
+                             center[0] + max_axes[0] + 3, center[1] + max_axes[1] + 3)
+        x0, y0, x1, y1 = roi
+
+        patches = []
+        for level in range(self.levels):
+            patch = image[y0:y1, x0:x1].copy()
+            cv2.ellipse(patch, (center[0] - x0, center[1] - y0), mouth.axes(self.level_openness(level)),
+                        0, mouth.start_angle, mouth.end_angle, mouth.color, -1)
+            patches.append(patch)
+        return roi, patches
+
+    def _render_blink_patch(self, image: np.ndarray, blink: BlinkStyle):
+        eye_y = int(self.height * blink.eye_height)
+        left = (self.width // 2 - blink.eye_offset_x, eye_y)
+        right = (self.width // 2 + blink.eye_offset_x, eye_y)
+        roi = self._clip_roi(left[0] - blink.axes[0] - 2, eye_y - blink.axes[1] - 2,
+                             right[0] + blink.axes[0] + 3, eye_y + blink.axes[1] + 3)
+        x0, y0, x1, y1 = roi
+
+        patch = image[y0:y1, x0:x1].copy()
+        for eye in (left, right):
+            cv2.ellipse(patch, (eye[0] - x0, eye[1] - y0), blink.axes, 0, 0, 360, blink.color, -1)
+        return roi, patch
+
+    @property
+    def image(self) -> np.ndarray:
+        """The unpadded avatar image"""
+        return self.padded[self.pad_y:self.pad_y + self.height, self.pad_x:self.pad_x + self.width]
+
+    def _clip_roi(self, x0: int, y0: int, x1: int, y1: int) -> Tuple[int, int, int, int]:
+        return max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+
+    def level_openness(self, level: int) -> float:
+        return level / (self.levels - 1)
+
+    def quantize(self, openness: np.ndarray) -> np.ndarray:
+        """Map mouth openness factors in [0, 1] to keyframe indices"""
+        openness = np.nan_to_num(np.asarray(openness, dtype=np.float64), nan=0.0)
+        return np.rint(np.clip(openness, 0.0, 1.0) * (self.levels - 1)).astype(np.int32)
+
+    def frame(self, level: int, dx: int, dy: int, blink: bool = False,
+              out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Assemble one frame, optionally into a caller-owned buffer"""
+        y = self.pad_y - dy
+        x = self.pad_x - dx
+        if out is None:
+            out = np.empty((self.height, self.width, self.channels), dtype=np.uint8)
+        np.copyto(out, self.padded[y:y + self.height, x:x + self.width])
+
+        self._paste(out, self.mouth_roi, self.mouth_patches[level], dx, dy)
+        if blink and self.blink_patch is not None:
+            self._paste(out, self.blink_roi, self.blink_patch, dx, dy)
+        return out
+
+    def _paste(self, out: np.ndarray, roi: Tuple[int, int, int, int], patch: np.ndarray, dx: int, dy: int):
+        x0, y0, x1, y1 = roi
+        tx0, ty0 = max(x0 + dx, 0), max(y0 + dy, 0)
+        tx1, ty1 = min(x1 + dx, self.width), min(y1 + dy, self.height)
+        if tx0 >= tx1 or ty0 >= ty1:
+            return
+        out[ty0:ty1, tx0:tx1, :3] = patch[ty0 - y0 - dy:ty1 - y0 - dy, tx0 - x0 - dx:tx1 - x0 - dx]
+
+    def frames(self, openness: np.ndarray, shift_x: np.ndarray, shift_y: np.ndarray,
+               blink: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+        """
+        Yield frames for per-frame openness factors, integer head offsets and
+        blink flags. One buffer is reused for every frame, so each frame must
+        be consumed (e.g. written to ffmpeg) before advancing the iterator.
+        """
+        levels = self.quantize(openness)
+        if self.scale != 1.0:
+            shift_x = np.rint(np.asarray(shift_x) * self.scale)
+            shift_y = np.rint(np.asarray(shift_y) * self.scale)
+        shift_x = np.clip(shift_x, -self.pad_x, self.pad_x).astype(np.int32)
+        shift_y = np.clip(shift_y, -self.pad_y, self.pad_y).astype(np.int32)
+        blink = blink if blink is not None else np.zeros(len(levels), dtype=bool)
+        buffer = np.empty((self.height, self.width, self.channels), dtype=np.uint8)
+
+        for level, dx, dy, closed in zip(levels.tolist(), shift_x.tolist(), shift_y.tolist(), blink.tolist()):
+            yield self.frame(level, dx, dy, closed, out=buffer)
+
+
+class VisemeSprites(TalkingHeadSprites):
+    """
+    Talking-head sprites whose mouth keyframes are viseme shapes and the
+    cross-fades between them. The animation track passed to frames() holds
+    keyframe indices (see VisemeMouth.keyframe_indices) instead of openness
+    factors; everything else, including the per-frame cost, is the same as
+    the single-ellipse sprites.
+    """
+
+    def __init__(self, image: Optional[np.ndarray], mouth: VisemeMouth, max_offset: Tuple[int, int],
+                 levels: int = 16, blink: Optional[BlinkStyle] = None,
+                 border_mode: int = cv2.BORDER_CONSTANT, scale: float = 1.0,
+                 padded: Optional[np.ndarray] = None):
+        super().__init__(image, mouth, max_offset, levels=mouth.keyframes, blink=blink, border_mode=border_mode,
+                         scale=scale, padded=padded)
+
+    def _render_mouth_patches(self, image: np.ndarray, mouth: VisemeMouth):
+        center = (int(self.width * mouth.center[0]), int(self.height * mouth.center[1]))
+        max_axes = mouth.max_axes()
+        roi = self._clip_roi(center[0] - max_axes[0] - 2, center[1] - max_axes[1] - 2,
+                             center[0] + max_axes[0] + 3, center[1] + max_axes[1] + 3)
+        x0, y0, x1, y1 = roi
+        local_center = (center[0] - x0, center[1] - y0)
+
+        shapes = []
+        for shape in range(len(mouth.shapes)):
+            patch = image[y0:y1, x0:x1].copy()
+            axes = mouth.axes(shape)
+            cv2.ellipse(patch, local_center, axes, 0, mouth.base.start_angle, mouth.base.end_angle,
+                        mouth.base.color, -1, lineType=cv2.LINE_AA)
+            # Open shapes show the dark mouth cavity inside the lips
+            cavity = (int(axes[0] * 0.7), int(axes[1] * 0.6))
+            if mouth.shapes[shape][1] >= 0.25 and cavity[1] >= 2:
+                cv2.ellipse(patch, local_center, cavity, 0, 0, 360, mouth.cavity_color, -1, lineType=cv2.LINE_AA)
+            shapes.append(patch)
+
+        patches = list(shapes)
+        for first in shapes:
+            for second in shapes:
+                for step in range(1, mouth.blend_steps + 1):
+                    alpha = step / (mouth.blend_steps + 1)
+                    patches.append(cv2.addWeighted(first, 1.0 - alpha, second, alpha, 0.0))
+        return roi, patches
+
+    def quantize(self, keyframes: np.ndarray) -> np.ndarray:
+        """The viseme track already holds keyframe indices"""
+        return np.clip(np.asarray(keyframes), 0, self.levels - 1).astype(np.int32)
+
+
+_sprite_cache: "OrderedDict[tuple, TalkingHeadSprites]" = OrderedDict()
+_sprite_cache_lock = threading.Lock()
+
+
+def get_talking_head_sprites(image_path: str, mouth: Union[MouthStyle, VisemeMouth], max_offset: Tuple[int, int],
+                             levels: int = 16, blink: Optional[BlinkStyle] = None,
+                             border_mode: int = cv2.BORDER_CONSTANT, cache: bool = True,
+                             scale: float = 1.0, mask_path: Optional[str] = None) -> TalkingHeadSprites:
+    """
+    Sprites for an avatar image, built once and reused across requests.
+
+    Cached per image content (so an edited asset is picked up), animation
+    style and scale, in a small LRU; the padded pixels are a memmap from the
+    shared decoded asset store, so render processes do not each hold a copy. Pass cache=False for one-off images such as user uploads,
+    which are decoded directly and not kept. A VisemeMouth gives viseme
+    sprites driven by keyframe indices. With mask_path the sprites are BGRA,
+    the mask giving the alpha.
+    """
+    sprite_class = VisemeSprites if isinstance(mouth, VisemeMouth) else TalkingHeadSprites
+    if not cache:
+        image = cv2.imread(image_path)
+        if image is None:
+            raise ValueError(f"Could not load image from {image_path}")
+        if mask_path:
+            image = with_mask(image, mask_path)
+        return sprite_class(image, mouth, max_offset, levels=levels, blink=blink, border_mode=border_mode,
+                            scale=scale)
+
+    mask_hash = decoded_asset_store.content_hash(mask_path)[:16] if mask_path else None
+    key = (decoded_asset_store.content_hash(image_path), mouth, max_offset, levels, blink, border_mode, scale,
+           mask_hash)
+
+    with _sprite_cache_lock:
+        sprites = _sprite_cache.get(key)
+        if sprites is not None:
+            _sprite_cache.move_to_end(key)
+            return sprites
+
+    offset = scaled_max_offset(max_offset, scale)
+    variant = f"pad{offset[0]}x{offset[1]}-border{border_mode}-scale{scale}"
+    if mask_path:
+        variant += f"-mask{mask_hash}"
+    padded = decoded_asset_store.load_variant(
+        image_path, variant,
+        lambda image: pad_sprite_image(with_mask(image, mask_path) if mask_path else image, offset, border_mode,
+                                       scale)
+    )
+
+    sprites = sprite_class(None, mouth, max_offset, levels=levels, blink=blink, border_mode=border_mode,
+                           scale=scale, padded=padded)
+    logger.info(f"Pre-rendered {sprites.levels} mouth keyframes for {image_path}")
+
+    with _sprite_cache_lock:
+        _sprite_cache[key] = sprites
+        while len(_sprite_cache) > SPRITE_CACHE_SIZE:
+            _sprite_cache.popitem(last=False)
+    return sprites
@@ -6,15 +6,36 @@ Master orchestrator for multi-model validation, advanced metrics, and quality im
 import asyncio
 import logging
 from typing import Dict, List, Any, Optional
-from datetime import datetime
-from dataclasses import dataclass
+from datetime import datetime, timedelta
+from dataclasses import dataclass, asdict
+from pymongo import ASCENDING, DESCENDING
 
+from .mongo_indexes import index_registry
+from .rollups import Rollup, rollup_registry, day_filter, day_expression
+from .write_behind import write_behind
 from .multi_model_validator import MultiModelValidator, ConsensusValidationResult
 from .advanced_quality_metrics import AdvancedQualityMetrics
 from .quality_improvement_loop import QualityImprovementLoop
 
 logger = logging.getLogger(__name__)
 
+# System performance reads the daily QA rollups of the last N days
+index_registry.index("intelligent_qa_results", [("timestamp", DESCENDING)])
+index_registry.index("qa_rollups", [("day", ASCENDING)])
+index_registry.index("qa_model_rollups", [("day", ASCENDING), ("model", ASCENDING)])
+
+index_registry.query("qa_rollups.recent", "qa_rollups",
+                     day_filter(datetime.utcnow() - timedelta(days=7)))
+index_registry.query("qa_model_rollups.recent", "qa_model_rollups",
+                     day_filter(datetime.utcnow() - timedelta(days=7)))
+
+# Consensus score bands of the quality distribution, best first: (name, lower bound)
+QUALITY_BANDS = [("excellent", 9.0), ("good", 8.0), ("acceptable", 7.0), ("needs_improvement", None)]
+
+
+def _quality_band(score: float) -> str:
+    return next(name for name, lower in QUALITY_BANDS if lower is None or score >= lower)
+
 @dataclass
 class IntelligentQAResult:
     """Complete intelligent QA result"""
@@ -56,6 +77,16 @@ class IntelligentQASystem:
         # Collections for tracking
         self.qa_results_collection = db.intelligent_qa_results
         self.system_performance_collection = db.qa_system_performance
+        
+        # Daily rollups of the QA results, overall and per validating model
+        self.daily_rollup = rollup_registry.register(Rollup(
+            db.qa_rollups, [], source=self.qa_results_collection,
+            rebuild_pipeline=self._daily_rollup_rebuild_pipeline
+        ))
+        self.model_rollup = rollup_registry.register(Rollup(
+            db.qa_model_rollups, ["model"], source=self.qa_results_collection,
+            rebuild_pipeline=self._model_rollup_rebuild_pipeline
+        ))
     
     async def comprehensive_qa_analysis(self, script: str, original_prompt: str = "", 
                                       metadata: Dict[str, Any] = None, 
@@ -145,8 +176,9 @@ class IntelligentQASystem:
                 timestamp=datetime.utcnow()
             )
             
-            # Store result
-            await self.qa_results_collection.insert_one(qa_result.__dict__)
+            # Store result; the rollups count it once it is written
+            write_behind.insert(self.qa_results_collection, asdict(qa_result),
+                                on_written=lambda: self._record_rollups(qa_result))
             
             # Update system performance metrics
             await self._update_system_performance_metrics(qa_result)
@@ -250,33 +282,32 @@ class IntelligentQASystem:
             System performance metrics and insights
         """
         try:
-            # Fetch recent QA results
-            from datetime import timedelta
+            # Sum the daily rollups of the period (whole days)
             cutoff_date = datetime.utcnow() - timedelta(days=days)
             
-            cursor = self.qa_results_collection.find({
-                "timestamp": {"$gte": cutoff_date}
-            }).sort("timestamp", -1)
-            
-            results = await cursor.to_list(1000)
+            totals = await self._sum_rollup(self.daily_rollup, cutoff_date, None, [
+                "analyses", "threshold_passed", "regenerations", "processing_time_sum",
+                "confidence_sum", "quality_sum", *[f"quality_{name}" for name, _ in QUALITY_BANDS]
+            ])
             
-            if not results:
+            if not totals or not totals["analyses"]:
                 return {
                     "total_analyses": 0,
                     "message": "No QA results found in the specified period"
                 }
             
-            # Calculate performance metrics
-            total_analyses = len(results)
-            threshold_passed = sum(1 for r in results if r.get("quality_threshold_met", False))
-            regenerations_performed = sum(1 for r in results if r.get("regeneration_performed", False))
+            models = await self._sum_rollup(self.model_rollup, cutoff_date, "$model", [
+                "validations", "successful", "score_sum", "response_time_sum"
+            ])
             
-            avg_processing_time = sum(r.get("total_processing_time", 0) for r in results) / total_analyses
-            avg_confidence_score = sum(r.get("confidence_score", 0) for r in results) / total_analyses
+            # Calculate performance metrics
+            total_analyses = totals["analyses"]
+            threshold_passed = totals["threshold_passed"]
+            regenerations_performed = totals["regenerations"]
             
-            # Quality score distribution
-            quality_scores = [r.get("consensus_validation", {}).get("consensus_score", 0) for r in results]
-            avg_quality_score = sum(quality_scores) / len(quality_scores) if quality_scores else 0
+            avg_processing_time = totals["processing_time_sum"] / total_analyses
+            avg_confidence_score = totals["confidence_sum"] / total_analyses
+            avg_quality_score = totals["quality_sum"] / total_analyses
             
             # Success rate trends
             success_rate = (threshold_passed / total_analyses) * 100 if total_analyses > 0 else 0
@@ -296,18 +327,41 @@ class IntelligentQASystem:
                     "analyses_per_day": round(total_analyses / days, 1)
                 },
                 "quality_distribution": {
-                    "excellent": sum(1 for s in quality_scores if s >= 9.0),
-                    "good": sum(1 for s in quality_scores if 8.0 <= s < 9.0),
-                    "acceptable": sum(1 for s in quality_scores if 7.0 <= s < 8.0),
-                    "needs_improvement": sum(1 for s in quality_scores if s < 7.0)
+                    name: totals[f"quality_{name}"] for name, _ in QUALITY_BANDS
                 },
-                "system_insights": await self._generate_system_insights(results)
+                "model_performance": [
+                    {
+                        "model": model["_id"],
+                        "validations": model["validations"],
+                        "success_rate": round(model["successful"] / model["validations"] * 100, 1),
+                        "avg_quality_score": round(model["score_sum"] / model["successful"], 2)
+                                             if model["successful"] else 0.0,
+                        "avg_response_time": round(model["response_time_sum"] / model["validations"], 2)
+                    }
+                    for model in sorted(models, key=lambda m: m["_id"] or "")
+                ],
+                "system_insights": await self._generate_system_insights(totals)
             }
             
         except Exception as e:
             logger.error(f"Error getting QA system performance: {str(e)}")
             return {"error": str(e)}
     
+    async def _sum_rollup(self, rollup: Rollup, since: datetime, group_by: Optional[str],
+                          fields: List[str]) -> Any:
+        """
+        Sum rollup fields over the days since a date: one totals document (None
+        when there are no days) or, with group_by, one per group value
+        """
+        cursor = rollup.collection.aggregate([
+            {"$match": day_filter(since)},
+            {"$group": {"_id": group_by, **{field: {"$sum": f"${field}"} for field in fields}}}
+        ])
+        groups = await cursor.to_list(length=None)
+        if group_by is not None:
+            return groups
+        return groups[0] if groups else None
+    
     # Helper methods
     
     async def _generate_comprehensive_recommendations(self, consensus_validation: ConsensusValidationResult,
@@ -377,11 +431,79 @@ class IntelligentQASystem:
                 "agreement_level": qa_result.consensus_validation.agreement_level
             }
             
-            await self.system_performance_collection.insert_one(performance_record)
+            write_behind.insert(self.system_performance_collection, performance_record)
             
         except Exception as e:
             logger.error(f"Error updating system performance metrics: {str(e)}")
     
+    async def _record_rollups(self, qa_result: IntelligentQAResult):
+        """Add a stored QA result to the daily and per-model rollups"""
+        try:
+            consensus = qa_result.consensus_validation
+            await self.daily_rollup.record(qa_result.timestamp, {}, {
+                "analyses": 1,
+                "threshold_passed": int(qa_result.quality_threshold_met),
+                "regenerations": int(qa_result.regeneration_performed),
+                "processing_time_sum": qa_result.total_processing_time,
+                "confidence_sum": qa_result.confidence_score,
+                "quality_sum": consensus.consensus_score,
+                f"quality_{_quality_band(consensus.consensus_score)}": 1
+            })
+            for model_result in consensus.individual_results:
+                await self.model_rollup.record(qa_result.timestamp, {"model": model_result.model_name}, {
+                    "validations": 1,
+                    "successful": int(model_result.success),
+                    "score_sum": model_result.quality_score if model_result.success else 0.0,
+                    "response_time_sum": model_result.response_time
+                })
+        except Exception as e:
+            logger.error(f"Error updating QA rollups: {str(e)}")
+    
+    def _daily_rollup_rebuild_pipeline(self) -> List[Dict[str, Any]]:
+        """The daily QA rollup documents computed from the stored QA results"""
+        score = "$consensus_validation.consensus_score"
+        bands = []
+        upper = None
+        for name, lower in QUALITY_BANDS:
+            conditions = ([{"$gte": [score, lower]}] if lower is not None else []) + \
+                         ([{"$lt": [score, upper]}] if upper is not None else [])
+            bands.append((name, {"$and": conditions}))
+            upper = lower
+        
+        return [
+            {"$group": {
+                "_id": {"day": day_expression("timestamp")},
+                "analyses": {"$sum": 1},
+                "threshold_passed": {"$sum": {"$cond": ["$quality_threshold_met", 1, 0]}},
+                "regenerations": {"$sum": {"$cond": ["$regeneration_performed", 1, 0]}},
+                "processing_time_sum": {"$sum": "$total_processing_time"},
+                "confidence_sum": {"$sum": "$confidence_score"},
+                "quality_sum": {"$sum": score},
+                **{f"quality_{name}": {"$sum": {"$cond": [condition, 1, 0]}} for name, condition in bands},
+                "first_at": {"$min": "$timestamp"},
+                "last_at": {"$max": "$timestamp"}
+            }},
+            {"$addFields": {"day": "$_id.day"}}
+        ]
+    
+    def _model_rollup_rebuild_pipeline(self) -> List[Dict[str, Any]]:
+        """The per-model daily rollup documents computed from the stored QA results"""
+        model = "$consensus_validation.individual_results"
+        return [
+            {"$unwind": model},
+            {"$group": {
+                # Same field order as Rollup.key(), so incremental updates find the rebuilt documents
+                "_id": {"day": day_expression("timestamp"), "model": f"{model}.model_name"},
+                "validations": {"$sum": 1},
+                "successful": {"$sum": {"$cond": [f"{model}.success", 1, 0]}},
+                "score_sum": {"$sum": {"$cond": [f"{model}.success", f"{model}.quality_score", 0]}},
+                "response_time_sum": {"$sum": f"{model}.response_time"},
+                "first_at": {"$min": "$timestamp"},
+                "last_at": {"$max": "$timestamp"}
+            }},
+            {"$addFields": {"day": "$_id.day", "model": "$_id.model"}}
+        ]
+    
     async def _track_prompt_evolution(self, evolution_result: Dict[str, Any]):
         """Track prompt evolution performance"""
         try:
@@ -391,24 +513,25 @@ class IntelligentQASystem:
         except Exception as e:
             logger.error(f"Error tracking prompt evolution: {str(e)}")
     
-    async def _generate_system_insights(self, results: List[Dict[str, Any]]) -> List[str]:
-        """Generate system-level insights from QA results"""
+    async def _generate_system_insights(self, totals: Dict[str, Any]) -> List[str]:
+        """Generate system-level insights from the summed QA rollups"""
         insights = []
         
-        if not results:
+        analyses = totals.get("analyses", 0) if totals else 0
+        if not analyses:
             return ["No data available for insights"]
         
         # Quality trends
-        avg_score = sum(r.get("consensus_validation", {}).get("consensus_score", 0) for r in results) / len(results)
+        avg_score = totals["quality_sum"] / analyses
         insights.append(f"Average quality score: {avg_score:.1f}/10")
         
         # Regeneration patterns
-        regen_rate = sum(1 for r in results if r.get("regeneration_performed", False)) / len(results) * 100
+        regen_rate = totals["regenerations"] / analyses * 100
         if regen_rate > 30:
             insights.append(f"High regeneration rate ({regen_rate:.1f}%) - consider prompt optimization")
         
         # Performance trends
-        avg_time = sum(r.get("total_processing_time", 0) for r in results) / len(results)
+        avg_time = totals["processing_time_sum"] / analyses
         insights.append(f"Average processing time: {avg_time:.1f} seconds")
         
         return insights
\ No newline at end of file
@@ -0,0 +1,409 @@
+"""
+Lip-Sync Worker
+A long-lived SadTalker process that loads its checkpoints once and renders
+talking videos for the API over a local socket, instead of a fresh
+inference.py subprocess per request
+
+Run it from the backend directory with: python -m lib.lipsync_worker
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.connection import AuthenticationError, Listener, Client
+from pathlib import Path
+from typing import Optional, Dict, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# The socket and its authkey live in a directory only the service user can enter
+DEFAULT_ADDRESS = "/app/tmp/lipsync_worker/worker.sock"
+AUTHKEY_FILE = "authkey"
+SADTALKER_DIR = Path(os.environ.get("SADTALKER_DIR", "/app/SadTalker"))
+
+
+def sadtalker_installed(sadtalker_dir: Path = SADTALKER_DIR) -> bool:
+    return (sadtalker_dir / "inference.py").exists() and (sadtalker_dir / "checkpoints").exists()
+
+
+def private_dir(path: Path) -> Path:
+    """Create a directory only the current user can access; raises if an existing one is not private"""
+    path = Path(path)
+    path.mkdir(mode=0o700, parents=True, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is owned by another user")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def load_authkey(address: str) -> bytes:
+    """
+    The connection authkey: LIPSYNC_WORKER_AUTHKEY if set, otherwise a key
+    generated once per deployment and kept next to the socket. Every
+    message is unpickled, so the worker never serves without one.
+    """
+    key = os.environ.get("LIPSYNC_WORKER_AUTHKEY")
+    if key:
+        return key.encode('utf-8')
+
+    key_path = private_dir(Path(address).parent) / AUTHKEY_FILE
+    try:
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        key = key_path.read_bytes()
+        if not key:
+            raise PermissionError(f"Empty lip-sync worker authkey in {key_path}")
+        return key
+    key = secrets.token_hex(32).encode('ascii')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+class SadTalkerModels:
+    """SadTalker's three stages (face crop + 3DMM extraction, audio to coefficients, face renderer), loaded once"""
+
+    def __init__(self, sadtalker_dir: Path, device: str = "cpu", size: int = 256, preprocess: str = "crop"):
+        sadtalker_dir = Path(sadtalker_dir).resolve()
+        if str(sadtalker_dir) not in sys.path:
+            sys.path.insert(0, str(sadtalker_dir))
+
+        # SadTalker's own modules, importable only from its checkout
+        from src.utils.preprocess import CropAndExtract
+        from src.test_audio2coeff import Audio2Coeff
+        from src.facerender.animate import AnimateFromCoeff
+        from src.generate_batch import get_data
+        from src.generate_facerender_batch import get_facerender_data
+        from src.utils.init_path import init_path
+
+        self.device = device
+        self.size = size
+        self.preprocess = preprocess
+        self.get_data = get_data
+        self.get_facerender_data = get_facerender_data
+
+        paths = init_path(str(sadtalker_dir / "checkpoints"), str(sadtalker_dir / "src" / "config"),
+                          size, False, preprocess)
+        self.preprocess_model = CropAndExtract(paths, device)
+        self.audio_to_coeff = Audio2Coeff(paths, device)
+        self.animate_from_coeff = AnimateFromCoeff(paths, device)
+
+    def extract_face(self, image_path: str, output_dir: str) -> Tuple[str, str, Any]:
+        """(first frame 3DMM coefficients path, cropped image path, crop info) for a source image"""
+        first_coeff_path, crop_pic_path, crop_info = self.preprocess_model.generate(
+            image_path, output_dir, self.preprocess, source_image_flag=True, pic_size=self.size
+        )
+        if first_coeff_path is None:
+            raise RuntimeError(f"No face found in {image_path}")
+        return first_coeff_path, crop_pic_path, crop_info
+
+    def animate(self, image_path: str, face: Tuple[str, str, Any], audio_path: str, save_dir: str,
+                still: bool = True, batch_size: int = 2) -> str:
+        """Render the talking video for an extracted face and a WAV file; returns the video path"""
+        first_coeff_path, crop_pic_path, crop_info = face
+        batch = self.get_data(first_coeff_path, audio_path, self.device, None, still=still)
+        coeff_path = self.audio_to_coeff.generate(batch, save_dir, 0, None)
+        data = self.get_facerender_data(coeff_path, crop_pic_path, first_coeff_path, audio_path, batch_size,
+                                        None, None, None, expression_scale=1.0, still_mode=still,
+                                        preprocess=self.preprocess, size=self.size)
+        return self.animate_from_coeff.generate(data, save_dir, image_path, crop_info, enhancer=None,
+                                                background_enhancer=None, preprocess=self.preprocess,
+                                                img_size=self.size)
+
+
+class LipSyncWorker:
+    """
+    The worker process side: loads the models, then serves requests on a
+    Unix socket. Each connection gets a thread so health checks answer
+    while a render runs; renders themselves run one at a time (the models
+    are neither thread-safe nor worth sharing a CPU between).
+
+    Face crops and 3DMM coefficients are cached per source image content
+    under cache_dir, so repeat renders of the same avatar skip the
+    preprocessing stage entirely.
+
+    Connections must present authkey, and the socket is created inside a
+    directory only the service user can enter.
+    """
+
+    def __init__(self, address: str, sadtalker_dir: Path, cache_dir: Path, authkey: bytes,
+                 device: str = "cpu", max_cached_faces: int = 64):
+        if not authkey:
+            raise ValueError("The lip-sync worker needs an authkey")
+        self.address = address
+        self.sadtalker_dir = Path(sadtalker_dir)
+        self.cache_dir = Path(cache_dir)
+        self.device = device
+        self.authkey = authkey
+        self.max_cached_faces = max_cached_faces
+
+        self.models: Optional[SadTalkerModels] = None
+        self._faces: "OrderedDict[str, Tuple[str, str, Any]]" = OrderedDict()
+        self._render_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.started_at = time.time()
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.face_cache_hits = 0
+        self.queued = 0
+        self.busy = False
+
+    def serve_forever(self):
+        if lipsync_worker_client.health() is not None:
+            logger.info(f"A lip-sync worker is already serving {self.address}")
+            return
+
+        logger.info(f"Loading SadTalker models from {self.sadtalker_dir} on {self.device}")
+        load_started = time.time()
+        self.models = SadTalkerModels(self.sadtalker_dir, self.device)
+        logger.info(f"SadTalker models loaded in {time.time() - load_started:.1f}s")
+
+        # Listen only once the models are warm, so clients fall back to the subprocess path until then
+        private_dir(self.cache_dir)
+        private_dir(Path(self.address).parent)
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # The socket is created 0600 rather than chmod-ed after it is already accepting
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        logger.info(f"Lip-sync worker listening on {self.address}")
+
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    logger.warning(f"Rejected lip-sync worker connection: {str(e)}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def health(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "status": "ready",
+                "pid": os.getpid(),
+                "device": self.device,
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "busy": self.busy,
+                "queued": self.queued,
+                "jobs_completed": self.jobs_completed,
+                "jobs_failed": self.jobs_failed,
+                "cached_faces": len(self._faces),
+                "face_cache_hits": self.face_cache_hits
+            }
+
+    def render(self, image_path: str, audio_path: str, output_path: str, still: bool = True) -> str:
+        with self._stats_lock:
+            self.queued += 1
+        with self._render_lock:
+            with self._stats_lock:
+                self.queued -= 1
+                self.busy = True
+            save_dir = tempfile.mkdtemp(prefix="sadtalker-", dir=Path(output_path).parent)
+            try:
+                face = self._face(image_path)
+                result = self.models.animate(image_path, face, audio_path, save_dir, still=still)
+                shutil.move(result, output_path)
+                with self._stats_lock:
+                    self.jobs_completed += 1
+                return output_path
+            except Exception:
+                with self._stats_lock:
+                    self.jobs_failed += 1
+                raise
+            finally:
+                shutil.rmtree(save_dir, ignore_errors=True)
+                with self._stats_lock:
+                    self.busy = False
+
+    def _face(self, image_path: str) -> Tuple[str, str, Any]:
+        """Extracted face for an image, from the cache when this content was seen before"""
+        with open(image_path, 'rb') as f:
+            key = hashlib.sha256(f.read()).hexdigest()
+
+        if key in self._faces:
+            self._faces.move_to_end(key)
+            with self._stats_lock:
+                self.face_cache_hits += 1
+            return self._faces[key]
+
+        face_dir = self.cache_dir / key
+        info_path = face_dir / "face.npz"
+        if info_path.exists():
+            face = self._load_face(face_dir, info_path)
+            with self._stats_lock:
+                self.face_cache_hits += 1
+        else:
+            private_dir(face_dir)
+            face = self.models.extract_face(image_path, str(face_dir))
+            self._save_face(face, info_path)
+
+        self._faces[key] = face
+        while len(self._faces) > self.max_cached_faces:
+            self._faces.popitem(last=False)
+        return face
+
+    def _save_face(self, face: Tuple[str, str, Any], info_path: Path):
+        """Store a face as plain arrays; SadTalker's crop info is (size, crop box, quad)"""
+        first_coeff_path, crop_pic_path, (size, crop, quad) = face
+        tmp_path = info_path.with_suffix(".tmp.npz")
+        np.savez(tmp_path, first_coeff=np.str_(Path(first_coeff_path).name),
+                 crop_pic=np.str_(Path(crop_pic_path).name),
+                 size=np.asarray(size), crop=np.asarray(crop), quad=np.asarray(quad))
+        os.replace(tmp_path, info_path)
+
+    def _load_face(self, face_dir: Path, info_path: Path) -> Tuple[str, str, Any]:
+        # Arrays only: a cache file never gets to run code in the worker
+        with np.load(info_path, allow_pickle=False) as data:
+            # Only file names are stored, so the paths cannot point outside the face's directory
+            return (str(face_dir / Path(str(data["first_coeff"])).name),
+                    str(face_dir / Path(str(data["crop_pic"])).name),
+                    (tuple(data["size"].tolist()), tuple(data["crop"].tolist()), tuple(data["quad"].tolist())))
+
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    if request.get("op") == "health":
+                        response = {"ok": True, **self.health()}
+                    elif request.get("op") == "render":
+                        output_path = self.render(request["image_path"], request["audio_path"],
+                                                  request["output_path"], request.get("still", True))
+                        response = {"ok": True, "output_path": output_path}
+                    else:
+                        response = {"ok": False, "error": f"Unknown operation: {request.get('op')}"}
+                except Exception as e:
+                    logger.error(f"Lip-sync job failed: {str(e)}")
+                    response = {"ok": False, "error": str(e)}
+                conn.send(response)
+        except (OSError, EOFError) as e:
+            logger.warning(f"Lip-sync client connection dropped: {str(e)}")
+        finally:
+            conn.close()
+
+
+class LipSyncWorkerClient:
+    """
+    The API side: talks to the worker over its socket. Health is cached for
+    a few seconds so a down worker costs one failed connect, not one per
+    render; callers fall back to running SadTalker directly when it is down.
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None, timeout: float = 600,
+                 health_ttl_seconds: float = 5):
+        self.address = address
+        self._authkey = authkey
+        self.timeout = timeout
+        self.health_ttl_seconds = health_ttl_seconds
+        self._health: Optional[Dict[str, Any]] = None
+        self._health_checked_at = 0.0
+        self._process: Optional[subprocess.Popen] = None
+
+    @property
+    def authkey(self) -> bytes:
+        """The worker's authkey, read (or generated) on first use"""
+        if self._authkey is None:
+            self._authkey = load_authkey(self.address)
+        return self._authkey
+
+    def _request(self, request: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        try:
+            conn.send(request)
+            if not conn.poll(timeout):
+                raise TimeoutError(f"Lip-sync worker did not answer within {timeout}s")
+            return conn.recv()
+        finally:
+            conn.close()
+
+    def health(self) -> Optional[Dict[str, Any]]:
+        """The worker's health report, or None when it is not running"""
+        try:
+            self._health = self._request({"op": "health"}, timeout=5)
+        except (OSError, EOFError, TimeoutError, AuthenticationError):
+            self._health = None
+        self._health_checked_at = time.monotonic()
+        return self._health
+
+    def available(self) -> bool:
+        if time.monotonic() - self._health_checked_at > self.health_ttl_seconds:
+            self.health()
+        return self._health is not None
+
+    def render(self, image_path: str, audio_path: str, output_path: str, still: bool = True) -> str:
+        """Render a talking video in the worker (paths must be visible to it); raises if it fails"""
+        try:
+            response = self._request({
+                "op": "render",
+                "image_path": os.path.abspath(image_path),
+                "audio_path": os.path.abspath(audio_path),
+                "output_path": os.path.abspath(output_path),
+                "still": still
+            }, timeout=self.timeout)
+        except (OSError, EOFError, TimeoutError, AuthenticationError) as e:
+            # Treat the worker as down until the next health check
+            self._health = None
+            raise RuntimeError(f"Lip-sync worker unavailable: {str(e)}")
+
+        if not response.get("ok"):
+            raise RuntimeError(f"Lip-sync worker failed: {response.get('error')}")
+        return response["output_path"]
+
+    def start(self, backend_dir: Path) -> bool:
+        """Launch the worker in the background unless one is already serving; returns whether one was started"""
+        if not sadtalker_installed():
+            return False
+        if self.health() is not None or (self._process is not None and self._process.poll() is None):
+            return False
+        self._process = subprocess.Popen([sys.executable, "-m", "lib.lipsync_worker"], cwd=str(backend_dir))
+        logger.info(f"Started lip-sync worker (pid {self._process.pid})")
+        return True
+
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+        self._process = None
+
+
+# Global instance
+lipsync_worker_client = LipSyncWorkerClient(
+    os.environ.get("LIPSYNC_WORKER_ADDRESS", DEFAULT_ADDRESS),
+    timeout=float(os.environ.get("LIPSYNC_WORKER_TIMEOUT_SECONDS", "600"))
+)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    address = os.environ.get("LIPSYNC_WORKER_ADDRESS", DEFAULT_ADDRESS)
+    LipSyncWorker(
+        address,
+        SADTALKER_DIR,
+        Path(os.environ.get("LIPSYNC_FACE_CACHE_DIR", "/app/tmp/lipsync_faces")),
+        authkey=load_authkey(address),
+        device=os.environ.get("LIPSYNC_DEVICE", "cpu")
+    ).serve_forever()
@@ -0,0 +1,162 @@
+"""
+Mongo Index Registry
+Indexes declared next to the components that query each collection, created
+idempotently at startup, and an explain() check of the known query shapes
+that flags collection scans and in-memory sorts
+"""
+
+import asyncio
+import logging
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import IndexModel
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+IndexKeys = List[Tuple[str, int]]
+
+
+@dataclass
+class QueryShape:
+    """A query a component runs, with representative values, for explain()"""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[IndexKeys] = None
+    limit: int = 0
+
+
+class IndexRegistry:
+    """
+    The indexes each collection needs and the query shapes they serve.
+
+    Components register both at import time, next to the code that runs the
+    queries. ensure_indexes() is safe to run on every startup: creating an
+    index that already exists is a no-op, and an index that conflicts with
+    an existing one (same name, different options) is logged and left alone
+    rather than dropped. explain() plans every registered query shape so a
+    missing or unused index shows up as a COLLSCAN before data volume makes
+    it visible in latency.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, Dict[str, IndexModel]] = {}
+        self._queries: Dict[str, QueryShape] = {}
+        self._ensure_task: Optional[asyncio.Task] = None
+
+    def index(self, collection: str, keys: IndexKeys, **options):
+        """Declare an index (pymongo key list and create_index options) on a collection"""
+        model = IndexModel(keys, **options)
+        self._indexes.setdefault(collection, {})[model.document["name"]] = model
+
+    def query(self, name: str, collection: str, filter: Dict[str, Any],
+              sort: Optional[IndexKeys] = None, limit: int = 0):
+        """Declare a query shape that should be served by an index"""
+        self._queries[name] = QueryShape(name, collection, filter, sort, limit)
+
+    def collections(self) -> List[str]:
+        return sorted(self._indexes)
+
+    async def ensure_indexes(self, db) -> Dict[str, List[str]]:
+        """Create every registered index; returns the index names per collection that exist afterwards"""
+        ensured: Dict[str, List[str]] = {}
+        for collection, models in self._indexes.items():
+            ensured[collection] = []
+            for name, model in models.items():
+                try:
+                    await db[collection].create_indexes([model])
+                    ensured[collection].append(name)
+                except PyMongoError as e:
+                    logger.error(f"Could not create index {collection}.{name}: {str(e)}")
+        logger.info(f"Ensured {sum(len(names) for names in ensured.values())} indexes "
+                    f"on {len(ensured)} collections")
+        return ensured
+
+    def start(self, db):
+        """Create the indexes in the background (call from the running event loop)"""
+        if self._ensure_task is None or self._ensure_task.done():
+            self._ensure_task = asyncio.create_task(self._ensure_indexes_logged(db))
+
+    async def _ensure_indexes_logged(self, db):
+        try:
+            await self.ensure_indexes(db)
+        except Exception as e:
+            logger.error(f"Error ensuring Mongo indexes: {str(e)}")
+
+    async def explain(self, db) -> List[Dict[str, Any]]:
+        """Winning plan summary for every registered query shape"""
+        reports = []
+        for shape in self._queries.values():
+            cursor = db[shape.collection].find(shape.filter)
+            if shape.sort:
+                cursor = cursor.sort(shape.sort)
+            if shape.limit:
+                cursor = cursor.limit(shape.limit)
+
+            try:
+                plan = await cursor.explain()
+            except PyMongoError as e:
+                reports.append({"query": shape.name, "collection": shape.collection, "error": str(e)})
+                continue
+
+            winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+            # Plans from the slot-based engine nest the classic plan tree one level down
+            stages = _plan_stages(winning_plan.get("queryPlan", winning_plan))
+            execution = plan.get("executionStats", {})
+            reports.append({
+                "query": shape.name,
+                "collection": shape.collection,
+                "stages": [stage for stage, _ in stages],
+                "indexes": [index for _, index in stages if index],
+                "collection_scan": any(stage == "COLLSCAN" for stage, _ in stages),
+                "in_memory_sort": any(stage == "SORT" for stage, _ in stages),
+                "docs_examined": execution.get("totalDocsExamined"),
+                "returned": execution.get("nReturned")
+            })
+        return reports
+
+
+def _plan_stages(node: Dict[str, Any]) -> List[Tuple[str, Optional[str]]]:
+    """(stage, index name) for every node of an explain plan tree, outermost first"""
+    stages = [(node.get("stage", "?"), node.get("indexName"))]
+    children = node.get("inputStages", [])
+    if "inputStage" in node:
+        children = [node["inputStage"]]
+    for child in children:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+# Global instance
+index_registry = IndexRegistry()
+
+
+async def _diagnose(apply: bool) -> int:
+    # The server module wires every component to the database, registering their indexes on import
+    import server
+
+    if apply:
+        await index_registry.ensure_indexes(server.db)
+
+    problems = 0
+    for report in await index_registry.explain(server.db):
+        if "error" in report:
+            problems += 1
+            print(f"ERROR     {report['query']} ({report['collection']}): {report['error']}")
+            continue
+        flags = [flag for flag, present in (("COLLSCAN", report["collection_scan"]),
+                                             ("SORT", report["in_memory_sort"])) if present]
+        problems += bool(flags)
+        print(f"{' '.join(flags) or 'OK':<9} {report['query']} ({report['collection']}): "
+              f"{' > '.join(report['stages'])}  indexes={','.join(report['indexes']) or '-'}  "
+              f"examined={report['docs_examined']} returned={report['returned']}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    # python -m lib.mongo_indexes [--apply]: explain every registered query shape (after creating the indexes)
+    logging.basicConfig(level=logging.WARNING)
+    sys.exit(asyncio.run(_diagnose("--apply" in sys.argv[1:])))
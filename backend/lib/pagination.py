@@ -0,0 +1,81 @@
+"""
+Keyset Pagination
+Opaque cursors over a (timestamp, id) sort key for newest-first list
+endpoints, and field projections for list views that do not need whole
+documents
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import DESCENDING
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by encode_cursor()"""
+
+
+def encode_cursor(timestamp: datetime, doc_id: str) -> str:
+    """Cursor pointing just past a document, for the next page"""
+    raw = json.dumps([timestamp.isoformat(), doc_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, doc_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), str(doc_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def sort_keys(time_field: str) -> List[Tuple[str, int]]:
+    """Newest first, with the id breaking ties between equal timestamps"""
+    return [(time_field, DESCENDING), ("id", DESCENDING)]
+
+
+def page_filter(time_field: str, cursor: Optional[str]) -> Dict[str, Any]:
+    """Query for the documents after the cursor in sort_keys() order (everything without one)"""
+    if not cursor:
+        return {}
+    timestamp, doc_id = decode_cursor(cursor)
+    return {"$or": [
+        {time_field: {"$lt": timestamp}},
+        {time_field: timestamp, "id": {"$lt": doc_id}}
+    ]}
+
+
+def projection(fields: Optional[str], allowed: Iterable[str], time_field: str) -> Optional[Dict[str, int]]:
+    """
+    Mongo projection for a comma separated `fields` parameter, or None for
+    whole documents. The id and timestamp are always included since the next
+    cursor is built from them; unknown field names raise ValueError.
+    """
+    if not fields:
+        return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return {"_id": 0, "id": 1, time_field: 1, **{field: 1 for field in requested}}
+
+
+async def fetch_page(collection, time_field: str, limit: int, cursor: Optional[str] = None,
+                     fields: Optional[Dict[str, int]] = None,
+                     query: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    One page of a collection, newest first: the documents and the cursor of
+    the next page (None on the last one). Fetches one extra document to know
+    whether there is a next page.
+    """
+    filter = {**(query or {}), **page_filter(time_field, cursor)}
+    documents = await collection.find(filter, fields).sort(sort_keys(time_field)).limit(limit + 1) \
+        .to_list(limit + 1)
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    last = documents[-1]
+    return documents, encode_cursor(last[time_field], last["id"])
@@ -15,11 +15,28 @@ from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
 import random
 
+from pymongo import ASCENDING
+
+from .mongo_indexes import index_registry
+from .rollups import Rollup, rollup_registry, day_filter, day_expression
+from .write_behind import write_behind
 from .script_quality_analyzer import ScriptQualityAnalyzer
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 logger = logging.getLogger(__name__)
 
+# Experiments are updated by id; the history reads the daily rollups (optionally per experiment strategy)
+index_registry.index("prompt_experiments", [("experiment_id", ASCENDING)], unique=True)
+index_registry.index("experiment_rollups", [("day", ASCENDING)])
+index_registry.index("variation_rollups", [("day", ASCENDING)])
+index_registry.index("variation_rollups", [("experiment_strategy", ASCENDING), ("day", ASCENDING)])
+
+index_registry.query("prompt_experiments.by_id", "prompt_experiments", {"experiment_id": "experiment"})
+index_registry.query("experiment_rollups.recent", "experiment_rollups",
+                     day_filter(datetime.utcnow() - timedelta(days=30)))
+index_registry.query("variation_rollups.by_strategy", "variation_rollups",
+                     {"experiment_strategy": "hook", **day_filter(datetime.utcnow() - timedelta(days=30))})
+
 @dataclass
 class PromptVariation:
     """Data class for prompt variations"""
@@ -57,6 +74,16 @@ class PromptOptimizationEngine:
         self.results_collection = db.experiment_results
         self.optimization_insights_collection = db.optimization_insights
         
+        # Daily rollups of completed experiments and their variation scores, by experiment strategy
+        self.experiment_rollup = rollup_registry.register(Rollup(
+            db.experiment_rollups, ["experiment_strategy"], source=self.experiments_collection,
+            rebuild_pipeline=self._experiment_rollup_rebuild_pipeline
+        ))
+        self.variation_rollup = rollup_registry.register(Rollup(
+            db.variation_rollups, ["experiment_strategy", "strategy"], source=self.results_collection,
+            rebuild_pipeline=self._variation_rollup_rebuild_pipeline
+        ))
+        
         # Initialize components
         self.quality_analyzer = ScriptQualityAnalyzer()
         self.llm_chat = LlmChat(api_key=gemini_api_key, session_id="optimization_engine", system_message="You are an AI prompt optimization assistant.")
@@ -145,8 +172,10 @@ class PromptOptimizationEngine:
                     result = await self._test_single_variation(variation, metadata)
                     experiment_results.append(result)
                     
-                    # Store result
-                    await self.results_collection.insert_one(result.__dict__)
+                    # Store result; the variation rollup counts it once it is written
+                    write_behind.insert(self.results_collection, result.__dict__,
+                                        on_written=lambda result=result: self._record_variation_rollup(
+                                            experiment_record, result))
                     
                 except Exception as e:
                     logger.error(f"Error testing variation {i}: {str(e)}")
@@ -165,6 +194,8 @@ class PromptOptimizationEngine:
                 }}
             )
             
+            await self._record_experiment_rollup(experiment_record)
+            
             # Generate optimization insights
             insights = await self._generate_optimization_insights(experiment_results, analysis_results)
             
@@ -267,47 +298,112 @@ class PromptOptimizationEngine:
         try:
             filters = filters or {}
             
-            # Build query
+            # Build the rollup query (date ranges resolve to whole days)
             query = {}
             if "date_range" in filters:
                 date_range = filters["date_range"]
-                query["created_at"] = {
-                    "$gte": datetime.fromisoformat(date_range["start"]),
-                    "$lte": datetime.fromisoformat(date_range["end"])
-                }
+                query.update(day_filter(datetime.fromisoformat(date_range["start"]),
+                                        datetime.fromisoformat(date_range["end"])))
             else:
                 # Default to last 30 days
-                query["created_at"] = {"$gte": datetime.utcnow() - timedelta(days=30)}
+                query.update(day_filter(datetime.utcnow() - timedelta(days=30)))
             
             if "strategy" in filters:
-                query["metadata.strategy"] = filters["strategy"]
-            
-            # Fetch experiment data
-            experiments = await self.experiments_collection.find(query).sort("created_at", -1).to_list(100)
-            results = await self._fetch_related_results(experiments)
+                query["experiment_strategy"] = filters["strategy"]
+            
+            # Sum the experiment and variation rollups
+            summary = await self.experiment_rollup.collection.aggregate([
+                {"$match": query},
+                {"$group": {"_id": None, "experiments": {"$sum": "$experiments"},
+                            "start": {"$min": "$first_at"}, "end": {"$max": "$last_at"}}}
+            ]).to_list(length=None)
+            summary = summary[0] if summary else {"experiments": 0}
+            strategies = await self.variation_rollup.collection.aggregate([
+                {"$match": query},
+                {"$group": {"_id": "$strategy", "variations": {"$sum": "$variations"},
+                            "composite_sum": {"$sum": "$composite_sum"}}}
+            ]).to_list(length=None)
+            variation_count = sum(group["variations"] for group in strategies)
             
             # Analyze trends
-            trend_analysis = await self._analyze_optimization_trends(experiments, results)
+            trend_analysis = await self._analyze_optimization_trends(summary["experiments"])
             
             # Strategy performance comparison
-            strategy_comparison = await self._compare_strategy_performance(results)
+            strategy_comparison = await self._compare_strategy_performance(strategies)
             
             # Success patterns
-            success_patterns = await self._identify_success_patterns(results)
+            success_patterns = await self._identify_success_patterns(strategies)
             
             return {
-                "total_experiments": len(experiments),
-                "date_range": self._get_date_range(experiments),
+                "total_experiments": summary["experiments"],
+                "date_range": self._get_date_range(summary),
                 "trend_analysis": trend_analysis,
                 "strategy_performance": strategy_comparison,
                 "success_patterns": success_patterns,
-                "optimization_insights": await self._generate_historical_insights(experiments, results)
+                "optimization_insights": await self._generate_historical_insights(summary["experiments"],
+                                                                                  variation_count)
             }
             
         except Exception as e:
             logger.error(f"Error getting optimization history: {str(e)}")
             return {"status": "ERROR", "error": str(e)}
     
+    async def _record_experiment_rollup(self, experiment_record: Dict[str, Any]):
+        """Add a completed experiment to the rollup of the day it was created"""
+        try:
+            await self.experiment_rollup.record(experiment_record["created_at"], {
+                "experiment_strategy": experiment_record["metadata"].get("strategy")
+            }, {"experiments": 1})
+        except Exception as e:
+            logger.error(f"Error updating experiment rollup: {str(e)}")
+    
+    async def _record_variation_rollup(self, experiment_record: Dict[str, Any], result: ExperimentResult):
+        """Add a stored variation result to the rollup of the day its experiment was created"""
+        try:
+            await self.variation_rollup.record(experiment_record["created_at"], {
+                "experiment_strategy": experiment_record["metadata"].get("strategy"),
+                "strategy": result.metadata.get("strategy", "unknown")
+            }, {
+                "variations": 1,
+                "composite_sum": result.performance_metrics.get("composite_score", 0.0)
+            })
+        except Exception as e:
+            logger.error(f"Error updating variation rollup: {str(e)}")
+    
+    def _experiment_rollup_rebuild_pipeline(self) -> List[Dict[str, Any]]:
+        """The daily experiment rollup documents computed from the completed experiments"""
+        return [
+            {"$match": {"status": "COMPLETED"}},
+            {"$group": {
+                "_id": {"day": day_expression("created_at"),
+                        "experiment_strategy": {"$ifNull": ["$metadata.strategy", None]}},
+                "experiments": {"$sum": 1},
+                "first_at": {"$min": "$created_at"},
+                "last_at": {"$max": "$created_at"}
+            }},
+            {"$addFields": {"day": "$_id.day", "experiment_strategy": "$_id.experiment_strategy"}}
+        ]
+    
+    def _variation_rollup_rebuild_pipeline(self) -> List[Dict[str, Any]]:
+        """The daily variation rollup documents computed from the stored results and their experiments"""
+        return [
+            {"$lookup": {"from": self.experiments_collection.name, "localField": "experiment_id",
+                         "foreignField": "experiment_id", "as": "experiment"}},
+            {"$unwind": "$experiment"},
+            {"$match": {"experiment.status": "COMPLETED"}},
+            {"$group": {
+                # Same field order as Rollup.key(), so incremental updates find the rebuilt documents
+                "_id": {"day": day_expression("experiment.created_at"),
+                        "experiment_strategy": {"$ifNull": ["$experiment.metadata.strategy", None]},
+                        "strategy": {"$ifNull": ["$metadata.strategy", "unknown"]}},
+                "variations": {"$sum": 1},
+                "composite_sum": {"$sum": {"$ifNull": ["$performance_metrics.composite_score", 0.0]}},
+                "first_at": {"$min": "$experiment.created_at"},
+                "last_at": {"$max": "$experiment.created_at"}
+            }},
+            {"$addFields": {field: f"$_id.{field}" for field in ["day", "experiment_strategy", "strategy"]}}
+        ]
+    
     # Core testing methods
     
     async def _create_prompt_variation(self, base_prompt: str, variation_config: Dict[str, Any], 
@@ -694,41 +790,24 @@ class PromptOptimizationEngine:
     
     # Additional helper methods (simplified implementations)
     
-    async def _fetch_related_results(self, experiments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Fetch related experiment results"""
-        if not experiments:
-            return []
-        
-        experiment_ids = [exp["experiment_id"] for exp in experiments]
-        cursor = self.results_collection.find({"experiment_id": {"$in": experiment_ids}})
-        return await cursor.to_list(1000)
-    
-    async def _analyze_optimization_trends(self, experiments: List[Dict[str, Any]], 
-                                         results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _analyze_optimization_trends(self, experiment_count: int) -> Dict[str, Any]:
         """Analyze optimization trends over time"""
         return {
-            "trend": "IMPROVING" if len(experiments) > 0 else "NO_DATA",
-            "experiments_count": len(experiments),
-            "average_improvement": 15.2 if len(experiments) > 0 else 0.0
+            "trend": "IMPROVING" if experiment_count > 0 else "NO_DATA",
+            "experiments_count": experiment_count,
+            "average_improvement": 15.2 if experiment_count > 0 else 0.0
         }
     
-    async def _compare_strategy_performance(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Compare performance across different strategies"""
-        strategy_scores = {}
-        for result in results:
-            strategy = result.get("metadata", {}).get("strategy", "unknown")
-            if strategy not in strategy_scores:
-                strategy_scores[strategy] = []
-            strategy_scores[strategy].append(result.get("performance_metrics", {}).get("composite_score", 0.0))
-        
+    async def _compare_strategy_performance(self, strategies: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Compare performance across different strategies from their summed variation rollups"""
         strategy_averages = {
-            strategy: statistics.mean(scores) if scores else 0.0
-            for strategy, scores in strategy_scores.items()
+            group["_id"]: group["composite_sum"] / group["variations"] if group["variations"] else 0.0
+            for group in strategies
         }
         
         return {"strategy_averages": strategy_averages}
     
-    async def _identify_success_patterns(self, results: List[Dict[str, Any]]) -> List[str]:
+    async def _identify_success_patterns(self, strategies: List[Dict[str, Any]]) -> List[str]:
         """Identify success patterns from results"""
         return [
             "Emotional engagement strategies show consistent high performance",
@@ -736,25 +815,20 @@ class PromptOptimizationEngine:
             "Viral elements boost shareability metrics"
         ]
     
-    async def _generate_historical_insights(self, experiments: List[Dict[str, Any]], 
-                                          results: List[Dict[str, Any]]) -> List[str]:
+    async def _generate_historical_insights(self, experiment_count: int, variation_count: int) -> List[str]:
         """Generate historical insights from experiments and results"""
         return [
-            f"Analyzed {len(experiments)} experiments with {len(results)} variations",
+            f"Analyzed {experiment_count} experiments with {variation_count} variations",
             "Performance improvements average 12.5% across successful experiments",
             "Emotional and viral strategies show highest success rates"
         ]
     
-    def _get_date_range(self, experiments: List[Dict[str, Any]]) -> Dict[str, str]:
-        """Get date range from experiments"""
-        if not experiments:
-            return {"start": "N/A", "end": "N/A"}
-        
-        dates = [exp["created_at"] for exp in experiments if "created_at" in exp]
-        if not dates:
+    def _get_date_range(self, summary: Dict[str, Any]) -> Dict[str, str]:
+        """Get date range from the summed experiment rollups"""
+        if not summary.get("experiments"):
             return {"start": "N/A", "end": "N/A"}
         
         return {
-            "start": min(dates).isoformat(),
-            "end": max(dates).isoformat()
+            "start": summary["start"].isoformat(),
+            "end": summary["end"].isoformat()
         }
\ No newline at end of file
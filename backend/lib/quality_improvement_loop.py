@@ -9,7 +9,7 @@ import json
 import uuid
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 import statistics
 from collections import defaultdict, deque
 import numpy as np
@@ -17,6 +17,7 @@ import numpy as np
 from .multi_model_validator import MultiModelValidator, ConsensusValidationResult
 from .advanced_quality_metrics import AdvancedQualityMetrics
 from .prompt_optimization_engine import PromptOptimizationEngine
+from .write_behind import write_behind
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 logger = logging.getLogger(__name__)
@@ -171,7 +172,7 @@ class QualityImprovementLoop:
             await self._learn_from_improvement_cycle(improvement_cycle)
             
             # Phase 5: Store improvement cycle data
-            await self.improvement_cycles_collection.insert_one(improvement_cycle.__dict__)
+            write_behind.insert(self.improvement_cycles_collection, asdict(improvement_cycle))
             
             # Phase 6: Return optimized result
             final_script = improvement_cycle.best_improvement["script"] if improvement_cycle.best_improvement else initial_script
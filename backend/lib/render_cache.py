@@ -0,0 +1,155 @@
+"""
+Render Result Cache
+Maps avatar video requests to videos already in the video store, so a
+re-submitted request returns immediately, and coalesces concurrent identical
+requests into a single render
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Optional, Dict, Any, Callable, Awaitable, Tuple
+
+from lib.video_store import VideoStore, RENDER_KEY_VERSION, video_store
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(generator: str, audio_base64: str, asset_fingerprint: str, **options) -> str:
+    """
+    Cache key of a render request: the audio payload, the shipped assets
+    (avatars and backgrounds, via the manifest fingerprint) and every
+    request option that changes the output (avatar choice, script and so the
+    background plan, timing track, quality tier)
+    """
+    key = {
+        "version": RENDER_KEY_VERSION,
+        "generator": generator,
+        "audio": hashlib.sha256(audio_base64.encode('ascii', errors='replace')).hexdigest(),
+        "assets": asset_fingerprint,
+        "options": options
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    """
+    Request key -> render result (video id and response metadata).
+
+    Results are small JSON files next to the video store so every API process
+    shares them; an entry is only a hit while its video is still in the
+    store. Identical requests arriving while one is rendering wait for that
+    render instead of starting their own (single-flight, per process); their
+    job ids are handed to alias_job so they can be polled and cancelled as
+    the render's own.
+    """
+
+    def __init__(self, cache_dir: Path, video_store: VideoStore):
+        self.cache_dir = Path(cache_dir)
+        self.video_store = video_store
+        # key -> (future of the render, job id of the request rendering it)
+        self._inflight: Dict[str, Tuple[asyncio.Future, Optional[str]]] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._entry_path(key), 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if self.video_store.get(result["video_id"]) is None:
+            # The video was evicted from the store
+            self._entry_path(key).unlink(missing_ok=True)
+            return None
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]):
+        entry = {k: v for k, v in result.items() if k != "video_base64"}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._entry_path(key).with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self._entry_path(key))
+
+    def with_base64(self, result: Dict[str, Any], return_base64: bool) -> Dict[str, Any]:
+        """The result with video_base64 filled from the store when asked for (and cleared otherwise)"""
+        result = dict(result)
+        if not return_base64:
+            result["video_base64"] = None
+        elif not result.get("video_base64"):
+            with open(self.video_store.get(result["video_id"]), 'rb') as video_file:
+                result["video_base64"] = base64.b64encode(video_file.read()).decode('utf-8')
+        return result
+
+    async def get_or_render(self, key: str, render: Callable[[], Awaitable[Dict[str, Any]]],
+                            job_id: Optional[str] = None,
+                            alias_job: Optional[Callable[[str, str], None]] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        The cached result for key, or the result of render(); returns
+        (result, cached). Concurrent callers with the same key share one render:
+        a caller that joins one in flight has alias_job(its job_id, the
+        rendering caller's job_id) called.
+        """
+        while True:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached, True
+
+            entry = self._inflight.get(key)
+            if entry is None:
+                break
+            inflight, leader_job_id = entry
+            if job_id and leader_job_id and alias_job is not None:
+                alias_job(job_id, leader_job_id)
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight), True
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The request doing the render went away; try again (and render ourselves if needed)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (future, job_id)
+        try:
+            result = await render()
+            self.put(key, result)
+            future.set_result(result)
+            return result, False
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 3) if lookups else 0.0
+        }
+
+
+# Global instance
+render_cache = RenderCache(Path(os.environ.get("RENDER_CACHE_DIR", "/app/tmp/render_cache")), video_store)
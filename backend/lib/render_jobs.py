@@ -0,0 +1,44 @@
+"""
+Render Jobs
+Picklable entry points run inside the render worker processes; each worker
+imports the generators once and reuses them for every job it runs
+"""
+
+
+def render_avatar_video(*args):
+    from lib.avatar_generator import avatar_generator
+    return avatar_generator.generate_avatar_video(*args)
+
+
+def render_enhanced_avatar_video(*args):
+    from lib.enhanced_avatar_generator import enhanced_avatar_generator
+    return enhanced_avatar_generator.generate_enhanced_avatar_video(*args)
+
+
+def render_ultra_realistic_video(*args):
+    from lib.ultra_realistic_avatar_generator import ultra_realistic_avatar_generator
+    return ultra_realistic_avatar_generator.generate_ultra_realistic_video(*args)
+
+
+def ultra_realistic_renderer(ai_model: str, quality: str):
+    """The (lip-sync model, renderer) an ultra-realistic request resolves to, for keying its render"""
+    from lib.render_quality import get_render_quality
+    from lib.ultra_realistic_avatar_generator import ultra_realistic_avatar_generator
+    return ultra_realistic_avatar_generator.select_renderer(ai_model, get_render_quality(quality))
+
+
+def promote_render(request_id: str, return_base64: bool = False):
+    """Re-render a preview at final quality from its saved render plan"""
+    from lib.render_plans import render_plan_store
+    plan = render_plan_store.load(request_id)
+    if plan is None:
+        raise KeyError(f"No render plan for preview {request_id}")
+
+    if plan["generator"] == "avatar":
+        from lib.avatar_generator import avatar_generator
+        return avatar_generator.promote_avatar_video(request_id, return_base64)
+    if plan["generator"] == "enhanced":
+        from lib.enhanced_avatar_generator import enhanced_avatar_generator
+        return enhanced_avatar_generator.promote_enhanced_avatar_video(request_id, return_base64)
+    from lib.ultra_realistic_avatar_generator import ultra_realistic_avatar_generator
+    return ultra_realistic_avatar_generator.promote_ultra_realistic_video(request_id, return_base64)
@@ -0,0 +1,159 @@
+"""
+Render Plans
+Everything a preview render worked out (audio, decoded samples, avatar,
+lip-sync timing, background timeline) kept on disk for a while, so the
+preview can be promoted to a final render without redoing that work
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+import numpy as np
+
+from lib.audio_timing import SpeechTiming
+from lib.background_compositor import foreground_mask_path
+from lib.decoded_audio import DecodedAudio
+
+logger = logging.getLogger(__name__)
+
+PLAN_FILE = "plan.json"
+
+
+class RenderPlanStore:
+    """
+    One directory per preview request id under plans_dir.
+
+    Plans are shared between the API process and the render workers through
+    the filesystem and expire after ttl_seconds; expired plans are removed
+    whenever a new one is saved.
+    """
+
+    def __init__(self, plans_dir: Path, ttl_seconds: float = 3600):
+        self.plans_dir = Path(plans_dir)
+        self.ttl_seconds = ttl_seconds
+
+    def _plan_dir(self, request_id: str) -> Path:
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", request_id or ""):
+            raise KeyError(f"Invalid render plan id: {request_id}")
+        return self.plans_dir / request_id
+
+    def save(self, request_id: str, generator: str, params: Dict[str, Any],
+             files: Optional[Dict[str, str]] = None, arrays: Optional[Dict[str, np.ndarray]] = None) -> Path:
+        """
+        Store a plan: JSON params, copies of the given files (inputs that are
+        deleted after the preview, such as the request audio) and numpy arrays
+        """
+        self.prune()
+        plan_dir = self._plan_dir(request_id)
+        plan_dir.mkdir(parents=True, exist_ok=True)
+
+        stored_files = {}
+        for key, path in (files or {}).items():
+            name = f"{key}{Path(path).suffix}"
+            shutil.copyfile(path, plan_dir / name)
+            stored_files[key] = name
+        for key, array in (arrays or {}).items():
+            name = f"{key}.npy"
+            np.save(plan_dir / name, array)
+            stored_files[key] = name
+
+        plan = {"generator": generator, "params": params, "files": stored_files, "created_at": time.time()}
+        tmp_path = plan_dir / f"{PLAN_FILE}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f)
+        os.replace(tmp_path, plan_dir / PLAN_FILE)
+
+        logger.info(f"Saved {generator} render plan {request_id}")
+        return plan_dir
+
+    def save_render_inputs(self, request_id: str, generator: str, audio: DecodedAudio,
+                           speech_timing: Optional[SpeechTiming], avatar_path: str, copy_avatar: bool,
+                           **params) -> Path:
+        """
+        Keep a preview's inputs: the encoded audio and its decoded samples,
+        the timing track, the avatar (copied when it is a temporary file such
+        as an upload) and any generator specific params
+        """
+        files = {"audio": audio.source_path}
+        params["sample_rate"] = audio.sample_rate
+        if copy_avatar:
+            files["avatar"] = avatar_path
+            # Stored as avatar.mask.png, where foreground_mask_path() finds it next to the copied avatar
+            mask_path = foreground_mask_path(avatar_path)
+            if mask_path is not None:
+                files["avatar.mask"] = mask_path
+        else:
+            params["avatar_path"] = avatar_path
+        if speech_timing is not None:
+            params["word_timings"] = [word.to_dict() for word in speech_timing.words]
+            params["audio_duration_seconds"] = speech_timing.duration_seconds
+        return self.save(request_id, generator, params, files=files, arrays={"samples": audio.samples})
+
+    def load_render_inputs(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """A saved preview's inputs ready to render again, or None if the plan is unknown or expired"""
+        plan = self.load(request_id)
+        if plan is None:
+            return None
+
+        params = plan["params"]
+        speech_timing = None
+        if "audio_duration_seconds" in params:
+            speech_timing = SpeechTiming.from_payload(None, params.pop("word_timings"),
+                                                      params.pop("audio_duration_seconds"))
+        return {
+            "generator": plan["generator"],
+            "audio": DecodedAudio.with_samples(plan["files"]["audio"], np.load(plan["files"]["samples"]),
+                                               params.pop("sample_rate")),
+            "speech_timing": speech_timing,
+            "avatar_path": plan["files"].get("avatar") or params.pop("avatar_path"),
+            "params": params
+        }
+
+    def load(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """The stored plan with absolute file paths, or None if it is unknown or expired"""
+        try:
+            plan_path = self._plan_dir(request_id) / PLAN_FILE
+        except KeyError:
+            return None
+        if not plan_path.exists():
+            return None
+
+        with open(plan_path, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+        if time.time() - plan["created_at"] > self.ttl_seconds:
+            self.discard(request_id)
+            return None
+
+        plan["files"] = {key: str(plan_path.parent / name) for key, name in plan["files"].items()}
+        return plan
+
+    def discard(self, request_id: str):
+        try:
+            shutil.rmtree(self._plan_dir(request_id), ignore_errors=True)
+        except KeyError:
+            pass
+
+    def prune(self) -> int:
+        """Remove expired plans; returns how many were removed"""
+        if not self.plans_dir.exists():
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        removed = 0
+        for plan_dir in self.plans_dir.iterdir():
+            if plan_dir.is_dir() and plan_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(plan_dir, ignore_errors=True)
+                removed += 1
+        return removed
+
+
+# Global instance
+render_plan_store = RenderPlanStore(
+    Path(os.environ.get("RENDER_PLAN_DIR", "/app/tmp/render_plans")),
+    ttl_seconds=float(os.environ.get("RENDER_PLAN_TTL_SECONDS", "3600"))
+)
@@ -0,0 +1,51 @@
+"""
+Render Quality Tiers
+Encoder and frame settings for fast preview renders versus the full
+quality final render of the avatar videos
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class RenderQuality:
+    """
+    A render tier. Unset fields keep the generator's own settings, so the
+    final tier renders exactly as before.
+    """
+    name: str
+    scale: float = 1.0
+    fps: Optional[int] = None
+    preset: Optional[str] = None
+    crf: Optional[int] = None
+    audio_bitrate: str = "128k"
+
+    @property
+    def is_preview(self) -> bool:
+        return self.scale < 1.0 or self.fps is not None
+
+    def frame_rate(self, default: int) -> int:
+        return self.fps or default
+
+    def encoder_settings(self, preset: str = "medium", crf: int = 23) -> dict:
+        """FFmpegFrameWriter keyword arguments for this tier"""
+        return {
+            "preset": self.preset or preset,
+            "crf": self.crf if self.crf is not None else crf,
+            "audio_bitrate": self.audio_bitrate
+        }
+
+
+# Half-size frames at half the frame rate with the fastest x264 preset: a few times cheaper to render
+PREVIEW = RenderQuality("preview", scale=0.5, fps=15, preset="ultrafast", crf=30, audio_bitrate="64k")
+FINAL = RenderQuality("final")
+
+RENDER_QUALITIES = {quality.name: quality for quality in (PREVIEW, FINAL)}
+
+
+def get_render_quality(name: str) -> RenderQuality:
+    quality = RENDER_QUALITIES.get(name)
+    if quality is None:
+        raise ValueError(f"Unknown render quality: {name} (expected one of {', '.join(RENDER_QUALITIES)})")
+    return quality
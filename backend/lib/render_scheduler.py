@@ -0,0 +1,430 @@
+"""
+Render Scheduler
+Process-wide scheduler for avatar video renders: a fixed-size process pool,
+a bounded admission queue, per-job CPU thread budgets, and progress and
+cancellation of running jobs
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """Raised when a render is submitted while the queue is at its maximum depth"""
+
+    def __init__(self, queued: int, retry_after_seconds: int):
+        super().__init__(f"Render queue is full ({queued} jobs waiting)")
+        self.queued = queued
+        self.retry_after_seconds = retry_after_seconds
+
+
+class RenderCancelled(Exception):
+    """Raised inside a render job (and by submit()) when the job was cancelled"""
+
+
+# Cancelled job ids shared with the workers: a ring of fixed-width slots
+CANCEL_SLOTS = 64
+JOB_ID_BYTES = 64
+
+# Worker process state: the job being run, where to send its progress and whether it was cancelled,
+# and the cores held by all running jobs (shared by the workers)
+_progress_queue = None
+_cancelled_jobs = None
+_cores_in_use = None
+_cpu_count = 1
+_current_job_id: Optional[str] = None
+_cancel_requested = False
+_last_reported: Optional[tuple] = None
+
+
+def _mark_cancelled(cancelled_jobs, slot: int, job_id: str):
+    offset = (slot % CANCEL_SLOTS) * JOB_ID_BYTES
+    with cancelled_jobs.get_lock():
+        cancelled_jobs[offset:offset + JOB_ID_BYTES] = job_id.encode("ascii").ljust(JOB_ID_BYTES, b"\0")
+
+
+def _is_marked_cancelled(cancelled_jobs, job_id: str) -> bool:
+    key = job_id.encode("ascii").ljust(JOB_ID_BYTES, b"\0")
+    with cancelled_jobs.get_lock():
+        raw = cancelled_jobs.raw
+    return any(raw[offset:offset + JOB_ID_BYTES] == key for offset in range(0, len(raw), JOB_ID_BYTES))
+
+
+def _init_render_worker(threads: int, progress_queue=None, cancelled_jobs=None, cores_in_use=None,
+                        cpu_count: int = 1):
+    """Cap every thread pool a render job can start to the job's core budget"""
+    global _progress_queue, _cancelled_jobs, _cores_in_use, _cpu_count
+    threads = str(threads)
+    os.environ["RENDER_THREADS"] = threads
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+        os.environ[var] = threads
+
+    import cv2
+    cv2.setNumThreads(int(threads))
+
+    if progress_queue is not None:
+        _progress_queue = progress_queue
+        _cancelled_jobs = cancelled_jobs
+        _cores_in_use = cores_in_use
+        _cpu_count = cpu_count
+        signal.signal(signal.SIGUSR1, _request_cancel)
+
+
+def _request_cancel(signum, frame):
+    # Only a flag: the job stops at its next check_cancelled(), so no cleanup is interrupted halfway
+    global _cancel_requested
+    _cancel_requested = True
+
+
+def _run_render_job(job_id: str, fn: Callable, *args) -> Any:
+    """Worker side wrapper: runs fn(*args) as the current job so it can report progress and be cancelled"""
+    global _current_job_id, _cancel_requested, _last_reported
+    _current_job_id, _cancel_requested, _last_reported = job_id, False, None
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, "started", os.getpid(), None))
+    own_cores = _hold_cores(int(os.environ.get("RENDER_THREADS", "1")))
+    try:
+        return fn(*args)
+    finally:
+        release_cores(own_cores)
+        _current_job_id = None
+
+
+def _hold_cores(count: int) -> int:
+    if _cores_in_use is None:
+        return 0
+    with _cores_in_use.get_lock():
+        _cores_in_use.value += count
+    return count
+
+
+def idle_cores() -> int:
+    """Cores no running render job holds right now (0 outside a render worker)"""
+    if _cores_in_use is None:
+        return 0
+    return max(0, _cpu_count - _cores_in_use.value)
+
+
+def lease_idle_cores(wanted: int) -> int:
+    """
+    Reserve up to `wanted` idle cores for the current job on top of its own
+    budget; returns how many it got. Give them back with release_cores().
+    Jobs started afterwards still get their own budget, so a lease only
+    keeps other leases from counting the same cores.
+    """
+    if _cores_in_use is None or wanted <= 0:
+        return 0
+    with _cores_in_use.get_lock():
+        granted = max(0, min(wanted, _cpu_count - _cores_in_use.value))
+        _cores_in_use.value += granted
+    return granted
+
+
+def release_cores(count: int):
+    if _cores_in_use is None or count <= 0:
+        return
+    with _cores_in_use.get_lock():
+        _cores_in_use.value -= count
+
+
+def check_cancelled():
+    """Raise RenderCancelled if the current render job was cancelled; cheap enough to call per frame"""
+    global _cancel_requested
+    if _cancel_requested and _current_job_id is not None:
+        if _cancelled_jobs is None or _is_marked_cancelled(_cancelled_jobs, _current_job_id):
+            raise RenderCancelled(f"Render job {_current_job_id} was cancelled")
+        # A late signal meant for a job this worker already finished
+        _cancel_requested = False
+
+
+def report_progress(percent: float, stage: Optional[str] = None):
+    """
+    Report the current render job's progress (0-100) for the stage it is
+    in. A no-op outside a render worker; only whole-percent changes are sent.
+    """
+    global _last_reported
+    if _progress_queue is None or _current_job_id is None:
+        return
+    update = (stage, int(max(0.0, min(percent, 100.0))))
+    if update != _last_reported:
+        _last_reported = update
+        _progress_queue.put((_current_job_id, "progress", update[1], stage))
+
+
+class RenderScheduler:
+    """
+    Runs CPU-heavy render jobs in a shared pool of worker processes.
+
+    At most `workers` renders run at once, each limited to
+    cpu_count // workers threads (OpenCV, BLAS and the ffmpeg encoder), so
+    concurrent requests share the machine instead of each trying to use all
+    of it. A job that can split its work (segmented renders) also leases the
+    cores no running job holds, so it scales up on an idle machine. Further jobs wait in a queue of at most `max_queue_depth`; beyond
+    that submit() raises RenderQueueFull so the API can answer 429 with a
+    Retry-After estimate.
+
+    Every job gets an id (the caller's or a generated one). Workers send
+    progress back over a queue that a reader thread folds into job_status();
+    cancel() signals the worker running a job, which stops at its next
+    cancellation check and kills its ffmpeg processes. Finished jobs are
+    remembered for the last `job_history` submissions. alias() lets further
+    ids (requests coalesced onto a render already in flight) stand for a job.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue_depth: int = 8,
+                 cpu_count: Optional[int] = None, job_history: int = 500):
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        self.workers = max(1, workers or max(1, self.cpu_count // 2))
+        self.threads_per_job = max(1, self.cpu_count // self.workers)
+        self.max_queue_depth = max_queue_depth
+        self.job_history = job_history
+
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._aliases: "OrderedDict[str, str]" = OrderedDict()
+        self._progress_queue = None
+        self._progress_reader: Optional[threading.Thread] = None
+        self._cancelled_jobs = None
+        self._cancel_slot = 0
+        self._cores_in_use = None
+
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn keeps the event loop, Mongo client and other server state out of the workers
+            context = multiprocessing.get_context("spawn")
+            if self._progress_queue is None:
+                self._progress_queue = context.Queue()
+                self._cancelled_jobs = context.Array("c", CANCEL_SLOTS * JOB_ID_BYTES)
+                self._cores_in_use = context.Value("i", 0)
+                self._progress_reader = threading.Thread(target=self._read_progress, daemon=True,
+                                                         name="render-progress")
+                self._progress_reader.start()
+            # A fresh pool (also after a worker died holding its cores) starts with every core idle
+            self._cores_in_use.value = 0
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_render_worker,
+                initargs=(self.threads_per_job, self._progress_queue, self._cancelled_jobs, self._cores_in_use,
+                          self.cpu_count)
+            )
+            logger.info(f"Started render pool: {self.workers} workers x {self.threads_per_job} threads")
+        return self._executor
+
+    def _read_progress(self):
+        while True:
+            event = self._progress_queue.get()
+            if event is None:
+                return
+            job_id, kind, value, stage = event
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "started":
+                job["pid"] = value
+                if job.get("cancel_requested"):
+                    # Cancelled between being handed to the pool and starting
+                    self._signal_cancel(job_id, job)
+            elif kind == "progress" and job["state"] == "running":
+                job["progress"] = value
+                job["stage"] = stage
+
+    def _track_job(self, job_id: str) -> Dict[str, Any]:
+        job = {"state": "queued", "progress": 0, "stage": None, "pid": None, "submitted_at": time.time(),
+               "task": asyncio.current_task()}
+        self._aliases.pop(job_id, None)
+        self._jobs[job_id] = job
+        while len(self._jobs) > self.job_history:
+            oldest_id = next(iter(self._jobs))
+            if self._jobs[oldest_id]["state"] in ("queued", "running"):
+                break
+            self._jobs.pop(oldest_id)
+        return job
+
+    def _signal_cancel(self, job_id: str, job: Dict[str, Any]):
+        # The id goes first: the worker only stops if the job it is running is marked
+        _mark_cancelled(self._cancelled_jobs, self._cancel_slot, job_id)
+        self._cancel_slot += 1
+        try:
+            os.kill(job["pid"], signal.SIGUSR1)
+        except ProcessLookupError:
+            pass
+
+    def retry_after_seconds(self) -> int:
+        """Rough time until a queue slot frees up, from the average render time"""
+        average_run = self.total_run_seconds / self.completed if self.completed else 30.0
+        return max(1, int(average_run * (self.queued + 1) / self.workers))
+
+    async def submit(self, fn: Callable, *args, job_id: Optional[str] = None) -> Any:
+        """
+        Run fn(*args) in the render pool; raises RenderQueueFull when the
+        queue is full and RenderCancelled when the job is cancelled. If the
+        awaiting task itself is cancelled (e.g. the client went away), the
+        running job is cancelled too.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        if self.queued >= self.max_queue_depth:
+            self.rejected += 1
+            raise RenderQueueFull(self.queued, self.retry_after_seconds())
+
+        job_id = job_id or uuid.uuid4().hex
+        job = self._track_job(job_id)
+        self.submitted += 1
+        self.queued += 1
+        enqueued_at = time.monotonic()
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            self._finish_job(job, "cancelled")
+            if job.get("cancel_requested"):
+                raise RenderCancelled(f"Render job {job_id} was cancelled") from None
+            raise
+        finally:
+            self.queued -= 1
+
+        try:
+            wait_seconds = time.monotonic() - enqueued_at
+            self.total_wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+            self.running += 1
+            job["state"] = "running"
+            started_at = time.monotonic()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self._get_executor(), _run_render_job, job_id, fn, *args
+                )
+            except asyncio.CancelledError:
+                # Nobody is waiting for the result any more: stop the worker instead of finishing the render
+                self.cancel(job_id)
+                self._finish_job(job, "cancelled")
+                raise
+            except RenderCancelled:
+                self._finish_job(job, "cancelled")
+                raise
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM killed); start a fresh pool for the next job
+                logger.error("Render worker process died, restarting render pool")
+                self._executor = None
+                self.failed += 1
+                self._finish_job(job, "failed")
+                raise RuntimeError("Render worker process died")
+            except Exception:
+                self.failed += 1
+                self._finish_job(job, "failed")
+                raise
+            finally:
+                self.running -= 1
+
+            self.completed += 1
+            self.total_run_seconds += time.monotonic() - started_at
+            job["progress"] = 100
+            self._finish_job(job, "completed")
+            return result
+        finally:
+            self._slots.release()
+
+    def _finish_job(self, job: Dict[str, Any], state: str):
+        if state == "cancelled" and job["state"] != "cancelled":
+            self.cancelled += 1
+        job["state"] = state
+        job["finished_at"] = time.time()
+        job["task"] = None
+
+    def alias(self, job_id: str, target_job_id: str):
+        """
+        Make job_id refer to another job, e.g. for a request whose render was
+        coalesced onto an identical one; cancelling either id cancels the
+        shared render
+        """
+        if job_id == target_job_id:
+            return
+        self._aliases[job_id] = target_job_id
+        self._aliases.move_to_end(job_id)
+        while len(self._aliases) > self.job_history:
+            self._aliases.popitem(last=False)
+
+    def _resolve(self, job_id: str) -> str:
+        return self._aliases.get(job_id, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued or running job; returns False if it is unknown or already finished"""
+        job_id = self._resolve(job_id)
+        job = self._jobs.get(job_id)
+        if job is None or job["state"] not in ("queued", "running"):
+            return False
+
+        job["cancel_requested"] = True
+        if job["state"] == "queued":
+            job["task"].cancel()
+        elif job["pid"] is not None:
+            self._signal_cancel(job_id, job)
+        # Otherwise the worker is signalled as soon as it reports that it started the job
+        logger.info(f"Cancelling render job {job_id}")
+        return True
+
+    def job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(self._resolve(job_id))
+        if job is None:
+            return None
+        return {
+            "job_id": job_id,
+            "state": job["state"],
+            "progress": job["progress"],
+            "stage": job["stage"],
+            "submitted_at": job["submitted_at"],
+            "finished_at": job.get("finished_at")
+        }
+
+    def metrics(self) -> Dict[str, Any]:
+        started = self.submitted - self.queued
+        return {
+            "workers": self.workers,
+            "threads_per_job": self.threads_per_job,
+            "cores_in_use": self._cores_in_use.value if self._cores_in_use is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "queued": self.queued,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avg_wait_seconds": round(self.total_wait_seconds / started, 3) if started else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+            "avg_run_seconds": round(self.total_run_seconds / self.completed, 3) if self.completed else 0.0
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
@@ -0,0 +1,147 @@
+"""
+Render Workspaces
+An isolated scratch directory per render job, removed when the job ends,
+plus a janitor for directories left behind by crashed or killed workers
+"""
+
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = ".lock"
+# Directories being set up; they only appear under their job name once locked
+STAGING_PREFIX = "."
+
+
+class RenderWorkspaces:
+    """
+    Job directories under root, one per render job.
+
+    A job holds an exclusive flock on the .lock file inside its directory for
+    as long as it runs, so the janitor (in any process) can tell live jobs
+    from orphans: it only removes directories whose lock it can take, oldest
+    first, once they are older than max_age_seconds or the workspaces total
+    more than max_bytes. Locks die with their process, so a killed worker's
+    directory becomes purgeable immediately. A new directory is created and
+    locked under a hidden staging name and only then renamed into place, so
+    the janitor never sees a job directory that is not locked yet.
+
+    Point root at a tmpfs mount (e.g. /dev/shm/render_jobs) to keep the
+    intermediate audio and video files off disk.
+    """
+
+    def __init__(self, root: Path, max_age_seconds: float = 3600, max_bytes: int = 2 * 1024 ** 3,
+                 janitor_interval_seconds: float = 60):
+        self.root = Path(root)
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.janitor_interval_seconds = janitor_interval_seconds
+        self._last_purge = 0.0
+
+    @contextmanager
+    def job(self, name: str, workdir: Optional[Path] = None) -> Iterator[Path]:
+        """
+        A fresh directory for one render job, removed (with everything in it)
+        on exit. A workdir of an already running job is used as-is.
+        """
+        if workdir is not None:
+            yield workdir
+            return
+        if time.monotonic() - self._last_purge > self.janitor_interval_seconds:
+            self.purge()
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        job_dir = staging_dir = Path(tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{name}-", dir=self.root))
+        lock_fd = None
+        try:
+            lock_fd = os.open(staging_dir / LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o600)
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            target = self.root / staging_dir.name[len(STAGING_PREFIX):]
+            os.rename(staging_dir, target)
+            job_dir = target
+            yield job_dir
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            if lock_fd is not None:
+                os.close(lock_fd)
+
+    def purge(self) -> int:
+        """Remove orphaned job directories by age and total size; returns how many were removed"""
+        self._last_purge = time.monotonic()
+        if not self.root.exists():
+            return 0
+
+        cutoff = time.time() - self.max_age_seconds
+        entries: List[Tuple[float, int, Path]] = []
+        for job_dir in self.root.iterdir():
+            if not job_dir.is_dir():
+                continue
+            if job_dir.name.startswith(STAGING_PREFIX):
+                # Staging takes microseconds; only one abandoned by a crash gets this old
+                try:
+                    if job_dir.stat().st_mtime < cutoff:
+                        shutil.rmtree(job_dir, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                entries.append((job_dir.stat().st_mtime, self._dir_size(job_dir), job_dir))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, job_dir in sorted(entries):
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            if self._remove_if_orphaned(job_dir):
+                total -= size
+                removed += 1
+
+        if removed:
+            logger.info(f"Removed {removed} orphaned render job directories from {self.root}")
+        return removed
+
+    def _remove_if_orphaned(self, job_dir: Path) -> bool:
+        try:
+            lock_fd = os.open(job_dir / LOCK_FILE, os.O_RDWR)
+        except FileNotFoundError:
+            # Not one of ours, or already being removed
+            return False
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # A live job still holds it
+            os.close(lock_fd)
+            return False
+        try:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        finally:
+            os.close(lock_fd)
+        return True
+
+    def _dir_size(self, path: Path) -> int:
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    size += os.lstat(os.path.join(dirpath, filename)).st_size
+                except FileNotFoundError:
+                    pass
+        return size
+
+
+# Global instance
+render_workspaces = RenderWorkspaces(
+    Path(os.environ.get("RENDER_WORKSPACE_DIR", "/app/tmp/render_jobs")),
+    max_age_seconds=float(os.environ.get("RENDER_WORKSPACE_MAX_AGE_SECONDS", "3600")),
+    max_bytes=int(os.environ.get("RENDER_WORKSPACE_MAX_BYTES", str(2 * 1024 ** 3)))
+)
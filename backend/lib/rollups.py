@@ -0,0 +1,129 @@
+"""
+Dashboard Rollups
+Per-day summary documents maintained incrementally as raw records are
+written, so dashboards read a handful of pre-aggregated documents however
+long the history is, plus rebuilding them from the raw data
+"""
+
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def day_key(at: datetime) -> str:
+    """The rollup day (UTC, like the stored timestamps) a record falls on"""
+    return at.strftime("%Y-%m-%d")
+
+
+def day_filter(start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict[str, Any]:
+    """Rollup query on the day field for a timestamp range; rollups resolve whole days only"""
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = day_key(start)
+    if end is not None:
+        bounds["$lte"] = day_key(end)
+    return {"day": bounds} if bounds else {}
+
+
+def day_expression(field: str) -> Dict[str, Any]:
+    """Aggregation expression for the rollup day of a raw record's timestamp field"""
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": f"${field}"}}
+
+
+class Rollup:
+    """
+    One rollup collection: a document per day and combination of dimension
+    values, keyed by {"day": ..., **dimensions} and holding counters and
+    sums that writers $inc, plus $min/$max fields. Means are sum / count at
+    read time, so updates commute and never touch the raw rows.
+
+    rebuild_pipeline(), if given, is an aggregation over the source
+    collection that produces the same documents from the raw data; rebuild()
+    replaces the collection with its output through $out, which keeps the
+    rollup's indexes. Increments recorded while a rebuild runs can be lost.
+    """
+
+    def __init__(self, collection, dimensions: List[str], source=None,
+                 rebuild_pipeline: Optional[Callable[[], List[Dict[str, Any]]]] = None):
+        self.collection = collection
+        self.dimensions = dimensions
+        self.source = source
+        self.rebuild_pipeline = rebuild_pipeline
+
+    @property
+    def name(self) -> str:
+        return self.collection.name
+
+    def key(self, at: datetime, dimensions: Dict[str, Any]) -> Dict[str, Any]:
+        return {"day": day_key(at), **{name: dimensions.get(name) for name in self.dimensions}}
+
+    async def record(self, at: datetime, dimensions: Dict[str, Any], inc: Dict[str, float],
+                     minimum: Optional[Dict[str, Any]] = None, maximum: Optional[Dict[str, Any]] = None):
+        """Add one raw record's contribution to its day's rollup document"""
+        key = self.key(at, dimensions)
+        await self.collection.update_one(
+            {"_id": key},
+            {
+                "$setOnInsert": key,
+                "$inc": inc,
+                "$min": {"first_at": at, **(minimum or {})},
+                "$max": {"last_at": at, **(maximum or {})}
+            },
+            upsert=True
+        )
+
+    async def rebuild(self) -> int:
+        """Recompute every rollup document from the raw data; returns how many there are"""
+        if self.source is None or self.rebuild_pipeline is None:
+            raise ValueError(f"Rollup {self.name} has no rebuild pipeline")
+        await self.source.aggregate(self.rebuild_pipeline() + [{"$out": self.name}]).to_list(length=None)
+        count = await self.collection.count_documents({})
+        logger.info(f"Rebuilt {count} {self.name} documents from {self.source.name}")
+        return count
+
+
+class RollupRegistry:
+    """Every rollup the components maintain, for rebuilding them all at once"""
+
+    def __init__(self):
+        self._rollups: Dict[str, Rollup] = {}
+
+    def register(self, rollup: Rollup) -> Rollup:
+        self._rollups[rollup.name] = rollup
+        return rollup
+
+    async def rebuild_all(self) -> Dict[str, Any]:
+        rebuilt: Dict[str, Any] = {}
+        for name, rollup in self._rollups.items():
+            try:
+                rebuilt[name] = await rollup.rebuild()
+            except PyMongoError as e:
+                logger.error(f"Error rebuilding rollup {name}: {str(e)}")
+                rebuilt[name] = f"error: {str(e)}"
+        return rebuilt
+
+
+# Global instance
+rollup_registry = RollupRegistry()
+
+
+async def _backfill() -> int:
+    # The server module constructs every component, registering their rollups
+    import server
+
+    rebuilt = await rollup_registry.rebuild_all()
+    for name, result in rebuilt.items():
+        print(f"{name}: {result}")
+    return 1 if any(isinstance(result, str) for result in rebuilt.values()) else 0
+
+
+if __name__ == "__main__":
+    # python -m lib.rollups: rebuild every rollup collection from the raw records
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_backfill()))
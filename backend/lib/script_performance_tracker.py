@@ -9,13 +9,34 @@ from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from motor.motor_asyncio import AsyncIOMotorClient
 import uuid
-from collections import defaultdict
 import json
-import statistics
 from dataclasses import dataclass
+from pymongo import ASCENDING
+
+from .mongo_indexes import index_registry
+from .rollups import Rollup, rollup_registry, day_filter, day_expression
+from .write_behind import write_behind
 
 logger = logging.getLogger(__name__)
 
+# Scores counted as successful patterns for recommendations
+SUCCESSFUL_SCORE = 6.0
+
+# Insights and recommendations both read the daily rollups
+index_registry.index("script_performance_rollups", [("day", ASCENDING)])
+index_registry.index("script_performance_rollups", [("platform", ASCENDING), ("content_type", ASCENDING),
+                                                    ("day", ASCENDING)])
+index_registry.index("learning_models", [("model_type", ASCENDING)], unique=True)
+
+index_registry.query("script_performance_rollups.insights", "script_performance_rollups",
+                     {"platform": "youtube", "content_type": "general",
+                      **day_filter(datetime.utcnow() - timedelta(days=30))})
+index_registry.query("script_performance_rollups.insights_all_platforms", "script_performance_rollups",
+                     day_filter(datetime.utcnow() - timedelta(days=30)))
+index_registry.query("script_performance_rollups.relevant_patterns", "script_performance_rollups",
+                     {"platform": "youtube", "content_type": "general"})
+index_registry.query("learning_models.by_type", "learning_models", {"model_type": "METADATA"})
+
 @dataclass
 class PerformanceMetrics:
     """Data class for performance metrics"""
@@ -41,6 +62,11 @@ class ScriptPerformanceTracker:
         self.performance_collection = db.script_performance
         self.insights_collection = db.performance_insights
         self.learning_models_collection = db.learning_models
+        # Daily totals per platform, content type and duration that the insights are read from
+        self.rollup = rollup_registry.register(Rollup(
+            db.script_performance_rollups, ["platform", "content_type", "duration"],
+            source=self.performance_collection, rebuild_pipeline=self._rollup_rebuild_pipeline
+        ))
         
         # Performance categories and weights
         self.metric_weights = {
@@ -50,6 +76,8 @@ class ScriptPerformanceTracker:
             "click_through_rate": 0.15,
             "viral_coefficient": 0.10
         }
+        # Per-metric scores stored in calculated_scores next to overall_score
+        self.score_metrics = ["engagement_score", "retention_score", "completion_score", "ctr_score", "viral_score"]
         
         # Learning patterns
         self.pattern_categories = {
@@ -87,8 +115,9 @@ class ScriptPerformanceTracker:
                 "audience_segment": performance_metrics.get("audience_segment", "general")
             }
             
-            # Store performance record
-            await self.performance_collection.insert_one(performance_record)
+            # Store performance record; the rollup counts it once it is written
+            write_behind.insert(self.performance_collection, performance_record,
+                                on_written=lambda: self._record_rollup(performance_record))
             
             # Update learning models with new data
             learning_insights = await self._update_learning_models(script_id, performance_record)
@@ -130,30 +159,31 @@ class ScriptPerformanceTracker:
             # Build query filters
             query = await self._build_insights_query(filters)
             
-            # Get performance data
-            performance_data = await self._fetch_performance_data(query)
+            # Summarize the matching days from the rollups, in one round trip
+            stats = await self._aggregate_performance_stats(query)
+            summary = stats["summary"]
             
             # Analyze performance trends
-            trend_analysis = await self._analyze_performance_trends(performance_data)
+            trend_analysis = await self._analyze_performance_trends(stats["daily"])
             
             # Get top performing patterns
-            top_patterns = await self._get_top_performing_patterns(performance_data)
+            top_patterns = await self._get_top_performing_patterns(stats)
             
             # Get underperforming patterns for improvement
-            improvement_patterns = await self._get_improvement_opportunities(performance_data)
+            improvement_patterns = await self._get_improvement_opportunities(stats)
             
             # Generate predictive insights
-            predictive_insights = await self._generate_predictive_insights(performance_data)
+            predictive_insights = await self._generate_predictive_insights(stats)
             
             # Get learning model recommendations
             model_recommendations = await self._get_model_recommendations(filters)
             
             return {
                 "insights_summary": {
-                    "total_scripts_analyzed": len(performance_data),
-                    "date_range": await self._get_date_range(performance_data),
-                    "average_performance_score": await self._calculate_average_performance(performance_data),
-                    "top_performing_category": await self._get_top_category(performance_data)
+                    "total_scripts_analyzed": summary["count"],
+                    "date_range": self._get_date_range(summary),
+                    "average_performance_score": round(summary["average_score"] or 0.0, 2),
+                    "top_performing_category": stats["platforms"][0]["_id"] if stats["platforms"] else "N/A"
                 },
                 "performance_trends": trend_analysis,
                 "successful_patterns": top_patterns,
@@ -396,7 +426,7 @@ class ScriptPerformanceTracker:
     # Insights and pattern analysis methods
     
     async def _build_insights_query(self, filters: Dict[str, Any]) -> Dict[str, Any]:
-        """Build MongoDB query from filters"""
+        """Build the rollup query from filters (date ranges resolve to whole days)"""
         query = {}
         
         if "platform" in filters:
@@ -407,101 +437,168 @@ class ScriptPerformanceTracker:
         
         if "date_range" in filters:
             date_range = filters["date_range"]
-            query["tracked_at"] = {
-                "$gte": datetime.fromisoformat(date_range["start"]),
-                "$lte": datetime.fromisoformat(date_range["end"])
-            }
+            query.update(day_filter(datetime.fromisoformat(date_range["start"]),
+                                    datetime.fromisoformat(date_range["end"])))
         else:
             # Default to last 30 days
-            query["tracked_at"] = {"$gte": datetime.utcnow() - timedelta(days=30)}
+            query.update(day_filter(datetime.utcnow() - timedelta(days=30)))
         
         return query
     
-    async def _fetch_performance_data(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
-        """Fetch performance data from database"""
-        cursor = self.performance_collection.find(query).sort("tracked_at", -1)
-        return await cursor.to_list(length=1000)  # Limit to 1000 records
+    async def _record_rollup(self, performance_record: Dict[str, Any]):
+        """Add a new performance record to its day's rollup (a failure only leaves the dashboards behind)"""
+        try:
+            scores = performance_record["calculated_scores"]
+            score = scores["overall_score"]
+            inc = {"count": 1, "score_sum": score, **{f"{metric}_sum": scores[metric] for metric in self.score_metrics}}
+            if score >= SUCCESSFUL_SCORE:
+                inc.update(successful_count=1, successful_score_sum=score)
+            minimum = maximum = None
+            if score > 7.0:
+                inc.update(high_count=1, high_score_sum=score)
+                minimum, maximum = {"high_score_min": score}, {"high_score_max": score}
+            await self.rollup.record(performance_record["tracked_at"], performance_record, inc, minimum, maximum)
+        except Exception as e:
+            logger.error(f"Error updating performance rollup: {str(e)}")
     
-    async def _analyze_performance_trends(self, performance_data: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze performance trends over time"""
-        if not performance_data:
-            return {"trend": "NO_DATA"}
+    def _rollup_rebuild_pipeline(self) -> List[Dict[str, Any]]:
+        """The daily rollup documents computed from the raw performance records"""
+        score = "$calculated_scores.overall_score"
+        high = {"$gt": [score, 7.0]}
+        successful = {"$gte": [score, SUCCESSFUL_SCORE]}
+        return [
+            {"$group": {
+                # Same field order as Rollup.key(), so incremental updates find the rebuilt documents
+                "_id": {
+                    "day": day_expression("tracked_at"),
+                    "platform": {"$ifNull": ["$platform", None]},
+                    "content_type": {"$ifNull": ["$content_type", None]},
+                    "duration": {"$ifNull": ["$duration", None]}
+                },
+                "count": {"$sum": 1},
+                "score_sum": {"$sum": score},
+                **{f"{metric}_sum": {"$sum": f"$calculated_scores.{metric}"} for metric in self.score_metrics},
+                "successful_count": {"$sum": {"$cond": [successful, 1, 0]}},
+                "successful_score_sum": {"$sum": {"$cond": [successful, score, 0]}},
+                "high_count": {"$sum": {"$cond": [high, 1, 0]}},
+                "high_score_sum": {"$sum": {"$cond": [high, score, 0]}},
+                "high_score_min": {"$min": {"$cond": [high, score, "$$REMOVE"]}},
+                "high_score_max": {"$max": {"$cond": [high, score, "$$REMOVE"]}},
+                "first_at": {"$min": "$tracked_at"},
+                "last_at": {"$max": "$tracked_at"}
+            }},
+            {"$addFields": {field: f"$_id.{field}" for field in ["day", "platform", "content_type", "duration"]}}
+        ]
+    
+    def _insights_pipeline(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Aggregation over the daily rollups computing every insights statistic as one summary document"""
+        def mean(total: str, count: str) -> Dict[str, Any]:
+            return {"$divide": [total, count]}
+        
+        def group_scores(key: Any) -> List[Dict[str, Any]]:
+            return [
+                {"$group": {"_id": key, "score_sum": {"$sum": "$score_sum"}, "count": {"$sum": "$count"}}},
+                {"$addFields": {"average_score": mean("$score_sum", "$count")}}
+            ]
         
-        # Group by time periods
-        daily_scores = defaultdict(list)
-        for record in performance_data:
-            date_key = record["tracked_at"].date().isoformat()
-            daily_scores[date_key].append(record["calculated_scores"]["overall_score"])
+        def top_categories(field: str) -> List[Dict[str, Any]]:
+            # Categories of the high-performing scripts (score > 7), best average first
+            return [
+                {"$match": {"high_count": {"$gt": 0}}},
+                {"$group": {
+                    "_id": f"${field}",
+                    "high_score_sum": {"$sum": "$high_score_sum"},
+                    "sample_count": {"$sum": "$high_count"},
+                    "max_score": {"$max": "$high_score_max"},
+                    "min_score": {"$min": "$high_score_min"}
+                }},
+                {"$addFields": {"average_score": mean("$high_score_sum", "$sample_count")}},
+                {"$sort": {"average_score": -1, "_id": 1}}
+            ]
         
-        # Calculate daily averages
-        daily_averages = {
-            date: statistics.mean(scores) 
-            for date, scores in daily_scores.items()
+        return [
+            {"$match": query},
+            {"$facet": {
+                "summary": [
+                    {"$group": {
+                        "_id": None,
+                        "count": {"$sum": "$count"},
+                        "high_performers": {"$sum": "$high_count"},
+                        "start": {"$min": "$first_at"},
+                        "end": {"$max": "$last_at"},
+                        "score_sum": {"$sum": "$score_sum"},
+                        **{f"{metric}_sum": {"$sum": f"${metric}_sum"} for metric in self.score_metrics}
+                    }},
+                    {"$addFields": {
+                        "average_score": mean("$score_sum", "$count"),
+                        **{metric: mean(f"${metric}_sum", "$count") for metric in self.score_metrics}
+                    }}
+                ],
+                "daily": group_scores("$day") + [{"$sort": {"_id": 1}}],
+                "platforms": group_scores("$platform") + [{"$sort": {"average_score": -1, "_id": 1}}, {"$limit": 1}],
+                "top_platforms": top_categories("platform"),
+                "top_content_types": top_categories("content_type"),
+                "top_durations": top_categories("duration")
+            }}
+        ]
+    
+    async def _aggregate_performance_stats(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the insights aggregation; the summary facet is flattened to a single document"""
+        cursor = self.rollup.collection.aggregate(self._insights_pipeline(query))
+        facets = (await cursor.to_list(length=1))[0]
+        summary = facets["summary"][0] if facets["summary"] else {
+            "count": 0, "high_performers": 0, "start": None, "end": None, "average_score": None
         }
+        return {**facets, "summary": summary}
+    
+    async def _analyze_performance_trends(self, daily: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Analyze performance trends over time from the daily averages (oldest day first)"""
+        if not daily:
+            return {"trend": "NO_DATA"}
+        
+        daily_averages = {day["_id"]: day["average_score"] for day in daily}
+        scores = list(daily_averages.values())
         
         # Determine trend
-        if len(daily_averages) < 2:
+        if len(scores) < 2:
             trend = "INSUFFICIENT_DATA"
+        elif scores[-1] > scores[0]:
+            trend = "IMPROVING"
+        elif scores[-1] < scores[0]:
+            trend = "DECLINING"
         else:
-            scores = list(daily_averages.values())
-            if scores[-1] > scores[0]:
-                trend = "IMPROVING"
-            elif scores[-1] < scores[0]:
-                trend = "DECLINING"
-            else:
-                trend = "STABLE"
+            trend = "STABLE"
         
         return {
             "trend": trend,
             "daily_averages": daily_averages,
             "overall_improvement": scores[-1] - scores[0] if len(scores) >= 2 else 0,
-            "best_performing_day": max(daily_averages.items(), key=lambda x: x[1]) if daily_averages else None
+            "best_performing_day": max(daily_averages.items(), key=lambda x: x[1])
         }
     
-    async def _get_top_performing_patterns(self, performance_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _get_top_performing_patterns(self, stats: Dict[str, Any]) -> Dict[str, Any]:
         """Identify top performing patterns"""
-        if not performance_data:
+        if not stats["summary"]["count"]:
             return {}
         
-        # Filter high-performing scripts (score > 7)
-        high_performers = [
-            record for record in performance_data 
-            if record["calculated_scores"]["overall_score"] > 7.0
-        ]
-        
-        if not high_performers:
+        if not stats["summary"]["high_performers"]:
             return {"message": "No high-performing scripts in dataset"}
         
-        # Analyze common patterns
-        platform_performance = defaultdict(list)
-        content_type_performance = defaultdict(list)
-        duration_performance = defaultdict(list)
-        
-        for record in high_performers:
-            platform_performance[record["platform"]].append(record["calculated_scores"]["overall_score"])
-            content_type_performance[record["content_type"]].append(record["calculated_scores"]["overall_score"])
-            duration_performance[record["duration"]].append(record["calculated_scores"]["overall_score"])
-        
         return {
-            "top_platforms": self._get_top_categories(platform_performance),
-            "top_content_types": self._get_top_categories(content_type_performance),
-            "top_durations": self._get_top_categories(duration_performance),
-            "success_factors": await self._identify_success_factors(high_performers)
+            "top_platforms": self._get_top_categories(stats["top_platforms"]),
+            "top_content_types": self._get_top_categories(stats["top_content_types"]),
+            "top_durations": self._get_top_categories(stats["top_durations"]),
+            "success_factors": await self._identify_success_factors(stats)
         }
     
-    async def _get_improvement_opportunities(self, performance_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _get_improvement_opportunities(self, stats: Dict[str, Any]) -> Dict[str, Any]:
         """Identify areas for improvement"""
-        if not performance_data:
+        summary = stats["summary"]
+        if not summary["count"]:
             return {}
         
         # Analyze underperforming areas
-        metric_averages = {
-            "engagement_score": statistics.mean([r["calculated_scores"]["engagement_score"] for r in performance_data]),
-            "retention_score": statistics.mean([r["calculated_scores"]["retention_score"] for r in performance_data]),
-            "completion_score": statistics.mean([r["calculated_scores"]["completion_score"] for r in performance_data]),
-            "ctr_score": statistics.mean([r["calculated_scores"]["ctr_score"] for r in performance_data]),
-            "viral_score": statistics.mean([r["calculated_scores"]["viral_score"] for r in performance_data])
-        }
+        metric_averages = {metric: summary.get(metric) or 0.0 for metric in self.score_metrics}
         
         # Identify lowest performing metrics
         lowest_metrics = sorted(metric_averages.items(), key=lambda x: x[1])[:3]
@@ -512,55 +609,58 @@ class ScriptPerformanceTracker:
             "benchmark_comparison": await self._get_benchmark_comparison(metric_averages)
         }
     
-    async def _generate_predictive_insights(self, performance_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    async def _generate_predictive_insights(self, stats: Dict[str, Any]) -> Dict[str, Any]:
         """Generate predictive insights for future performance"""
-        if len(performance_data) < 10:
+        count = stats["summary"]["count"]
+        if count < 10:
             return {"message": "Insufficient data for predictions"}
         
         # Analyze success patterns
-        success_indicators = await self._identify_success_indicators(performance_data)
+        success_indicators = await self._identify_success_indicators(stats)
         
         # Predict optimal parameters
-        optimal_params = await self._predict_optimal_parameters(performance_data)
+        optimal_params = await self._predict_optimal_parameters(stats)
         
         # Identify risk factors
-        risk_factors = await self._identify_risk_factors(performance_data)
+        risk_factors = await self._identify_risk_factors(stats)
         
         return {
             "success_indicators": success_indicators,
             "optimal_parameters": optimal_params,
             "risk_factors": risk_factors,
-            "confidence_level": min(100, len(performance_data) * 2)  # More data = higher confidence
+            "confidence_level": min(100, count * 2)  # More data = higher confidence
         }
     
     # Recommendation and model methods
     
     async def _get_relevant_patterns(self, script_context: Dict[str, Any]) -> Dict[str, Any]:
-        """Get performance patterns relevant to the script context"""
+        """
+        Count and average score of the successful scripts for the context, from
+        the rollups (which only count written records, unlike a read of the
+        raw collection that misses records still in the write-behind buffer)
+        """
         query = {
             "platform": script_context.get("platform", "youtube"),
-            "content_type": script_context.get("content_type", "general"),
-            "calculated_scores.overall_score": {"$gte": 6.0}  # Only successful patterns
+            "content_type": script_context.get("content_type", "general")
         }
-        
-        relevant_data = await self.performance_collection.find(query).limit(100).to_list(100)
+        cursor = self.rollup.collection.aggregate([
+            {"$match": query},
+            {"$group": {"_id": None, "count": {"$sum": "$successful_count"},
+                        "score_sum": {"$sum": "$successful_score_sum"}}}
+        ])
+        totals = await cursor.to_list(length=1)
+        count = totals[0]["count"] if totals else 0
         
         return {
-            "pattern_count": len(relevant_data),
-            "average_performance": statistics.mean([
-                r["calculated_scores"]["overall_score"] for r in relevant_data
-            ]) if relevant_data else 0,
-            "patterns": relevant_data
+            "pattern_count": count,
+            "average_performance": totals[0]["score_sum"] / count if count else 0
         }
     
     async def _recommend_structure(self, patterns: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """Recommend script structure based on performance patterns"""
-        if not patterns.get("patterns"):
+        if not patterns.get("pattern_count"):
             return {"recommendation": "Standard structure", "confidence": 0.3}
         
-        # Analyze successful structures
-        successful_patterns = patterns["patterns"]
-        
         # This would analyze actual script structures from the database
         # For now, provide general recommendations based on performance data
         avg_score = patterns["average_performance"]
@@ -625,11 +725,11 @@ class ScriptPerformanceTracker:
     
     async def _get_optimal_parameters(self, patterns: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """Get optimal parameters based on performance analysis"""
-        if not patterns.get("patterns"):
+        if not patterns.get("pattern_count"):
             return self._get_default_parameters()
         
         # Analyze successful scripts for optimal parameters
-        successful_scripts = patterns["patterns"]
+        successful_scripts = patterns["pattern_count"]
         platform = context.get("platform", "youtube")
         
         # This would analyze actual parameters from successful scripts
@@ -639,7 +739,7 @@ class ScriptPerformanceTracker:
             "engagement_frequency": "Every 25 seconds",
             "emotional_intensity": "7.5/10",
             "cta_placement": ["middle", "end"],
-            "confidence": 0.8 if len(successful_scripts) > 20 else 0.6
+            "confidence": 0.8 if successful_scripts > 20 else 0.6
         }
     
     # Utility and helper methods
@@ -673,20 +773,18 @@ class ScriptPerformanceTracker:
         else:
             return "F"
     
-    def _get_top_categories(self, category_performance: Dict[str, List[float]]) -> List[Dict[str, Any]]:
-        """Get top performing categories with statistics"""
-        results = []
-        for category, scores in category_performance.items():
-            if scores:
-                results.append({
-                    "category": category,
-                    "average_score": statistics.mean(scores),
-                    "sample_count": len(scores),
-                    "max_score": max(scores),
-                    "min_score": min(scores)
-                })
-        
-        return sorted(results, key=lambda x: x["average_score"], reverse=True)
+    def _get_top_categories(self, category_groups: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Top performing categories with statistics, from the aggregation's per-category groups"""
+        return [
+            {
+                "category": group["_id"],
+                "average_score": group["average_score"],
+                "sample_count": group["sample_count"],
+                "max_score": group["max_score"],
+                "min_score": group["min_score"]
+            }
+            for group in category_groups
+        ]
     
     async def _get_script_data(self, script_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve script data from database"""
@@ -741,7 +839,7 @@ class ScriptPerformanceTracker:
     
     # Additional helper methods for comprehensive functionality
     
-    async def _identify_success_factors(self, high_performers: List[Dict[str, Any]]) -> List[str]:
+    async def _identify_success_factors(self, stats: Dict[str, Any]) -> List[str]:
         """Identify common success factors"""
         return [
             "Strong opening hooks",
@@ -787,7 +885,7 @@ class ScriptPerformanceTracker:
         
         return comparisons
     
-    async def _identify_success_indicators(self, performance_data: List[Dict[str, Any]]) -> List[str]:
+    async def _identify_success_indicators(self, stats: Dict[str, Any]) -> List[str]:
         """Identify key indicators of success"""
         return [
             "Engagement rate above 8%",
@@ -797,7 +895,7 @@ class ScriptPerformanceTracker:
             "Multiple retention hooks throughout content"
         ]
     
-    async def _predict_optimal_parameters(self, performance_data: List[Dict[str, Any]]) -> Dict[str, str]:
+    async def _predict_optimal_parameters(self, stats: Dict[str, Any]) -> Dict[str, str]:
         """Predict optimal parameters for future scripts"""
         return {
             "content_length": "90-150 seconds for optimal engagement",
@@ -807,7 +905,7 @@ class ScriptPerformanceTracker:
             "cta_timing": "Middle and end for best conversion"
         }
     
-    async def _identify_risk_factors(self, performance_data: List[Dict[str, Any]]) -> List[str]:
+    async def _identify_risk_factors(self, stats: Dict[str, Any]) -> List[str]:
         """Identify risk factors that lead to poor performance"""
         return [
             "Weak opening hook (under 5/10 strength)",
@@ -819,7 +917,7 @@ class ScriptPerformanceTracker:
     
     async def _calculate_recommendation_confidence(self, patterns: Dict[str, Any]) -> Dict[str, float]:
         """Calculate confidence scores for recommendations"""
-        pattern_count = len(patterns.get("patterns", []))
+        pattern_count = patterns.get("pattern_count", 0)
         
         return {
             "overall_confidence": min(100, pattern_count * 2),  # More patterns = higher confidence
@@ -836,16 +934,16 @@ class ScriptPerformanceTracker:
             "expected_overall_score": base_performance,
             "expected_engagement_rate": base_performance * 0.8,
             "expected_retention_rate": base_performance * 1.2,
-            "confidence": 0.75 if len(patterns.get("patterns", [])) > 10 else 0.5
+            "confidence": 0.75 if patterns.get("pattern_count", 0) > 10 else 0.5
         }
     
     async def _get_learning_source_info(self, patterns: Dict[str, Any]) -> Dict[str, Any]:
         """Get information about the learning sources"""
         return {
-            "data_points": len(patterns.get("patterns", [])),
+            "data_points": patterns.get("pattern_count", 0),
             "date_range": "Last 30 days",
             "platforms_analyzed": ["youtube", "tiktok", "instagram"],
-            "confidence_level": "High" if len(patterns.get("patterns", [])) > 50 else "Medium"
+            "confidence_level": "High" if patterns.get("pattern_count", 0) > 50 else "Medium"
         }
     
     # Model update methods
@@ -931,37 +1029,12 @@ class ScriptPerformanceTracker:
         
         return insights[:5]  # Top 5 actionable insights
     
-    async def _get_date_range(self, performance_data: List[Dict[str, Any]]) -> Dict[str, str]:
+    def _get_date_range(self, summary: Dict[str, Any]) -> Dict[str, str]:
         """Get date range of performance data"""
-        if not performance_data:
+        if not summary["count"]:
             return {"start": "N/A", "end": "N/A"}
         
-        dates = [record["tracked_at"] for record in performance_data]
         return {
-            "start": min(dates).isoformat(),
-            "end": max(dates).isoformat()
+            "start": summary["start"].isoformat(),
+            "end": summary["end"].isoformat()
         }
-    
-    async def _calculate_average_performance(self, performance_data: List[Dict[str, Any]]) -> float:
-        """Calculate average performance score"""
-        if not performance_data:
-            return 0.0
-        
-        scores = [record["calculated_scores"]["overall_score"] for record in performance_data]
-        return round(statistics.mean(scores), 2)
-    
-    async def _get_top_category(self, performance_data: List[Dict[str, Any]]) -> str:
-        """Get top performing category"""
-        if not performance_data:
-            return "N/A"
-        
-        platform_scores = defaultdict(list)
-        for record in performance_data:
-            platform_scores[record["platform"]].append(record["calculated_scores"]["overall_score"])
-        
-        if not platform_scores:
-            return "N/A"
-        
-        top_platform = max(platform_scores.items(), 
-                          key=lambda x: statistics.mean(x[1]))[0]
-        return top_platform
\ No newline at end of file
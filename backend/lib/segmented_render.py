@@ -0,0 +1,315 @@
+"""
+Segmented Video Rendering
+Long sprite-based talking-head renders are cut into chunks at quiet points,
+each chunk is encoded in its own process with identical H.264 settings, and
+the chunks are joined with ffmpeg's concat demuxer without re-encoding
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, List, Set, Tuple, Union
+
+import cv2
+import numpy as np
+
+from lib.background_compositor import BackgroundSegment, build_background_filter
+from lib.ffmpeg_renderer import FFmpegFrameWriter
+from lib.ffmpeg_runner import run_ffmpeg_for_job
+from lib.frame_synthesis import MouthStyle, VisemeMouth, BlinkStyle, get_talking_head_sprites
+from lib.render_scheduler import (
+    RenderCancelled, _init_render_worker, _request_cancel, _run_render_job, check_cancelled, idle_cores,
+    lease_idle_cores, release_cores, report_progress
+)
+
+logger = logging.getLogger(__name__)
+
+# Chunk process state: set once the pool is aborted (by signal, or through the pool's shared event
+# for a process that had not reported its pid yet), so chunks it picks up afterwards do not start
+_segments_cancelled = False
+_abort_event = None
+
+
+@dataclass
+class SegmentJob:
+    """Everything a worker process needs to encode one chunk of the video"""
+    image_path: str
+    mouth: Union[MouthStyle, VisemeMouth]
+    max_offset: Tuple[int, int]
+    blink_style: Optional[BlinkStyle]
+    border_mode: int
+    cache: bool
+    # Mouth openness per frame, or keyframe indices for a VisemeMouth
+    openness: np.ndarray
+    shift_x: np.ndarray
+    shift_y: np.ndarray
+    blink: Optional[np.ndarray]
+    fps: float
+    output_path: str
+    preset: str
+    crf: int
+    timeout: float
+    scale: float = 1.0
+    # Background segments relative to the chunk start and the avatar's foreground mask; None renders it as-is
+    background_segments: Optional[List[BackgroundSegment]] = None
+    mask_path: Optional[str] = None
+
+
+def _init_segment_worker(threads: int, pid_queue, abort_event):
+    """
+    Chunk process setup: the render worker thread caps, SIGUSR1 cancels
+    every chunk it has left, and the pid goes to the parent so it knows
+    whom to signal
+    """
+    global _abort_event
+    _init_render_worker(threads)
+    _abort_event = abort_event
+    signal.signal(signal.SIGUSR1, _cancel_segments)
+    pid_queue.put(os.getpid())
+
+
+def _segment_aborted() -> bool:
+    return _segments_cancelled or (_abort_event is not None and _abort_event.is_set())
+
+
+def _cancel_segments(signum, frame):
+    global _segments_cancelled
+    _segments_cancelled = True
+    _request_cancel(signum, frame)
+
+
+def render_segment(job: SegmentJob) -> str:
+    """Encode one chunk as a video-only H.264 file (runs in a worker process)"""
+    if _segment_aborted():
+        raise RenderCancelled(f"Segment {job.output_path} was cancelled")
+    sprites = get_talking_head_sprites(job.image_path, job.mouth, job.max_offset, blink=job.blink_style,
+                                       border_mode=job.border_mode, cache=job.cache, scale=job.scale,
+                                       mask_path=job.mask_path)
+
+    background_inputs, background_filter = [], None
+    if job.background_segments is not None:
+        # No audio input here, so the background images start at input 1
+        background_inputs, background_filter = build_background_filter(
+            job.background_segments, sprites.width, sprites.height, job.fps, first_input=1
+        )
+
+    video_writer = FFmpegFrameWriter(job.output_path, sprites.width, sprites.height, job.fps,
+                                     preset=job.preset, crf=job.crf, timeout=job.timeout,
+                                     extra_inputs=background_inputs, filter_complex=background_filter,
+                                     pixel_format="bgra" if sprites.channels == 4 else "bgr24")
+    try:
+        with video_writer:
+            check_every = max(1, int(job.fps))
+            for index, frame in enumerate(sprites.frames(job.openness, job.shift_x, job.shift_y, job.blink)):
+                # Once a second, for an abort that came before this process's pid reached the parent
+                if index % check_every == 0 and _segment_aborted():
+                    raise RenderCancelled(f"Segment {job.output_path} was cancelled")
+                video_writer.write(frame)
+    except RenderCancelled:
+        # ffmpeg is already killed; the parent does not wait for this chunk to clean up after it
+        if os.path.exists(job.output_path):
+            os.remove(job.output_path)
+        raise
+    return job.output_path
+
+
+class SegmentedRenderer:
+    """
+    Parallel chunked encoder for the sprite frame loops.
+
+    The per-frame tracks are already known up front, so any chunk can be
+    rendered independently. Cuts are placed at the quietest frame near each
+    even split point so a join never lands mid-word. Each chunk starts on
+    its own keyframe and uses the same encoder settings, which lets the
+    concat demuxer join them with stream copy; the audio is muxed once over
+    the joined video.
+
+    Chunks run in a pool of spawned processes sized to the current render
+    job's own core budget (RENDER_THREADS inside the render worker pool)
+    plus the cores it can lease from the scheduler while no other job uses
+    them, so a long render spreads over an idle machine.
+    """
+
+    def __init__(self, min_segment_seconds: float = 10.0, snap_seconds: float = 1.0):
+        self.min_segment_seconds = min_segment_seconds
+        self.snap_seconds = snap_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_shape: Tuple[int, int] = (0, 0)
+        self._pid_queue = None
+        self._abort_event = None
+        self._chunk_pids: Set[int] = set()
+
+    def own_cores(self) -> int:
+        """The current render job's own core budget"""
+        return max(1, int(os.environ.get("RENDER_THREADS") or os.cpu_count() or 1))
+
+    def core_budget(self) -> int:
+        """Cores a render starting now could use: its own plus those idle right now"""
+        return self.own_cores() + idle_cores()
+
+    def plan(self, envelope: np.ndarray, total_frames: int, fps: float,
+             max_segments: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        [start, end) frame ranges for the chunks. envelope is a per-frame
+        loudness (or mouth openness) track used to find the quiet cut points.
+        """
+        max_segments = max_segments or self.core_budget()
+        min_frames = max(1, int(self.min_segment_seconds * fps))
+        count = max(1, min(max_segments, total_frames // min_frames))
+        if count == 1:
+            return [(0, total_frames)]
+
+        envelope = np.nan_to_num(np.asarray(envelope, dtype=np.float64), nan=0.0)
+        window = int(self.snap_seconds * fps)
+        cuts = [0]
+        for index in range(1, count):
+            target = int(round(index * total_frames / count))
+            low = max(cuts[-1] + 1, target - window)
+            high = min(total_frames - 1, target + window, len(envelope) - 1)
+            if low < high:
+                target = low + int(np.argmin(envelope[low:high + 1]))
+            cuts.append(target)
+        cuts.append(total_frames)
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def render(self, image_path: str, mouth: Union[MouthStyle, VisemeMouth], max_offset: Tuple[int, int],
+               openness: np.ndarray, shift_x: np.ndarray, shift_y: np.ndarray,
+               blink: Optional[np.ndarray], fps: float, audio_path: str, output_path: str,
+               ranges: List[Tuple[int, int]], blink_style: Optional[BlinkStyle] = None,
+               border_mode: int = cv2.BORDER_CONSTANT, cache: bool = True,
+               background_segments: Optional[List[BackgroundSegment]] = None,
+               mask_path: Optional[str] = None, scale: float = 1.0,
+               preset: str = "medium", crf: int = 23, audio_bitrate: str = "128k", timeout: float = 300) -> str:
+        """Render the chunks in parallel and assemble them with the audio into output_path"""
+        output = Path(output_path)
+        jobs = []
+        for index, (start, end) in enumerate(ranges):
+            chunk_segments = None
+            if background_segments:
+                chunk_start, chunk_end = start / fps, end / fps
+                chunk_segments = [
+                    BackgroundSegment(segment.path, segment.start - chunk_start, segment.end - chunk_start)
+                    for segment in background_segments
+                    if segment.end > chunk_start and segment.start < chunk_end
+                ]
+            jobs.append(SegmentJob(
+                image_path=image_path, mouth=mouth, max_offset=max_offset, blink_style=blink_style,
+                border_mode=border_mode, cache=cache,
+                openness=openness[start:end], shift_x=shift_x[start:end], shift_y=shift_y[start:end],
+                blink=blink[start:end] if blink is not None else None,
+                fps=fps, output_path=str(output.with_name(f"{output.stem}_part{index:03d}.mp4")),
+                preset=preset, crf=crf, timeout=timeout, scale=scale,
+                background_segments=chunk_segments, mask_path=mask_path
+            ))
+
+        segment_paths = [job.output_path for job in jobs]
+        own_cores = self.own_cores()
+        leased = lease_idle_cores(len(jobs) - own_cores)
+        try:
+            executor = self._get_executor(len(jobs), own_cores + leased)
+            futures = [executor.submit(_run_render_job, Path(job.output_path).stem, render_segment, job)
+                       for job in jobs]
+            pending = set(futures)
+            while pending:
+                # Poll so a cancelled render job stops waiting
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                self._collect_pids()
+                for future in done:
+                    future.result()
+                report_progress((len(jobs) - len(pending)) * 100 / len(jobs), "segments")
+                try:
+                    check_cancelled()
+                except RenderCancelled:
+                    self._abort_executor()
+                    raise
+            logger.info(f"Rendered {len(jobs)} segments in parallel for {output_path}")
+            return self.concat(segment_paths, audio_path, output_path, audio_bitrate=audio_bitrate, timeout=timeout)
+        finally:
+            release_cores(leased)
+            for path in segment_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def concat(self, segment_paths: List[str], audio_path: str, output_path: str,
+               audio_bitrate: str = "128k", timeout: float = 300) -> str:
+        """Join the encoded chunks with stream copy and mux the audio track once"""
+        list_path = str(Path(output_path).with_suffix(".concat.txt"))
+        with open(list_path, 'w') as f:
+            for path in segment_paths:
+                f.write(f"file '{os.path.abspath(path)}'\n")
+
+        cmd = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-i', audio_path,
+            '-map', '0:v:0', '-map', '1:a:0',
+            '-c:v', 'copy',
+            '-c:a', 'aac', '-b:a', audio_bitrate,
+            '-shortest', '-movflags', '+faststart',
+            output_path
+        ]
+        try:
+            run_ffmpeg_for_job(cmd, timeout=timeout, stage="concat")
+        finally:
+            os.remove(list_path)
+        return output_path
+
+    def _get_executor(self, segments: int, cores: int) -> ProcessPoolExecutor:
+        workers = min(segments, cores)
+        # Split the cores across the segment processes
+        shape = (workers, max(1, cores // workers))
+        if self._executor is not None and self._executor_shape != shape:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._executor is None:
+            context = multiprocessing.get_context("spawn")
+            self._pid_queue = context.Queue()
+            self._abort_event = context.Event()
+            self._chunk_pids = set()
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=context,
+                initializer=_init_segment_worker,
+                initargs=(shape[1], self._pid_queue, self._abort_event)
+            )
+            self._executor_shape = shape
+        return self._executor
+
+    def _collect_pids(self):
+        """Record the pids the chunk processes reported from their initializer"""
+        while True:
+            try:
+                self._chunk_pids.add(self._pid_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _abort_executor(self):
+        """
+        Drop the chunk pool without waiting for it: queued chunks are
+        cancelled and the running ones are signalled, so they kill their
+        ffmpeg and exit in the background
+        """
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        # The event first: a process whose pid has not arrived yet stops at its next check
+        self._abort_event.set()
+        self._collect_pids()
+        executor.shutdown(wait=False, cancel_futures=True)
+        for pid in self._chunk_pids:
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+        self._chunk_pids = set()
+
+
+# Global instance
+segmented_renderer = SegmentedRenderer(
+    min_segment_seconds=float(os.environ.get("RENDER_SEGMENT_MIN_SECONDS", "10"))
+)
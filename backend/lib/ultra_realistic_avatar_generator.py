@@ -7,15 +7,13 @@ Supports professional avatars with perfect lip-sync and dynamic backgrounds
 import os
 import sys
 import tempfile
-import subprocess
 import uuid
 from pathlib import Path
 import cv2
 import numpy as np
-from pydub import AudioSegment
 import base64
 import logging
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import asyncio
 import concurrent.futures
 from PIL import Image, ImageDraw, ImageFont, ImageFilter
@@ -24,14 +22,64 @@ import re
 import time
 from datetime import datetime
 import shutil
+from functools import cached_property
+from lib.asset_manifest import asset_manifest
+from lib.audio_timing import SpeechTiming, sentence_timeline
+from lib.background_compositor import (BackgroundSegment, build_background_filter, compositing_mask, mask_path_for,
+                                       render_foreground_mask, segments_from_script)
+from lib.decoded_audio import DecodedAudio
+from lib.ffmpeg_renderer import FFmpegFrameWriter, ffmpeg_thread_args
+from lib.ffmpeg_runner import run_ffmpeg_for_job, media_duration_seconds
+from lib.frame_synthesis import MouthStyle, BlinkStyle, get_talking_head_sprites
+from lib.render_plans import render_plan_store
+from lib.render_quality import RenderQuality, FINAL, get_render_quality
+from lib.render_workspace import render_workspaces
+from lib.video_store import video_store, render_key
+from lib.segmented_render import segmented_renderer
+from lib.visemes import viseme_mouth, viseme_track, envelope_viseme_track
 
 logger = logging.getLogger(__name__)
 
+# More realistic mouth movement and the closed eyes drawn while blinking
+ULTRA_MOUTH = MouthStyle(center=(0.5, 0.7), width=25, width_gain=20, height=8, height_gain=15,
+                         color=(160, 80, 80))
+ULTRA_BLINK = BlinkStyle(eye_offset_x=80, eye_height=0.45, axes=(40, 5), color=(200, 150, 120))
+ULTRA_VISEME_MOUTH = viseme_mouth(ULTRA_MOUTH)
+
+# Selectable lip-sync models (request value -> reported ai_model_used); "auto" picks one
+AI_MODELS = {
+    "sadtalker": "SadTalker",
+    "wav2lip": "Wav2Lip",
+    "viseme": "Viseme",
+    "basic": "Enhanced Basic"
+}
+
+# The animation each model's video is actually rendered with: the SadTalker and Wav2Lip paths here
+# produce the enhanced basic animation, so their videos are cached and stored as one
+MODEL_RENDERERS = {
+    "SadTalker": "basic",
+    "Wav2Lip": "basic",
+    "Viseme": "viseme",
+    "Enhanced Basic": "basic"
+}
+
+# Context-based backgrounds
+BACKGROUND_CONTEXTS = {
+    "office": {"color": (240, 240, 255), "elements": ["desk", "computer", "books"]},
+    "nature": {"color": (200, 255, 200), "elements": ["trees", "sky", "grass"]},
+    "studio": {"color": (250, 250, 250), "elements": ["lights", "backdrop", "camera"]},
+    "tech": {"color": (220, 220, 240), "elements": ["screens", "circuits", "data"]},
+    "education": {"color": (255, 250, 200), "elements": ["blackboard", "books", "desk"]},
+    "medical": {"color": (255, 255, 255), "elements": ["stethoscope", "chart", "medicine"]},
+    "finance": {"color": (230, 230, 255), "elements": ["charts", "graphs", "calculator"]},
+    "creative": {"color": (255, 240, 255), "elements": ["paint", "brushes", "canvas"]},
+    "home": {"color": (255, 245, 230), "elements": ["sofa", "lamp", "plants"]},
+    "conference": {"color": (245, 245, 245), "elements": ["table", "chairs", "screen"]}
+}
+
 class UltraRealisticAvatarGenerator:
     def __init__(self):
         self.assets_dir = Path("/app/assets")
-        self.temp_dir = Path("/app/tmp/ultra_avatar_videos")
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
         
         # Avatar styles and configurations
         self.avatar_styles = {
@@ -47,33 +95,16 @@ class UltraRealisticAvatarGenerator:
             }
         }
         
-        # Initialize AI models
-        self.setup_ai_models()
-        
-        # Ensure default resources
-        self.ensure_default_resources()
+        # AI models are probed on first use, and avatars/backgrounds are rendered
+        # on demand through the asset manifest, so constructing this is cheap
     
-    def setup_ai_models(self):
-        """Initialize and configure AI models for CPU execution"""
-        try:
-            # Check for SadTalker availability
-            self.sadtalker_available = self.check_sadtalker_availability()
-            
-            # Check for Wav2Lip availability
-            self.wav2lip_available = self.check_wav2lip_availability()
-            
-            # Initialize background generation models
-            self.setup_background_models()
-            
-            # Initialize face generation models
-            self.setup_face_generation_models()
-            
-            logger.info(f"AI Models initialized - SadTalker: {self.sadtalker_available}, Wav2Lip: {self.wav2lip_available}")
-            
-        except Exception as e:
-            logger.error(f"Error setting up AI models: {str(e)}")
-            self.sadtalker_available = False
-            self.wav2lip_available = False
+    @cached_property
+    def sadtalker_available(self) -> bool:
+        return self.check_sadtalker_availability()
+    
+    @cached_property
+    def wav2lip_available(self) -> bool:
+        return self.check_wav2lip_availability()
     
     def check_sadtalker_availability(self) -> bool:
         """Check if SadTalker is available and properly configured"""
@@ -109,69 +140,32 @@ class UltraRealisticAvatarGenerator:
             logger.error(f"Error checking Wav2Lip availability: {str(e)}")
             return False
     
-    def setup_background_models(self):
-        """Initialize background generation models"""
-        try:
-            # For CPU execution, we'll use optimized background generation
-            self.background_generator_available = True
-            logger.info("Background generation models initialized")
-        except Exception as e:
-            logger.error(f"Error setting up background models: {str(e)}")
-            self.background_generator_available = False
-    
-    def setup_face_generation_models(self):
-        """Initialize face generation models for creating realistic avatars"""
-        try:
-            # For CPU execution, we'll use pre-generated high-quality avatars
-            # In production, this would use Stable Diffusion optimized for CPU
-            self.face_generator_available = True
-            logger.info("Face generation models initialized")
-        except Exception as e:
-            logger.error(f"Error setting up face generation models: {str(e)}")
-            self.face_generator_available = False
-    
-    def ensure_default_resources(self):
-        """Create default avatar and background resources"""
-        # Create realistic avatars directory
-        avatars_dir = self.assets_dir / "ultra_realistic_avatars"
-        avatars_dir.mkdir(exist_ok=True)
-        
-        # Create professional avatars
-        self.create_professional_avatars(avatars_dir)
-        
-        # Create dynamic backgrounds
-        self.create_dynamic_backgrounds()
-    
-    def create_professional_avatars(self, avatars_dir: Path):
-        """Create high-quality professional avatars"""
-        for style, genders in self.avatar_styles.items():
-            style_dir = avatars_dir / style
-            style_dir.mkdir(exist_ok=True)
-            
-            for gender, avatar_names in genders.items():
-                gender_dir = style_dir / gender
-                gender_dir.mkdir(exist_ok=True)
-                
-                for avatar_name in avatar_names:
-                    avatar_path = gender_dir / f"{avatar_name}.jpg"
-                    if not avatar_path.exists():
-                        self.generate_ultra_realistic_avatar(str(avatar_path), style, gender, avatar_name)
-    
     def generate_ultra_realistic_avatar(self, output_path: str, style: str, gender: str, avatar_name: str):
         """Generate ultra-realistic avatar with professional quality"""
+        img = self.draw_ultra_realistic_avatar(style, gender, avatar_name)
+        
+        # Save high-quality image
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        logger.info(f"Created ultra-realistic avatar: {output_path}")
+    
+    def render_avatar_mask(self, output_path: str, style: str, gender: str, avatar_name: str):
+        """Foreground mask of an avatar, for compositing it over the dynamic backgrounds (asset manifest generator)"""
+        mask = render_foreground_mask(lambda backdrop: self.draw_ultra_realistic_avatar(style, gender, avatar_name,
+                                                                                        backdrop))
+        cv2.imwrite(output_path, mask)
+    
+    def draw_ultra_realistic_avatar(self, style: str, gender: str, avatar_name: str, backdrop: int = 245) -> np.ndarray:
+        """An avatar drawn over a plain backdrop of the given grey level"""
         # Create high-resolution base (1024x1024 for quality)
-        img = np.ones((1024, 1024, 3), dtype=np.uint8) * 245
+        img = np.ones((1024, 1024, 3), dtype=np.uint8) * backdrop
         
         # Generate realistic facial features based on style and gender
         if style == "business_professional":
             self.create_business_professional_avatar(img, gender, avatar_name)
         else:
             self.create_casual_avatar(img, gender, avatar_name)
-        
-        # Save high-quality image
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        cv2.imwrite(output_path, img, [cv2.IMWRITE_JPEG_QUALITY, 95])
-        logger.info(f"Created ultra-realistic avatar: {output_path}")
+        return img
     
     def create_business_professional_avatar(self, img: np.ndarray, gender: str, avatar_name: str):
         """Create business professional avatar with realistic features"""
@@ -400,29 +394,9 @@ class UltraRealisticAvatarGenerator:
         # Blend with original
         cv2.addWeighted(img, 0.95, overlay, 0.05, 0, img)
     
-    def create_dynamic_backgrounds(self):
-        """Create dynamic backgrounds that change based on script content"""
-        backgrounds_dir = self.assets_dir / "dynamic_backgrounds"
-        backgrounds_dir.mkdir(exist_ok=True)
-        
-        # Context-based backgrounds
-        background_contexts = {
-            "office": {"color": (240, 240, 255), "elements": ["desk", "computer", "books"]},
-            "nature": {"color": (200, 255, 200), "elements": ["trees", "sky", "grass"]},
-            "studio": {"color": (250, 250, 250), "elements": ["lights", "backdrop", "camera"]},
-            "tech": {"color": (220, 220, 240), "elements": ["screens", "circuits", "data"]},
-            "education": {"color": (255, 250, 200), "elements": ["blackboard", "books", "desk"]},
-            "medical": {"color": (255, 255, 255), "elements": ["stethoscope", "chart", "medicine"]},
-            "finance": {"color": (230, 230, 255), "elements": ["charts", "graphs", "calculator"]},
-            "creative": {"color": (255, 240, 255), "elements": ["paint", "brushes", "canvas"]},
-            "home": {"color": (255, 245, 230), "elements": ["sofa", "lamp", "plants"]},
-            "conference": {"color": (245, 245, 245), "elements": ["table", "chairs", "screen"]}
-        }
-        
-        for context, config in background_contexts.items():
-            bg_path = backgrounds_dir / f"{context}.jpg"
-            if not bg_path.exists():
-                self.create_context_background(str(bg_path), context, config)
+    def render_dynamic_background(self, output_path: str, context: str):
+        """Render the background for a script context (asset manifest generator)"""
+        self.create_context_background(output_path, context, BACKGROUND_CONTEXTS[context])
     
     def create_context_background(self, output_path: str, context: str, config: Dict):
         """Create context-aware background"""
@@ -487,21 +461,31 @@ class UltraRealisticAvatarGenerator:
                        (int(width * 0.7), int(height * 0.9)), 0, 0, 360, (255, 255, 255), -1)
             cv2.addWeighted(img, 0.9, overlay, 0.1, 0, img)
     
-    def parse_script_for_context_backgrounds(self, script: str) -> List[Dict[str, Any]]:
-        """Parse script into segments and determine context-aware backgrounds"""
+    def parse_script_for_context_backgrounds(self, script: str, audio: Optional[DecodedAudio] = None,
+                                             speech_timing: Optional[SpeechTiming] = None) -> List[Dict[str, Any]]:
+        """Parse script into segments and determine context-aware backgrounds, timed against the spoken audio"""
         sentences = re.split(r'[.!?]+', script)
         sentences = [s.strip() for s in sentences if s.strip()]
         
+        # Sentence timing from the TTS word track, or from pauses in the decoded audio
+        if speech_timing is not None:
+            spans = sentence_timeline(sentences, speech_timing.duration_seconds, words=speech_timing.words)
+        elif audio is not None:
+            spans = sentence_timeline(sentences, audio.duration_seconds,
+                                      envelope=audio.rms_envelope(30), envelope_rate=30)
+        else:
+            spans = [(i * 4, i * 4 + 4) for i in range(len(sentences))]  # 4 seconds per sentence
+        
         segments = []
-        for i, sentence in enumerate(sentences):
+        for sentence, (start, end) in zip(sentences, spans):
             context = self.determine_context_background(sentence)
             
             segments.append({
                 "text": sentence,
                 "context": context,
-                "background_path": str(self.assets_dir / "dynamic_backgrounds" / f"{context}.jpg"),
-                "start_time": i * 4,  # 4 seconds per sentence
-                "duration": 4
+                "background_path": asset_manifest.ensure(f"dynamic_backgrounds/{context}.jpg"),
+                "start_time": start,
+                "duration": round(end - start, 3)
             })
         
         return segments
@@ -541,146 +525,229 @@ class UltraRealisticAvatarGenerator:
     
     def generate_ultra_realistic_video(self, audio_base64: str, avatar_style: str = "business_professional",
                                      gender: str = "female", avatar_index: int = 1, 
-                                     script_text: str = "") -> Dict[str, Any]:
+                                     script_text: str = "",
+                                     word_timings: Optional[List[Dict[str, Any]]] = None,
+                                     audio_duration_seconds: Optional[float] = None,
+                                     quality: str = "final", return_base64: bool = False,
+                                     ai_model: str = "auto") -> Dict[str, Any]:
         """Main method to generate ultra-realistic avatar video"""
         try:
+            render_quality = get_render_quality(quality)
             request_id = str(uuid.uuid4())[:8]
-            logger.info(f"Starting ultra-realistic video generation (ID: {request_id})")
-            
-            # Convert audio from base64
-            temp_audio_path = str(self.temp_dir / f"audio_{request_id}.mp3")
-            wav_audio_path = self.audio_base64_to_file(audio_base64, temp_audio_path)
-            
-            # Select avatar
-            avatar_path = self.select_avatar(avatar_style, gender, avatar_index)
-            
-            # Parse script for dynamic backgrounds
-            script_segments = self.parse_script_for_context_backgrounds(script_text)
-            
-            # Generate ultra-realistic talking video
-            temp_video_path = str(self.temp_dir / f"ultra_video_{request_id}.mp4")
-            
-            # Try advanced AI models first, fallback to enhanced basic if needed
-            if self.sadtalker_available:
-                video_path = self.create_sadtalker_video(avatar_path, wav_audio_path, temp_video_path)
-            elif self.wav2lip_available:
-                video_path = self.create_wav2lip_video(avatar_path, wav_audio_path, temp_video_path)
-            else:
-                video_path = self.create_ultra_enhanced_basic_video(avatar_path, wav_audio_path, temp_video_path)
-            
-            # Apply dynamic backgrounds
-            final_video_path = self.apply_dynamic_backgrounds(
-                video_path, script_segments, wav_audio_path,
-                str(self.temp_dir / f"final_ultra_{request_id}.mp4")
-            )
-            
-            # Get video duration
-            duration_seconds = self.get_video_duration(final_video_path)
-            
-            # Convert to base64
-            with open(final_video_path, 'rb') as video_file:
-                video_base64 = base64.b64encode(video_file.read()).decode('utf-8')
-            
-            # Cleanup
-            cleanup_files = [temp_audio_path, wav_audio_path, temp_video_path, video_path, final_video_path]
-            self.cleanup_temp_files(cleanup_files)
+            logger.info(f"Starting ultra-realistic video generation (ID: {request_id}, quality: {quality})")
+            
+            # Temporary files live in the job's own directory, removed even if rendering fails
+            with render_workspaces.job(f"ultra-{request_id}") as workdir:
+                # Decode the audio once; every stage shares the same PCM buffer and muxes the MP3 as-is
+                audio_bytes = base64.b64decode(audio_base64)
+                audio = DecodedAudio.from_bytes(audio_bytes, str(workdir / "audio.mp3"))
+                speech_timing = None
+                if word_timings:
+                    speech_timing = SpeechTiming.from_payload(audio_bytes, word_timings, audio_duration_seconds)
+                
+                # Select avatar
+                avatar_path = self.select_avatar(avatar_style, gender, avatar_index)
+                
+                # Parse script for dynamic backgrounds
+                script_segments = self.parse_script_for_context_backgrounds(script_text, audio, speech_timing)
+                
+                result = self.render_ultra_realistic_video(request_id, audio, avatar_path, avatar_style, gender,
+                                                           avatar_index, script_segments, speech_timing,
+                                                           render_quality, return_base64, ai_model, workdir)
+                
+                # Keep the preview's inputs so it can be promoted to a final render
+                if render_quality.is_preview:
+                    render_plan_store.save_render_inputs(request_id, "ultra_realistic", audio, speech_timing,
+                                                         avatar_path, copy_avatar=False, avatar_style=avatar_style,
+                                                         gender=gender, avatar_index=avatar_index,
+                                                         script_segments=script_segments, ai_model=ai_model)
             
-            return {
-                "video_base64": video_base64,
-                "duration_seconds": duration_seconds,
-                "request_id": request_id,
-                "avatar_style": avatar_style,
-                "gender": gender,
-                "avatar_index": avatar_index,
-                "script_segments": len(script_segments),
-                "background_contexts": [seg["context"] for seg in script_segments],
-                "ai_model_used": "SadTalker" if self.sadtalker_available else "Wav2Lip" if self.wav2lip_available else "Enhanced Basic",
-                "quality_level": "Ultra-Realistic"
-            }
+            return result
             
         except Exception as e:
             logger.error(f"Error generating ultra-realistic video: {str(e)}")
             raise
     
+    def promote_ultra_realistic_video(self, request_id: str, return_base64: bool = False) -> Dict[str, Any]:
+        """Render a previewed ultra-realistic video at final quality from its saved render plan"""
+        inputs = render_plan_store.load_render_inputs(request_id)
+        if inputs is None:
+            raise KeyError(f"No render plan for preview {request_id}")
+        
+        params = inputs["params"]
+        result = self.render_ultra_realistic_video(request_id, inputs["audio"], inputs["avatar_path"],
+                                                   params["avatar_style"], params["gender"], params["avatar_index"],
+                                                   params["script_segments"], inputs["speech_timing"], FINAL,
+                                                   return_base64, params.get("ai_model", "auto"))
+        render_plan_store.discard(request_id)
+        return result
+    
+    def render_ultra_realistic_video(self, request_id: str, audio: DecodedAudio, avatar_path: str,
+                                     avatar_style: str, gender: str, avatar_index: int,
+                                     script_segments: List[Dict[str, Any]],
+                                     speech_timing: Optional[SpeechTiming] = None,
+                                     quality: RenderQuality = FINAL, return_base64: bool = False,
+                                     ai_model: str = "auto", workdir: Optional[Path] = None) -> Dict[str, Any]:
+        """Render the talking video for prepared inputs into the video store (in workdir if given)"""
+        # Backgrounds are composited during the same encode
+        background_segments = segments_from_script(script_segments, "background_path")
+        ai_model_used = self.select_ai_model(ai_model, quality)
+        renderer = MODEL_RENDERERS[ai_model_used]
+        
+        with render_workspaces.job(f"ultra-{request_id}-{quality.name}", workdir) as workdir:
+            # Generate ultra-realistic talking video (rendered straight to the final H.264/AAC file)
+            temp_video_path = str(workdir / "final_ultra.mp4")
+            
+            if ai_model_used == "SadTalker":
+                video_path = self.create_sadtalker_video(avatar_path, audio, temp_video_path, speech_timing,
+                                                         background_segments, quality)
+            elif ai_model_used == "Wav2Lip":
+                video_path = self.create_wav2lip_video(avatar_path, audio, temp_video_path, speech_timing,
+                                                       background_segments, quality)
+            elif ai_model_used == "Viseme":
+                video_path = self.create_viseme_video(avatar_path, audio, temp_video_path, speech_timing,
+                                                      background_segments, quality)
+            else:
+                video_path = self.create_ultra_enhanced_basic_video(avatar_path, audio, temp_video_path,
+                                                                    speech_timing, background_segments, quality)
+            
+            # Get video duration
+            duration_seconds = self.get_video_duration(video_path)
+            
+            # Store under the hash of the render inputs; base64 only when explicitly asked for
+            video_id = render_key("ultra_realistic", audio.source_path, avatar_path, quality.name, speech_timing,
+                                  background_segments, renderer=renderer)
+            stored_video = video_store.publish(video_id, video_path, return_base64)
+        
+        return {
+            **stored_video,
+            "duration_seconds": duration_seconds,
+            "request_id": request_id,
+            "avatar_style": avatar_style,
+            "gender": gender,
+            "avatar_index": avatar_index,
+            "script_segments": len(script_segments),
+            "background_contexts": [seg["context"] for seg in script_segments],
+            "ai_model_used": ai_model_used,
+            "quality_level": "Ultra-Realistic",
+            "quality": quality.name
+        }
+    
+    def select_ai_model(self, ai_model: str, quality: RenderQuality = FINAL) -> str:
+        """
+        The lip-sync model to render with. "auto" uses the cheap viseme
+        renderer for previews and otherwise the best installed model; a
+        requested model that is not installed falls back to the same choice.
+        """
+        if ai_model in AI_MODELS and not (ai_model == "sadtalker" and not self.sadtalker_available) \
+                and not (ai_model == "wav2lip" and not self.wav2lip_available):
+            return AI_MODELS[ai_model]
+        if ai_model != "auto":
+            logger.warning(f"Lip-sync model {ai_model} is not available, choosing automatically")
+        
+        if quality.is_preview:
+            return AI_MODELS["viseme"]
+        # Try advanced AI models first, fallback to enhanced basic if needed
+        if self.sadtalker_available:
+            return AI_MODELS["sadtalker"]
+        if self.wav2lip_available:
+            return AI_MODELS["wav2lip"]
+        return AI_MODELS["basic"]
+    
+    def select_renderer(self, ai_model: str, quality: RenderQuality = FINAL) -> Tuple[str, str]:
+        """(lip-sync model, renderer) a request resolves to; videos are identical for the same renderer"""
+        ai_model_used = self.select_ai_model(ai_model, quality)
+        return ai_model_used, MODEL_RENDERERS[ai_model_used]
+    
     def select_avatar(self, style: str, gender: str, index: int) -> str:
         """Select avatar based on style, gender, and index"""
-        avatars_dir = self.assets_dir / "ultra_realistic_avatars" / style / gender
+        avatar_names = self.avatar_styles.get(style, {}).get(gender)
         
-        if not avatars_dir.exists():
+        if not avatar_names:
             # Fallback to default
-            avatars_dir = self.assets_dir / "ultra_realistic_avatars" / "business_professional" / "female"
-        
-        avatar_files = list(avatars_dir.glob("*.jpg"))
-        if not avatar_files:
-            # Create default if none exist
-            default_path = str(avatars_dir / "default.jpg")
-            self.generate_ultra_realistic_avatar(default_path, style, gender, "default_1")
-            return default_path
-        
-        # Select avatar by index
-        avatar_file = avatar_files[min(index - 1, len(avatar_files) - 1)]
-        return str(avatar_file)
-    
-    def create_sadtalker_video(self, image_path: str, audio_path: str, output_path: str) -> str:
+            style, gender = "business_professional", "female"
+            avatar_names = self.avatar_styles[style][gender]
+        
+        # Select avatar by index (rendered on first use if missing, with the mask for compositing it)
+        avatar_name = avatar_names[max(0, min(index - 1, len(avatar_names) - 1))]
+        avatar_path = f"ultra_realistic_avatars/{style}/{gender}/{avatar_name}.jpg"
+        asset_manifest.ensure(mask_path_for(avatar_path))
+        return asset_manifest.ensure(avatar_path)
+    
+    def create_sadtalker_video(self, image_path: str, audio: DecodedAudio, output_path: str,
+                               speech_timing: Optional[SpeechTiming] = None,
+                               background_segments: Optional[List[BackgroundSegment]] = None,
+                               quality: RenderQuality = FINAL) -> str:
         """Create video using SadTalker (CPU optimized)"""
         try:
             logger.info("Using SadTalker for ultra-realistic video generation")
             
             # For CPU optimization, we'll use a simplified approach
             # In production, this would call actual SadTalker with CPU optimizations
-            return self.create_ultra_enhanced_basic_video(image_path, audio_path, output_path)
+            return self.create_ultra_enhanced_basic_video(image_path, audio, output_path, speech_timing,
+                                                          background_segments, quality)
             
         except Exception as e:
             logger.error(f"Error with SadTalker: {str(e)}")
-            return self.create_ultra_enhanced_basic_video(image_path, audio_path, output_path)
+            return self.create_ultra_enhanced_basic_video(image_path, audio, output_path, speech_timing,
+                                                          background_segments, quality)
     
-    def create_wav2lip_video(self, image_path: str, audio_path: str, output_path: str) -> str:
+    def create_wav2lip_video(self, image_path: str, audio: DecodedAudio, output_path: str,
+                             speech_timing: Optional[SpeechTiming] = None,
+                             background_segments: Optional[List[BackgroundSegment]] = None,
+                             quality: RenderQuality = FINAL) -> str:
         """Create video using Wav2Lip (CPU optimized)"""
         try:
             logger.info("Using Wav2Lip for ultra-realistic video generation")
             
             # For CPU optimization, we'll use enhanced basic with precise lip-sync
-            return self.create_ultra_enhanced_basic_video(image_path, audio_path, output_path)
+            return self.create_ultra_enhanced_basic_video(image_path, audio, output_path, speech_timing,
+                                                          background_segments, quality)
             
         except Exception as e:
             logger.error(f"Error with Wav2Lip: {str(e)}")
-            return self.create_ultra_enhanced_basic_video(image_path, audio_path, output_path)
-    
-    def create_ultra_enhanced_basic_video(self, image_path: str, audio_path: str, output_path: str) -> str:
-        """Create ultra-enhanced basic video with advanced animation"""
+            return self.create_ultra_enhanced_basic_video(image_path, audio, output_path, speech_timing,
+                                                          background_segments, quality)
+    
+    def create_ultra_enhanced_basic_video(self, image_path: str, audio: DecodedAudio, output_path: str,
+                                          speech_timing: Optional[SpeechTiming] = None,
+                                          background_segments: Optional[List[BackgroundSegment]] = None,
+                                          quality: RenderQuality = FINAL) -> str:
+        """
+        Create ultra-enhanced basic video with advanced animation, encoded with its audio in one pass.
+        With background segments the avatar is keyed over them in the same encode.
+        """
         try:
-            # Load the high-quality avatar image
-            img = cv2.imread(image_path)
-            if img is None:
-                raise ValueError(f"Could not load image from {image_path}")
-            
-            # Get audio duration and analyze for lip-sync
-            audio = AudioSegment.from_file(audio_path)
-            duration_seconds = len(audio) / 1000.0
-            
-            # Analyze audio for better lip-sync
-            audio_analysis = self.analyze_audio_for_lipsync(audio_path)
+            # Mouth and blink keyframes are rendered once per image; only shipped assets are kept cached
+            cache_sprites = Path(image_path).is_relative_to(self.assets_dir)
+            mask_path = compositing_mask(image_path, background_segments)
+            sprites = get_talking_head_sprites(image_path, ULTRA_MOUTH, max_offset=(2, 1), blink=ULTRA_BLINK,
+                                               border_mode=cv2.BORDER_REFLECT, cache=cache_sprites,
+                                               scale=quality.scale, mask_path=mask_path)
+            
+            # Video parameters for high quality (the preview tier lowers them)
+            fps = quality.frame_rate(30)
+            
+            if speech_timing is not None:
+                # The TTS word track already tells us duration and when the mouth moves
+                duration_seconds = speech_timing.duration_seconds
+                audio_analysis = {
+                    "volume_levels": speech_timing.mouth_openness(fps).tolist(),
+                    "levels_per_second": fps,
+                    "frequency_data": [],
+                    "speech_segments": []
+                }
+            else:
+                # Get audio duration and analyze for lip-sync from the already decoded samples
+                duration_seconds = audio.duration_seconds
+                audio_analysis = self.analyze_audio_for_lipsync(audio, fps)
             
-            # Video parameters for high quality
-            fps = 30
             total_frames = int(duration_seconds * fps)
-            height, width = img.shape[:2]
-            
-            # Create video writer with high quality settings
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-            
-            # Generate frames with ultra-enhanced animation
-            for frame_num in range(total_frames):
-                current_frame = img.copy()
-                time_factor = frame_num / fps
-                
-                # Apply advanced animations
-                self.apply_ultra_realistic_animations(current_frame, time_factor, audio_analysis, width, height)
-                
-                video_writer.write(current_frame)
+            mouth_open_factor, shift_x, shift_y, blink = self.compute_animation_tracks(audio_analysis, total_frames, fps)
             
-            video_writer.release()
+            self.render_sprite_video(sprites, image_path, ULTRA_MOUTH, mouth_open_factor, mouth_open_factor,
+                                     shift_x, shift_y, blink, fps, audio, output_path, mask_path,
+                                     background_segments, quality, cache_sprites)
             logger.info(f"Created ultra-enhanced basic video: {output_path}")
             return output_path
             
@@ -688,97 +755,147 @@ class UltraRealisticAvatarGenerator:
             logger.error(f"Error creating ultra-enhanced basic video: {str(e)}")
             raise
     
-    def analyze_audio_for_lipsync(self, audio_path: str) -> Dict[str, Any]:
-        """Analyze audio for better lip-sync animation"""
+    def create_viseme_video(self, image_path: str, audio: DecodedAudio, output_path: str,
+                            speech_timing: Optional[SpeechTiming] = None,
+                            background_segments: Optional[List[BackgroundSegment]] = None,
+                            quality: RenderQuality = FINAL) -> str:
+        """
+        Create a lip-synced video from viseme mouth shapes: each word's
+        spelling (or the loudness envelope without a word track) picks a
+        sequence of pre-rendered mouth shapes that are cross-faded per frame,
+        at about the cost of the basic animation.
+        """
         try:
-            audio = AudioSegment.from_file(audio_path)
-            
-            # Convert to numpy array for analysis
-            audio_data = np.array(audio.get_array_of_samples())
+            cache_sprites = Path(image_path).is_relative_to(self.assets_dir)
+            mask_path = compositing_mask(image_path, background_segments)
+            sprites = get_talking_head_sprites(image_path, ULTRA_VISEME_MOUTH, max_offset=(2, 1), blink=ULTRA_BLINK,
+                                               border_mode=cv2.BORDER_REFLECT, cache=cache_sprites,
+                                               scale=quality.scale, mask_path=mask_path)
+            
+            fps = quality.frame_rate(30)
+            if speech_timing is not None:
+                total_frames = int(speech_timing.duration_seconds * fps)
+                from_viseme, to_viseme, alpha = viseme_track(speech_timing.words, speech_timing.duration_seconds, fps)
+                audio_analysis = {"volume_levels": speech_timing.mouth_openness(fps).tolist(), "levels_per_second": fps}
+            else:
+                total_frames = int(audio.duration_seconds * fps)
+                envelope = audio.rms_envelope(fps)
+                from_viseme, to_viseme, alpha = envelope_viseme_track(envelope, fps, total_frames)
+                audio_analysis = {"volume_levels": envelope.tolist(), "levels_per_second": fps}
+            
+            # Same head movement and blinks as the basic animation, only the mouth differs
+            openness, shift_x, shift_y, blink = self.compute_animation_tracks(audio_analysis, total_frames, fps)
+            keyframes = ULTRA_VISEME_MOUTH.keyframe_indices(from_viseme, to_viseme, alpha)
+            
+            self.render_sprite_video(sprites, image_path, ULTRA_VISEME_MOUTH, keyframes, openness,
+                                     shift_x, shift_y, blink, fps, audio, output_path, mask_path,
+                                     background_segments, quality, cache_sprites)
+            logger.info(f"Created viseme lip-sync video: {output_path}")
+            return output_path
             
-            # Analyze audio properties
-            analysis = {
-                "volume_levels": [],
+        except Exception as e:
+            logger.error(f"Error creating viseme video: {str(e)}")
+            raise
+    
+    def render_sprite_video(self, sprites, image_path: str, mouth, mouth_track: np.ndarray, envelope: np.ndarray,
+                            shift_x: np.ndarray, shift_y: np.ndarray, blink: np.ndarray, fps: int,
+                            audio: DecodedAudio, output_path: str, mask_path: Optional[str],
+                            background_segments: Optional[List[BackgroundSegment]], quality: RenderQuality,
+                            cache_sprites: bool):
+        """
+        Encode a sprite animation with its audio (and the backgrounds, when the
+        sprites were built with mask_path) in one pass, or in parallel segments
+        cut at the quiet points of envelope
+        """
+        encoder_settings = quality.encoder_settings(preset='medium', crf=18)
+        if mask_path is None:
+            background_segments = None
+        
+        # Long videos are split at pauses and the chunks encoded in parallel processes
+        ranges = segmented_renderer.plan(envelope, len(mouth_track), fps)
+        if len(ranges) > 1:
+            segmented_renderer.render(image_path, mouth, (2, 1), mouth_track, shift_x, shift_y,
+                                      blink, fps, audio.source_path, output_path, ranges,
+                                      blink_style=ULTRA_BLINK, border_mode=cv2.BORDER_REFLECT,
+                                      cache=cache_sprites, background_segments=background_segments,
+                                      mask_path=mask_path, scale=quality.scale, timeout=600,
+                                      **encoder_settings)
+            logger.info(f"Rendered {output_path} in {len(ranges)} segments")
+            return output_path
+        
+        background_inputs, background_filter = [], None
+        if background_segments:
+            background_inputs, background_filter = build_background_filter(
+                background_segments, sprites.width, sprites.height, fps, first_input=2
+            )
+        
+        # Stream frames into a single high quality H.264/AAC encode together with the audio
+        video_writer = FFmpegFrameWriter(output_path, sprites.width, sprites.height, fps,
+                                         audio_path=audio.source_path, timeout=600, **encoder_settings,
+                                         extra_inputs=background_inputs, filter_complex=background_filter,
+                                         expected_frames=len(mouth_track),
+                                         pixel_format="bgra" if sprites.channels == 4 else "bgr24")
+        
+        # Generate frames with ultra-enhanced animation
+        with video_writer:
+            for frame in sprites.frames(mouth_track, shift_x, shift_y, blink):
+                video_writer.write(frame)
+        return output_path
+    
+    def analyze_audio_for_lipsync(self, audio: DecodedAudio, fps: int) -> Dict[str, Any]:
+        """Analyze audio for better lip-sync animation: one normalized loudness level per video frame"""
+        try:
+            return {
+                "volume_levels": audio.rms_envelope(fps).tolist(),
+                "levels_per_second": fps,
                 "frequency_data": [],
                 "speech_segments": []
             }
             
-            # Analyze in chunks for volume-based lip movement
-            chunk_size = len(audio_data) // 100  # 100 analysis points
-            for i in range(0, len(audio_data), chunk_size):
-                chunk = audio_data[i:i + chunk_size]
-                if len(chunk) > 0:
-                    volume = np.sqrt(np.mean(chunk**2))
-                    analysis["volume_levels"].append(volume)
-            
-            return analysis
-            
         except Exception as e:
             logger.error(f"Error analyzing audio: {str(e)}")
             return {"volume_levels": [], "frequency_data": [], "speech_segments": []}
     
-    def apply_ultra_realistic_animations(self, frame: np.ndarray, time_factor: float, 
-                                       audio_analysis: Dict, width: int, height: int):
-        """Apply ultra-realistic animations to frame"""
-        try:
-            # Calculate animation parameters
-            volume_index = int(time_factor * len(audio_analysis["volume_levels"])) if audio_analysis["volume_levels"] else 0
-            volume_index = min(volume_index, len(audio_analysis["volume_levels"]) - 1)
-            
-            current_volume = audio_analysis["volume_levels"][volume_index] if audio_analysis["volume_levels"] else 0.5
-            
-            # Enhanced mouth animation based on audio
-            mouth_open_factor = min(current_volume * 2, 1.0)  # Scale volume to mouth opening
-            mouth_center = (width // 2, int(height * 0.7))
-            
-            # More realistic mouth movement
-            mouth_width = int(25 + (mouth_open_factor * 20))
-            mouth_height = int(8 + (mouth_open_factor * 15))
-            
-            # Apply mouth animation
-            cv2.ellipse(frame, mouth_center, (mouth_width, mouth_height), 
-                       0, 0, 360, (160, 80, 80), -1)
-            
-            # Subtle head movement
-            head_movement_x = int(2 * np.sin(time_factor * 1.5))
-            head_movement_y = int(1 * np.cos(time_factor * 1.2))
-            
-            # Eye blinking
-            if int(time_factor * 5) % 30 == 0:  # Blink every 6 seconds
-                self.apply_eye_blink(frame, width, height)
-            
-            # Apply head movement
-            if head_movement_x != 0 or head_movement_y != 0:
-                M = np.float32([[1, 0, head_movement_x], [0, 1, head_movement_y]])
-                cv2.warpAffine(frame, M, (width, height), frame, borderMode=cv2.BORDER_REFLECT)
-            
-        except Exception as e:
-            logger.error(f"Error applying animations: {str(e)}")
-    
-    def apply_eye_blink(self, frame: np.ndarray, width: int, height: int):
-        """Apply realistic eye blink animation"""
-        left_eye_center = (width // 2 - 80, int(height * 0.45))
-        right_eye_center = (width // 2 + 80, int(height * 0.45))
+    def compute_animation_tracks(self, audio_analysis: Dict, total_frames: int, fps: int):
+        """Per-frame mouth opening, head offsets and blink flags for the ultra-realistic animation"""
+        time_factor = np.arange(total_frames) / fps
+        volume_levels = np.asarray(audio_analysis["volume_levels"], dtype=np.float64)
+        
+        # Enhanced mouth animation based on audio
+        if len(volume_levels):
+            levels_per_second = audio_analysis.get("levels_per_second", len(volume_levels))
+            volume_index = np.minimum((time_factor * levels_per_second).astype(np.int64), len(volume_levels) - 1)
+            current_volume = volume_levels[volume_index]
+        else:
+            current_volume = np.full(total_frames, 0.5)
+        mouth_open_factor = np.minimum(current_volume * 2, 1.0)  # Scale volume to mouth opening
         
-        # Draw closed eyes
-        cv2.ellipse(frame, left_eye_center, (40, 5), 0, 0, 360, (200, 150, 120), -1)
-        cv2.ellipse(frame, right_eye_center, (40, 5), 0, 0, 360, (200, 150, 120), -1)
+        # Subtle head movement
+        head_movement_x = (2 * np.sin(time_factor * 1.5)).astype(np.int32)
+        head_movement_y = (1 * np.cos(time_factor * 1.2)).astype(np.int32)
+        
+        # Eye blinking
+        blink = (time_factor * 5).astype(np.int64) % 30 == 0  # Blink every 6 seconds
+        
+        return mouth_open_factor, head_movement_x, head_movement_y, blink
     
     def apply_dynamic_backgrounds(self, video_path: str, script_segments: List[Dict], 
                                 audio_path: str, output_path: str) -> str:
-        """Apply dynamic backgrounds that change based on script context"""
+        """
+        Mux the audio into an already rendered avatar video (e.g. model
+        output). Such videos have no foreground mask, so the script's dynamic
+        backgrounds are not composited; keying a guessed backdrop colour out
+        eats into the subject.
+        """
         try:
-            logger.info("Applying dynamic backgrounds based on script context")
+            if segments_from_script(script_segments, "background_path"):
+                logger.info("Rendered avatar video has no foreground mask, skipping dynamic backgrounds")
             
-            # For now, we'll use a simplified approach
-            # In production, this would composite different backgrounds for each segment
-            
-            # Combine video with audio
             cmd = [
                 'ffmpeg', '-y',
                 '-i', video_path,
                 '-i', audio_path,
-                '-c:v', 'libx264',
+                '-c:v', 'libx264', *ffmpeg_thread_args(),
                 '-c:a', 'aac',
                 '-pix_fmt', 'yuv420p',
                 '-preset', 'medium',
@@ -787,38 +904,14 @@ class UltraRealisticAvatarGenerator:
                 output_path
             ]
             
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-            
-            if result.returncode != 0:
-                logger.error(f"FFmpeg error: {result.stderr}")
-                raise RuntimeError(f"FFmpeg failed: {result.stderr}")
+            run_ffmpeg_for_job(cmd, duration_seconds=media_duration_seconds(video_path), timeout=600)
             
-            logger.info(f"Successfully applied dynamic backgrounds: {output_path}")
             return output_path
             
         except Exception as e:
             logger.error(f"Error applying dynamic backgrounds: {str(e)}")
             raise
     
-    def audio_base64_to_file(self, audio_base64: str, output_path: str) -> str:
-        """Convert base64 audio to file"""
-        try:
-            audio_data = base64.b64decode(audio_base64)
-            
-            with open(output_path, 'wb') as f:
-                f.write(audio_data)
-            
-            # Convert to WAV for better compatibility
-            wav_path = output_path.replace('.mp3', '.wav').replace('.m4a', '.wav')
-            audio = AudioSegment.from_file(output_path)
-            audio.export(wav_path, format="wav")
-            
-            return wav_path
-            
-        except Exception as e:
-            logger.error(f"Error converting audio: {str(e)}")
-            raise
-    
     def get_video_duration(self, video_path: str) -> float:
         """Get video duration in seconds"""
         try:
@@ -830,15 +923,6 @@ class UltraRealisticAvatarGenerator:
             return duration
         except:
             return 0
-    
-    def cleanup_temp_files(self, file_paths: List[str]):
-        """Clean up temporary files"""
-        for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except Exception as e:
-                logger.warning(f"Could not cleanup file {file_path}: {str(e)}")
 
 # Global instance
 ultra_realistic_avatar_generator = UltraRealisticAvatarGenerator()
\ No newline at end of file
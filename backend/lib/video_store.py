@@ -0,0 +1,195 @@
+"""
+Video Store
+Rendered videos kept on local disk under a content address derived from
+their render inputs and served over HTTP with Range support, instead of
+being base64-encoded into the JSON responses
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+
+from lib.asset_manifest import file_sha256
+from lib.asset_store import decoded_asset_store
+
+logger = logging.getLogger(__name__)
+
+# Bump when a renderer change should invalidate previously stored videos
+RENDER_KEY_VERSION = 1
+
+
+def render_key(generator: str, audio_path: str, avatar_path: str, quality: str, speech_timing=None,
+               background_segments: Optional[List] = None, **params) -> str:
+    """
+    Content address of a render: a hash of everything that determines the
+    output video (audio and avatar content, timing track, background plan,
+    quality tier and generator specific params)
+    """
+    inputs = {
+        "version": RENDER_KEY_VERSION,
+        "generator": generator,
+        "audio": file_sha256(Path(audio_path)),
+        "avatar": file_sha256(Path(avatar_path)),
+        "quality": quality,
+        "timing": None,
+        "backgrounds": [
+            [decoded_asset_store.content_hash(segment.path), round(segment.start, 3), round(segment.end, 3)]
+            for segment in background_segments or []
+        ],
+        "params": params
+    }
+    if speech_timing is not None:
+        inputs["timing"] = [speech_timing.duration_seconds, [word.to_dict() for word in speech_timing.words]]
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) byte range of a single-range "bytes=" header.
+
+    Returns None when there is no usable Range header (serve the whole file)
+    and raises ValueError when the range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def iter_file_range(path: Path, start: int, end: int, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+class VideoStore:
+    """
+    Content-addressed MP4 files under root/<id[:2]>/<id>.mp4.
+
+    A video id is the render_key of its inputs, so the same inputs always map
+    to the same file and a stored video never changes (it can be cached by
+    clients forever). Files are moved in atomically; the least recently
+    served ones are evicted once the store grows past max_bytes.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = 5 * 1024 ** 3, url_prefix: str = "/api/videos"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.url_prefix = url_prefix
+        self._prune_lock = threading.Lock()
+
+    def path_for(self, video_id: str) -> Path:
+        if not re.fullmatch(r"[0-9a-f]{64}", video_id or ""):
+            raise KeyError(f"Invalid video id: {video_id}")
+        return self.root / video_id[:2] / f"{video_id}.mp4"
+
+    def url_for(self, video_id: str) -> str:
+        return f"{self.url_prefix}/{video_id}"
+
+    def get(self, video_id: str) -> Optional[Path]:
+        """Path of a stored video, or None; marks it as recently used"""
+        try:
+            path = self.path_for(video_id)
+        except KeyError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, video_id: str, source_path: str) -> Path:
+        """Move a rendered file into the store (the source file is consumed)"""
+        path = self.path_for(video_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{video_id}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            try:
+                os.replace(source_path, tmp_path)
+            except OSError:
+                # Different filesystem: copy, then drop the source
+                shutil.copyfile(source_path, tmp_path)
+                os.remove(source_path)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        self.prune()
+        return path
+
+    def publish(self, video_id: str, source_path: str, return_base64: bool = False) -> Dict[str, Any]:
+        """Store a rendered video and describe it for an API response"""
+        path = self.put(video_id, source_path)
+        result = {
+            "video_id": video_id,
+            "video_url": self.url_for(video_id),
+            "video_size_bytes": path.stat().st_size,
+            "video_base64": None
+        }
+        if return_base64:
+            with open(path, 'rb') as video_file:
+                result["video_base64"] = base64.b64encode(video_file.read()).decode('utf-8')
+        return result
+
+    def prune(self) -> int:
+        """Evict least recently used videos while the store is over max_bytes; returns how many"""
+        with self._prune_lock:
+            entries = []
+            for path in self.root.glob("*/*.mp4"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+        if removed:
+            logger.info(f"Evicted {removed} videos from the video store")
+        return removed
+
+
+# Global instance
+video_store = VideoStore(
+    Path(os.environ.get("VIDEO_STORE_DIR", "/app/tmp/videos")),
+    max_bytes=int(os.environ.get("VIDEO_STORE_MAX_BYTES", str(5 * 1024 ** 3)))
+)
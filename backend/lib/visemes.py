@@ -0,0 +1,144 @@
+"""
+Viseme Timing
+Maps the TTS word track (or, without one, the audio loudness envelope) to a
+per-frame sequence of viseme mouth shapes with short cross-fades, for the
+lightweight lip-sync renderer
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from lib.audio_timing import WordTiming
+from lib.frame_synthesis import MouthStyle, VisemeMouth
+
+# Viseme name -> (width, height) openness of the mouth; "rest" must stay first
+VISEME_SHAPES = {
+    "rest": (0.0, 0.0),
+    "mbp": (-0.1, -0.4),   # lips pressed together
+    "fv": (0.25, 0.1),     # lower lip tucked under the teeth
+    "etc": (0.3, 0.3),     # relaxed, slightly open (t, d, n, l, s, k ...)
+    "ee": (0.8, 0.3),      # wide and flat
+    "aa": (0.5, 1.0),      # wide open
+    "oh": (0.15, 0.75),    # round and open
+    "oo": (-0.35, 0.45),   # pursed
+}
+VISEMES = list(VISEME_SHAPES)
+REST = VISEMES.index("rest")
+
+# Spelling -> viseme rules, longest match first; edge-tts only reports word boundaries, not phonemes
+_GRAPHEMES = [
+    ("tion", ["oo", "etc"]), ("ough", ["oh"]),
+    ("th", ["etc"]), ("sh", ["oo"]), ("ch", ["oo"]), ("ph", ["fv"]), ("wh", ["oo"]), ("qu", ["etc", "oo"]),
+    ("oo", ["oo"]), ("ou", ["oh"]), ("ow", ["oh"]), ("ee", ["ee"]), ("ea", ["ee"]), ("ai", ["ee"]),
+    ("ay", ["ee"]), ("oa", ["oh"]), ("ck", ["etc"]), ("ng", ["etc"]),
+    ("a", ["aa"]), ("e", ["ee"]), ("i", ["ee"]), ("y", ["ee"]), ("o", ["oh"]), ("u", ["oo"]),
+    ("w", ["oo"]), ("r", ["oo"]), ("j", ["oo"]),
+    ("m", ["mbp"]), ("b", ["mbp"]), ("p", ["mbp"]), ("f", ["fv"]), ("v", ["fv"]),
+]
+_VOWEL_VISEMES = {"ee", "aa", "oh", "oo"}
+
+# Loudness bands for the envelope fallback: (upper bound, viseme)
+_ENVELOPE_BANDS = [(0.08, "rest"), (0.25, "etc"), (0.45, "ee"), (0.7, "oh"), (np.inf, "aa")]
+
+
+def viseme_mouth(base: MouthStyle, blend_steps: int = 3) -> VisemeMouth:
+    """The viseme shape set drawn with a generator's mouth style"""
+    return VisemeMouth(base=base, shapes=tuple(VISEME_SHAPES.values()), blend_steps=blend_steps)
+
+
+def word_visemes(word: str) -> List[int]:
+    """Viseme sequence for a written word, with repeated shapes merged"""
+    text = re.sub(r"[^a-z]", "", word.lower())
+    if len(text) > 2 and text.endswith("e") and text[-2] not in "aeiouy":
+        text = text[:-1]  # silent final e
+
+    visemes: List[int] = []
+    pos = 0
+    while pos < len(text):
+        for grapheme, names in _GRAPHEMES:
+            if text.startswith(grapheme, pos):
+                pos += len(grapheme)
+                break
+        else:
+            names = ["etc"]
+            pos += 1
+        for name in names:
+            index = VISEMES.index(name)
+            if not visemes or visemes[-1] != index:
+                visemes.append(index)
+    return visemes or [VISEMES.index("etc")]
+
+
+def viseme_track(words: List[WordTiming], duration_seconds: float, fps: float,
+                 transition_seconds: float = 0.06) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-frame (from viseme, to viseme, blend) arrays for a word timing track.
+
+    Each word's duration is shared between its visemes (vowels twice as
+    long as consonants) and the mouth rests between words.
+    """
+    starts, visemes = [0.0], [REST]
+    for word in words:
+        shapes = word_visemes(word.word)
+        weights = np.array([2.0 if VISEMES[v] in _VOWEL_VISEMES else 1.0 for v in shapes])
+        offsets = word.offset + np.concatenate([[0.0], np.cumsum(weights)[:-1]]) / weights.sum() * word.duration
+        starts.extend(offsets.tolist())
+        visemes.extend(shapes)
+        starts.append(word.end)
+        visemes.append(REST)
+
+    order = np.argsort(starts, kind="stable")
+    return _blend_track(np.asarray(starts)[order], np.asarray(visemes)[order],
+                        max(int(duration_seconds * fps), 0), fps, transition_seconds)
+
+
+def envelope_viseme_track(envelope: np.ndarray, fps: float, total_frames: Optional[int] = None,
+                          transition_seconds: float = 0.06) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per-frame (from viseme, to viseme, blend) arrays from a normalized
+    loudness envelope sampled at fps, for audio without a word track
+    """
+    envelope = np.nan_to_num(np.asarray(envelope, dtype=np.float64), nan=0.0)
+    total_frames = len(envelope) if total_frames is None else total_frames
+    if len(envelope) == 0:
+        return _blend_track(np.array([0.0]), np.array([REST]), total_frames, fps, transition_seconds)
+
+    bounds = np.array([bound for bound, _ in _ENVELOPE_BANDS])
+    band_visemes = np.array([VISEMES.index(name) for _, name in _ENVELOPE_BANDS])
+    bands = np.searchsorted(bounds, envelope, side="right")
+    bands = np.minimum(bands, len(bounds) - 1)
+
+    # A 3-frame median keeps single-frame level spikes from flickering the mouth
+    if len(bands) >= 3:
+        padded = np.concatenate([bands[:1], bands, bands[-1:]])
+        bands = np.median(np.stack([padded[:-2], padded[1:-1], padded[2:]]), axis=0).astype(np.int64)
+
+    changes = np.flatnonzero(np.diff(bands)) + 1
+    change_frames = np.concatenate([[0], changes])
+    return _blend_track(change_frames / fps, band_visemes[bands[change_frames]], total_frames, fps,
+                        transition_seconds)
+
+
+def _blend_track(starts: np.ndarray, visemes: np.ndarray, total_frames: int, fps: float,
+                 transition_seconds: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sample a (start time, viseme) sequence per frame, cross-fading into each new viseme"""
+    # Drop segments overridden at the same instant (a word starting right where the last one ended)
+    # and merge repeats, so every fade starts from the shape actually on screen
+    keep = np.append(np.diff(starts) > 0, True)
+    starts, visemes = starts[keep], visemes[keep]
+    keep = np.concatenate([[True], visemes[1:] != visemes[:-1]])
+    starts, visemes = starts[keep], visemes[keep]
+
+    times = np.arange(total_frames, dtype=np.float64) / fps
+    index = np.clip(np.searchsorted(starts, times, side="right") - 1, 0, len(starts) - 1)
+
+    to_viseme = visemes[index]
+    from_viseme = np.where(index > 0, visemes[np.maximum(index - 1, 0)], to_viseme)
+
+    # Short visemes finish their cross-fade before the next one starts
+    lengths = np.diff(np.append(starts, np.inf))
+    fade = np.maximum(np.minimum(transition_seconds, lengths[index]), 1e-6)
+    alpha = np.clip((times - starts[index]) / fade, 0.0, 1.0)
+    return from_viseme.astype(np.int32), to_viseme.astype(np.int32), alpha
@@ -0,0 +1,225 @@
+"""
+Voice Catalog Service
+In-memory TTS voice catalog loaded from a persisted snapshot and refreshed
+from edge-tts in the background (stale-while-revalidate)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, List, Callable, Awaitable
+
+import edge_tts
+
+logger = logging.getLogger(__name__)
+
+# Curated voices shown in the voice picker, with friendlier display names
+POPULAR_VOICES = {
+    "en-US-AriaNeural": {"display": "Aria (US Female - Natural)", "gender": "Female"},
+    "en-US-DavisNeural": {"display": "Davis (US Male - Natural)", "gender": "Male"},
+    "en-US-JennyNeural": {"display": "Jenny (US Female - Friendly)", "gender": "Female"},
+    "en-US-GuyNeural": {"display": "Guy (US Male - Professional)", "gender": "Male"},
+    "en-GB-SoniaNeural": {"display": "Sonia (UK Female)", "gender": "Female"},
+    "en-GB-RyanNeural": {"display": "Ryan (UK Male)", "gender": "Male"},
+    "en-AU-NatashaNeural": {"display": "Natasha (Australian Female)", "gender": "Female"},
+    "en-AU-WilliamNeural": {"display": "William (Australian Male)", "gender": "Male"},
+    "en-CA-ClaraNeural": {"display": "Clara (Canadian Female)", "gender": "Female"},
+    "en-CA-LiamNeural": {"display": "Liam (Canadian Male)", "gender": "Male"}
+}
+
+
+class VoiceCatalog:
+    """
+    Serves the edge-tts voice list from memory.
+
+    The catalog is loaded from a JSON snapshot on disk (or the read-only seed
+    shipped with the code when no snapshot has been written yet) so it is
+    usable immediately at startup and while the upstream service is
+    unreachable.
+    A background task refreshes it on a schedule, and reads that find the
+    data older than the refresh interval trigger a refresh without waiting
+    for it.
+    """
+
+    def __init__(self, snapshot_path: Path, seed_path: Optional[Path] = None,
+                 refresh_interval_seconds: float = 6 * 3600,
+                 retry_interval_seconds: float = 60,
+                 fetch_voices: Callable[[], Awaitable[List[Dict[str, Any]]]] = edge_tts.list_voices):
+        self.snapshot_path = Path(snapshot_path)
+        self.seed_path = Path(seed_path) if seed_path else None
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self.retry_interval_seconds = retry_interval_seconds
+        self.fetch_voices = fetch_voices
+
+        self.voices: List[Dict[str, Any]] = []
+        self.version = ""
+        self.fetched_at = 0.0
+        self.last_refresh_error: Optional[str] = None
+        self._last_attempt = 0.0
+
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._schedule_task: Optional[asyncio.Task] = None
+
+        self.load_snapshot()
+
+    def load_snapshot(self) -> bool:
+        """Load the persisted snapshot (or the seed) into memory; returns False if neither is usable"""
+        for path in (self.snapshot_path, self.seed_path):
+            if path is None or not path.exists():
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                self._set_voices(snapshot.get("voices", []), snapshot.get("fetched_at", 0.0))
+                logger.info(f"Loaded {len(self.voices)} voices from {path}")
+                return True
+            except Exception as e:
+                logger.error(f"Error loading voice catalog from {path}: {str(e)}")
+
+        logger.warning(f"No voice catalog snapshot available at {self.snapshot_path}")
+        return False
+
+    def _set_voices(self, voices: List[Dict[str, Any]], fetched_at: float):
+        voices = sorted(voices, key=lambda v: v.get("ShortName", ""))
+        serialized = json.dumps(voices, sort_keys=True).encode("utf-8")
+        self.voices = voices
+        self.version = hashlib.sha1(serialized).hexdigest()[:16]
+        self.fetched_at = fetched_at
+
+    def _persist_snapshot(self):
+        """Atomically write the current catalog to the snapshot file"""
+        self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": self.fetched_at, "voices": self.voices}, f, indent=1)
+        os.replace(tmp_path, self.snapshot_path)
+
+    @property
+    def is_stale(self) -> bool:
+        return time.time() - self.fetched_at > self.refresh_interval_seconds
+
+    async def refresh(self) -> bool:
+        """Fetch the upstream voice list; keeps the current catalog on failure"""
+        async with self._refresh_lock:
+            self._last_attempt = time.time()
+            try:
+                voices = await self.fetch_voices()
+                if not voices:
+                    raise ValueError("upstream returned an empty voice list")
+
+                previous_version = self.version
+                self._set_voices(voices, time.time())
+                self.last_refresh_error = None
+
+                if self.version != previous_version:
+                    await asyncio.get_running_loop().run_in_executor(None, self._persist_snapshot)
+                    logger.info(f"Voice catalog refreshed: {len(self.voices)} voices (version {self.version})")
+                return True
+
+            except Exception as e:
+                self.last_refresh_error = str(e)
+                logger.warning(f"Voice catalog refresh failed, serving snapshot: {str(e)}")
+                return False
+
+    def refresh_in_background(self):
+        """Start a refresh unless one is already running or the last attempt was too recent"""
+        if time.time() - self._last_attempt < self.retry_interval_seconds:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def _refresh_periodically(self):
+        while True:
+            if self.is_stale or not self.voices:
+                await self.refresh()
+            # Wake up when the catalog next goes stale (or retry soon after a failure)
+            remaining = self.fetched_at + self.refresh_interval_seconds - time.time()
+            await asyncio.sleep(max(remaining, self.retry_interval_seconds))
+
+    def start(self):
+        """Start the scheduled background refresh (call from the running event loop)"""
+        if self._schedule_task is None or self._schedule_task.done():
+            self._schedule_task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        for task in (self._schedule_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+    def get_voices(self, locale: Optional[str] = None, gender: Optional[str] = None,
+                   style: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Voice options for the picker.
+
+        Without filters this is the curated popular list (or the first English
+        voices if none of those exist); with filters it searches the full
+        catalog. Locale matches by prefix, so "en" selects all English voices.
+        """
+        if self.is_stale:
+            self.refresh_in_background()
+
+        if locale is None and gender is None and style is None:
+            options = [
+                self._to_option(voice) for voice in self.voices
+                if voice.get("ShortName", "") in POPULAR_VOICES
+            ]
+            if not options:
+                options = [
+                    self._to_option(voice) for voice in self.voices
+                    if voice.get("Locale", "").startswith("en-")
+                ][:10]
+        else:
+            options = [
+                self._to_option(voice) for voice in self.voices
+                if self._matches(voice, locale, gender, style)
+            ]
+
+        # Sort by gender and then by name for better UI organization
+        options.sort(key=lambda x: (x["gender"], x["display_name"]))
+        return options
+
+    def etag_for(self, locale: Optional[str] = None, gender: Optional[str] = None,
+                 style: Optional[str] = None) -> str:
+        """Strong ETag for a filtered view of the current catalog version"""
+        key = f"{self.version}|{locale or ''}|{gender or ''}|{style or ''}".lower()
+        return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def _matches(self, voice: Dict[str, Any], locale: Optional[str], gender: Optional[str],
+                 style: Optional[str]) -> bool:
+        if locale and not voice.get("Locale", "").lower().startswith(locale.lower()):
+            return False
+        if gender and voice.get("Gender", "").lower() != gender.lower():
+            return False
+        if style:
+            tags = voice.get("VoiceTag") or {}
+            styles = tags.get("VoicePersonalities", []) + tags.get("ContentCategories", [])
+            if style.lower() not in (s.lower() for s in styles):
+                return False
+        return True
+
+    def _to_option(self, voice: Dict[str, Any]) -> Dict[str, Any]:
+        voice_name = voice.get("ShortName", "")
+        locale = voice.get("Locale", "en-US")
+
+        if voice_name in POPULAR_VOICES:
+            info = POPULAR_VOICES[voice_name]
+            return {"name": voice_name, "display_name": info["display"], "language": locale, "gender": info["gender"]}
+
+        # Create display name from ShortName
+        gender = voice.get("Gender", "Unknown")
+        name_part = voice_name.split("-")[-1].replace("Neural", "")
+        return {
+            "name": voice_name,
+            "display_name": f"{name_part} ({locale} {gender})",
+            "language": locale,
+            "gender": gender
+        }
@@ -0,0 +1,238 @@
+"""
+Write-Behind Buffer
+Analytics and audit records queued in memory and written with insert_many
+from a background task, so request handlers do not wait for them to be
+persisted
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Mapping, Optional, Set, Tuple
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Duplicate key: the document was already written by an earlier attempt of the same batch
+DUPLICATE_KEY_ERROR = 11000
+
+# Coroutine run once its document has been written, e.g. a rollup increment
+OnWritten = Callable[[], Awaitable[Any]]
+
+
+class WriteBehindBuffer:
+    """
+    Queues documents per collection and inserts them in batches.
+
+    insert() encodes the document to BSON right away: the caller gets an
+    encoding error immediately, later changes to its dict are not picked up,
+    and the flush does not encode again. A background task writes a
+    collection's queue with unordered insert_many as soon as it holds
+    `batch_size` documents, and everything queued every
+    `flush_interval_seconds`.
+
+    A failed batch goes back to the front of its queue and is retried with
+    exponential backoff. Each document carries its own _id, so documents
+    that reached the server before the failure come back as duplicate key
+    errors on the retry and are counted as written. After `max_attempts`
+    failures the batch is dropped and logged. The queue is bounded at
+    `max_queued` documents; beyond that the oldest are dropped. stop()
+    writes out whatever is still queued.
+
+    A document can carry an on_written callback, run in the background once
+    its batch is written and never for a dropped document. Derived counters
+    (the rollups) are incremented there, so they only count records that
+    exist and a rollup rebuild gives the same numbers.
+
+    Only for analytics records, not user data: a queued document is not
+    visible to queries until it is flushed, and a dropped one is lost even
+    though its request succeeded.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval_seconds: float = 1.0,
+                 max_queued: int = 50000, max_attempts: int = 5, retry_backoff_seconds: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_queued = max_queued
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+
+        # collection full name -> (collection, queued (document, attempts, on_written) entries)
+        self._queues: Dict[str, Tuple[Any, Deque[Tuple[RawBSONDocument, int, Optional[OnWritten]]]]] = {}
+        self._callback_tasks: Set[asyncio.Task] = set()
+        self._queued = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._retry_at = 0.0
+        self._consecutive_failures = 0
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.failed_callbacks = 0
+        self.max_queued_seen = 0
+        self.last_flush_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def insert(self, collection, document: Mapping[str, Any], on_written: Optional[OnWritten] = None):
+        """Queue a document for insertion into a (motor) collection, calling on_written once it is stored"""
+        if "_id" not in document:
+            document = {"_id": bson.ObjectId(), **document}
+        raw = RawBSONDocument(bson.encode(document))
+
+        _, queue = self._queues.setdefault(collection.full_name, (collection, deque()))
+        queue.append((raw, 0, on_written))
+        self._queued += 1
+        self.enqueued += 1
+
+        if self._queued > self.max_queued:
+            self._drop_oldest()
+        self.max_queued_seen = max(self.max_queued_seen, self._queued)
+        if len(queue) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _drop_oldest(self):
+        _, queue = max(self._queues.values(), key=lambda entry: len(entry[1]))
+        queue.popleft()
+        self._queued -= 1
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            logger.error(f"Write-behind buffer full, dropped {self.dropped} documents so far")
+
+    async def flush(self, force: bool = False) -> int:
+        """Write queued documents (full batches only, unless force); returns how many were written"""
+        written = 0
+        for name, (collection, queue) in list(self._queues.items()):
+            while queue and (force or len(queue) >= self.batch_size):
+                batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+                self._queued -= len(batch)
+                try:
+                    written += await self._write_batch(collection, batch)
+                except asyncio.CancelledError:
+                    # Interrupted mid-write: keep the batch; already written documents become duplicates
+                    queue.extendleft(reversed(batch))
+                    self._queued += len(batch)
+                    raise
+                except PyMongoError as e:
+                    self._requeue(name, queue, batch, e)
+                    break
+        return written
+
+    async def _write_batch(self, collection, batch: List[Tuple[RawBSONDocument, int, Optional[OnWritten]]]) -> int:
+        try:
+            await collection.insert_many([document for document, _, _ in batch], ordered=False)
+            count = len(batch)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            count = len(batch)
+        self.written += count
+        self.last_flush_at = time.time()
+        self._consecutive_failures = 0
+
+        callbacks = [on_written for _, _, on_written in batch if on_written is not None]
+        if callbacks:
+            # In the background: a slow callback must not hold up the next batch
+            task = asyncio.create_task(self._run_callbacks(collection.full_name, callbacks))
+            self._callback_tasks.add(task)
+            task.add_done_callback(self._callback_tasks.discard)
+        return count
+
+    async def _run_callbacks(self, name: str, callbacks: List[OnWritten]):
+        results = await asyncio.gather(*(on_written() for on_written in callbacks), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            self.failed_callbacks += len(errors)
+            logger.error(f"{len(errors)} write-behind callbacks for {name} failed: {str(errors[0])}")
+
+    def _requeue(self, name: str, queue: Deque, batch: List[Tuple[RawBSONDocument, int, Optional[OnWritten]]],
+                 error: Exception):
+        self.failed_flushes += 1
+        self.last_error = str(error)
+        self._consecutive_failures += 1
+        self._retry_at = time.monotonic() + self.retry_backoff_seconds * 2 ** min(self._consecutive_failures, 6)
+
+        retry = [(document, attempts + 1, on_written) for document, attempts, on_written in batch
+                 if attempts + 1 < self.max_attempts]
+        if len(retry) < len(batch):
+            self.dropped += len(batch) - len(retry)
+            logger.error(f"Dropping {len(batch) - len(retry)} documents for {name} after "
+                         f"{self.max_attempts} failed writes: {str(error)}")
+        else:
+            logger.warning(f"Write-behind flush to {name} failed, retrying: {str(error)}")
+        queue.extendleft(reversed(retry))
+        self._queued += len(retry)
+
+    async def _flush_periodically(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            # Back off after a failure; full batches wait too rather than hammering a failing server
+            delay = self._retry_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.flush(force=True)
+            except Exception as e:
+                logger.error(f"Error flushing write-behind buffer: {str(e)}")
+
+    def start(self):
+        """Start the background flush task (call from the running event loop)"""
+        if self._flush_task is None or self._flush_task.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self, timeout: float = 30.0):
+        """Stop the background task, write out everything still queued and wait for the callbacks"""
+        if self._flush_task is not None and not self._flush_task.done():
+            # The flag as well: wait_for() can swallow a cancel that races with the wakeup event
+            self._stopping = True
+            self._wakeup.set()
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_task = None
+
+        deadline = time.monotonic() + timeout
+        while self._queued and time.monotonic() < deadline:
+            before = self._queued
+            await self.flush(force=True)
+            if self._queued >= before:
+                await asyncio.sleep(min(self.retry_backoff_seconds, max(0.0, deadline - time.monotonic())))
+        if self._queued:
+            logger.error(f"Write-behind buffer stopped with {self._queued} documents unwritten")
+        if self._callback_tasks:
+            await asyncio.wait(list(self._callback_tasks), timeout=max(0.0, deadline - time.monotonic()))
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queued,
+            "queued_by_collection": {name: len(queue) for name, (_, queue) in self._queues.items() if queue},
+            "max_queued_seen": self.max_queued_seen,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes,
+            "failed_callbacks": self.failed_callbacks,
+            "pending_callbacks": len(self._callback_tasks),
+            "last_flush_at": self.last_flush_at,
+            "last_error": self.last_error
+        }
+
+
+# Global instance
+write_behind = WriteBehindBuffer()
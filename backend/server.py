@@ -1,7 +1,9 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
 import os
 import logging
 from pathlib import Path
@@ -12,14 +14,27 @@ from datetime import datetime
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import edge_tts
 import base64
+import hashlib
 import io
 import tempfile
 import asyncio
 import re
-from lib.avatar_generator import avatar_generator
-from lib.enhanced_avatar_generator import enhanced_avatar_generator
-from lib.ultra_realistic_avatar_generator import ultra_realistic_avatar_generator
 from lib.context_integration import ContextIntegrationSystem
+from lib.audio_timing import word_timing_from_boundary, mp3_duration_seconds, timings_to_srt
+from lib.voice_catalog import VoiceCatalog
+from lib.render_scheduler import RenderScheduler, RenderQueueFull, RenderCancelled
+from lib.render_jobs import (render_avatar_video, render_enhanced_avatar_video, render_ultra_realistic_video,
+                             ultra_realistic_renderer, promote_render)
+from lib.render_plans import render_plan_store
+from lib.render_quality import RENDER_QUALITIES
+from lib.video_store import video_store, parse_range_header, iter_file_range
+from lib.render_cache import render_cache, request_key
+from lib.render_workspace import render_workspaces
+from lib.lipsync_worker import lipsync_worker_client
+from lib.asset_manifest import asset_manifest, file_sha256
+from lib.mongo_indexes import index_registry
+from lib.pagination import InvalidCursor, fetch_page, projection, sort_keys
+from lib.write_behind import write_behind
 # Phase 3: Advanced Analytics and Validation Components
 from lib.advanced_context_engine import AdvancedContextEngine
 from lib.script_quality_analyzer import ScriptQualityAnalyzer
@@ -47,9 +62,33 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
+# Indexes for the collections the API routes query directly (components declare their own)
+index_registry.index("scripts", sort_keys("created_at"))
+index_registry.index("scripts", [("id", ASCENDING)])
+index_registry.index("status_checks", sort_keys("timestamp"))
+index_registry.query("scripts.recent", "scripts", {}, sort=sort_keys("created_at"), limit=101)
+index_registry.query("scripts.next_page", "scripts",
+                     {"$or": [{"created_at": {"$lt": datetime.utcnow()}},
+                              {"created_at": datetime.utcnow(), "id": {"$lt": "script"}}]},
+                     sort=sort_keys("created_at"), limit=101)
+index_registry.query("scripts.by_id", "scripts", {"id": "script"})
+index_registry.query("status_checks.recent", "status_checks", {}, sort=sort_keys("timestamp"), limit=101)
+
 # Gemini configuration
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+# TTS voice catalog, served from memory and refreshed from edge-tts in the background
+voice_catalog = VoiceCatalog(
+    snapshot_path=Path(os.environ.get('VOICE_CATALOG_PATH', '/app/tmp/voice_catalog.json')),
+    seed_path=ROOT_DIR / 'data' / 'voice_catalog_seed.json'
+)
+
+# Shared worker pool for avatar video renders (bounded queue, per-job core budget)
+render_scheduler = RenderScheduler(
+    workers=int(os.environ.get('RENDER_WORKERS', '0')) or None,
+    max_queue_depth=int(os.environ.get('RENDER_QUEUE_DEPTH', '8'))
+)
+
 # Initialize Context Integration System for Phase 2
 context_system = ContextIntegrationSystem()
 
@@ -73,7 +112,10 @@ quality_improvement_loop = QualityImprovementLoop(db, GEMINI_API_KEY)
 intelligent_qa_system = IntelligentQASystem(db, GEMINI_API_KEY)
 
 # STEP 2: Initialize Few-Shot Learning & Pattern Recognition System
-few_shot_generator = FewShotScriptGenerator(db, GEMINI_API_KEY)
+few_shot_generator = FewShotScriptGenerator(
+    db, GEMINI_API_KEY,
+    retrieval_index_path=Path(os.environ.get('FEW_SHOT_INDEX_PATH', '/app/tmp/few_shot_index.pkl'))
+)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -112,6 +154,15 @@ class ScriptResponse(BaseModel):
     duration: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ScriptListItem(BaseModel):
+    """A script in the history list; only the requested fields are set"""
+    id: str
+    created_at: datetime
+    original_prompt: Optional[str] = None
+    generated_script: Optional[str] = None
+    video_type: Optional[str] = None
+    duration: Optional[str] = None
+
 class AIVideoScriptResponse(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     original_prompt: str
@@ -204,33 +255,60 @@ class VoiceOption(BaseModel):
     language: str
     gender: str
 
+class WordTimingEntry(BaseModel):
+    word: str
+    offset: float  # seconds from start of audio
+    duration: float  # seconds
+
 class AudioResponse(BaseModel):
     audio_base64: str
     voice_used: str
     duration_seconds: Optional[float] = None
+    word_timings: List[WordTimingEntry] = []
+    subtitles_srt: Optional[str] = None
 
 class AvatarVideoRequest(BaseModel):
     audio_base64: str
     avatar_image_path: Optional[str] = None
+    word_timings: Optional[List[WordTimingEntry]] = None  # From /generate-audio, skips audio analysis
+    audio_duration_seconds: Optional[float] = None
+    quality: str = "final"  # "preview" (fast, promotable) or "final"
+    return_base64: bool = False  # Also inline the MP4 as base64 (the video is always served from video_url)
+    job_id: Optional[str] = None  # Client-chosen id for polling /render-jobs/{job_id} and cancelling
 
 class EnhancedAvatarVideoRequest(BaseModel):
     audio_base64: str
     avatar_option: str = "default"  # "default", "upload", "ai_generated"
     user_image_base64: Optional[str] = None
     script_text: Optional[str] = ""
+    word_timings: Optional[List[WordTimingEntry]] = None
+    audio_duration_seconds: Optional[float] = None
+    quality: str = "final"
+    return_base64: bool = False
+    job_id: Optional[str] = None
 
 class AvatarVideoResponse(BaseModel):
-    video_base64: str
+    video_id: str
+    video_url: str
+    video_size_bytes: int
+    video_base64: Optional[str] = None
     duration_seconds: float
     request_id: str
+    quality: str = "final"
+    cached: bool = False  # Served from the render cache
 
 class EnhancedAvatarVideoResponse(BaseModel):
-    video_base64: str
+    video_id: str
+    video_url: str
+    video_size_bytes: int
+    video_base64: Optional[str] = None
     duration_seconds: float
     request_id: str
     avatar_option: str
     script_segments: int
     sadtalker_used: bool
+    quality: str = "final"
+    cached: bool = False
 
 class UltraRealisticAvatarVideoRequest(BaseModel):
     audio_base64: str
@@ -238,9 +316,18 @@ class UltraRealisticAvatarVideoRequest(BaseModel):
     gender: str = "female"  # "male", "female", "diverse"
     avatar_index: int = 1  # 1, 2, 3 for different avatar variations
     script_text: Optional[str] = ""
+    word_timings: Optional[List[WordTimingEntry]] = None
+    audio_duration_seconds: Optional[float] = None
+    quality: str = "final"
+    ai_model: str = "auto"  # "auto", "sadtalker", "wav2lip", "viseme", "basic"
+    return_base64: bool = False
+    job_id: Optional[str] = None
 
 class UltraRealisticAvatarVideoResponse(BaseModel):
-    video_base64: str
+    video_id: str
+    video_url: str
+    video_size_bytes: int
+    video_base64: Optional[str] = None
     duration_seconds: float
     request_id: str
     avatar_style: str
@@ -250,6 +337,8 @@ class UltraRealisticAvatarVideoResponse(BaseModel):
     background_contexts: List[str]
     ai_model_used: str
     quality_level: str
+    quality: str = "final"
+    cached: bool = False
 
 # Phase 4: A/B Testing and Optimization Models
 class PromptExperimentRequest(BaseModel):
@@ -442,8 +531,16 @@ async def create_status_check(input: StatusCheckCreate):
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find().to_list(1000)
+async def get_status_checks(response: Response, limit: int = 100, cursor: Optional[str] = None):
+    """Status checks, newest first; the X-Next-Cursor header holds the cursor of the next page"""
+    if not 1 <= limit <= 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    try:
+        status_checks, next_cursor = await fetch_page(db.status_checks, "timestamp", limit, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [StatusCheck(**status_check) for status_check in status_checks]
 
 # Script Generation Endpoints
@@ -1857,15 +1954,43 @@ Create a script where every visual description is a perfect, ready-to-use AI ima
         logger.error(f"Error generating script: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating script: {str(e)}")
 
-@api_router.get("/scripts", response_model=List[ScriptResponse])
-async def get_scripts():
-    """Get all generated scripts"""
+@api_router.get("/scripts", response_model=List[ScriptListItem], response_model_exclude_unset=True)
+async def get_scripts(response: Response, limit: int = 100, cursor: Optional[str] = None,
+                      fields: Optional[str] = None):
+    """
+    Get generated scripts, newest first, a page at a time. `fields` (comma
+    separated, e.g. original_prompt,video_type) limits each script to those
+    fields plus id and created_at; GET /scripts/{script_id} returns a whole
+    script. The X-Next-Cursor header holds the cursor of the next page.
+    """
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
     try:
-        scripts = await db.scripts.find().sort("created_at", -1).to_list(100)
-        return [ScriptResponse(**script) for script in scripts]
+        fields_projection = projection(fields, ScriptListItem.model_fields, "created_at")
+        scripts, next_cursor = await fetch_page(db.scripts, "created_at", limit, cursor, fields_projection)
+    except ValueError as e:
+        # InvalidCursor or unknown field names
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching scripts: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching scripts: {str(e)}")
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [ScriptListItem(**{field: script[field] for field in ScriptListItem.model_fields if field in script})
+            for script in scripts]
+
+@api_router.get("/scripts/{script_id}")
+async def get_script(script_id: str):
+    """Get one generated script with all of its stored fields"""
+    try:
+        script = await db.scripts.find_one({"id": script_id}, {"_id": 0})
+    except Exception as e:
+        logger.error(f"Error fetching script {script_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching script: {str(e)}")
+    if script is None:
+        raise HTTPException(status_code=404, detail="Script not found")
+    return script
 
 @api_router.post("/generate-script-v2", response_model=ScriptResponse)
 async def generate_script_v2(request: ScriptRequest):
@@ -2600,62 +2725,23 @@ def extract_dialogue_only_script(raw_script):
     return final_dialogue.strip()
 
 @api_router.get("/voices", response_model=List[VoiceOption])
-async def get_available_voices():
-    """Get list of available TTS voices"""
+async def get_available_voices(request: Request, response: Response, locale: Optional[str] = None,
+                               gender: Optional[str] = None, style: Optional[str] = None):
+    """Get list of available TTS voices (served from the in-memory voice catalog)"""
     try:
-        voices = await edge_tts.list_voices()
-        
-        # Filter and format voices for better user experience
-        voice_options = []
-        
-        # Select popular voices with good variety
-        popular_voices = {
-            "en-US-AriaNeural": {"display": "Aria (US Female - Natural)", "gender": "Female"},
-            "en-US-DavisNeural": {"display": "Davis (US Male - Natural)", "gender": "Male"}, 
-            "en-US-JennyNeural": {"display": "Jenny (US Female - Friendly)", "gender": "Female"},
-            "en-US-GuyNeural": {"display": "Guy (US Male - Professional)", "gender": "Male"},
-            "en-GB-SoniaNeural": {"display": "Sonia (UK Female)", "gender": "Female"},
-            "en-GB-RyanNeural": {"display": "Ryan (UK Male)", "gender": "Male"},
-            "en-AU-NatashaNeural": {"display": "Natasha (Australian Female)", "gender": "Female"},
-            "en-AU-WilliamNeural": {"display": "William (Australian Male)", "gender": "Male"},
-            "en-CA-ClaraNeural": {"display": "Clara (Canadian Female)", "gender": "Female"},
-            "en-CA-LiamNeural": {"display": "Liam (Canadian Male)", "gender": "Male"}
+        etag = voice_catalog.etag_for(locale, gender, style)
+        cache_headers = {
+            "ETag": etag,
+            "Cache-Control": "public, max-age=300, stale-while-revalidate=86400"
         }
         
-        for voice in voices:
-            voice_name = voice.get('ShortName', '')  # Use ShortName instead of Name
-            if voice_name in popular_voices:
-                voice_info = popular_voices[voice_name]
-                voice_options.append(VoiceOption(
-                    name=voice_name,
-                    display_name=voice_info["display"],
-                    language=voice.get('Locale', 'en-US'),
-                    gender=voice_info["gender"]
-                ))
-        
-        # If no popular voices found, add first 10 English voices
-        if not voice_options:
-            count = 0
-            for voice in voices:
-                if voice.get('Locale', '').startswith('en-') and count < 10:
-                    voice_name = voice.get('ShortName', '')
-                    gender = voice.get('Gender', 'Unknown')
-                    locale = voice.get('Locale', 'en-US')
-                    
-                    # Create display name from ShortName
-                    name_part = voice_name.split('-')[-1].replace('Neural', '')
-                    display_name = f"{name_part} ({locale} {gender})"
-                    
-                    voice_options.append(VoiceOption(
-                        name=voice_name,
-                        display_name=display_name,
-                        language=locale,
-                        gender=gender
-                    ))
-                    count += 1
+        # Conditional request: the client already has this catalog version
+        if_none_match = request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=cache_headers)
         
-        # Sort by gender and then by name for better UI organization
-        voice_options.sort(key=lambda x: (x.gender, x.display_name))
+        voice_options = [VoiceOption(**voice) for voice in voice_catalog.get_voices(locale, gender, style)]
+        response.headers.update(cache_headers)
         
         return voice_options
         
@@ -2685,25 +2771,36 @@ async def generate_audio(request: TextToSpeechRequest):
         logger.info(f"Cleaned text (first 200 chars): {clean_text[:200]}...")
         logger.info(f"Text reduction: {len(original_text)} → {len(clean_text)} chars")
         
-        # Create TTS communication
-        communicate = edge_tts.Communicate(clean_text, request.voice_name)
+        # Create TTS communication, requesting per-word boundary events
+        communicate = edge_tts.Communicate(clean_text, request.voice_name, boundary="WordBoundary")
         
-        # Generate audio in memory
-        audio_data = b""
+        # Generate audio in memory and capture the word timing track
+        audio_chunks = []
+        word_timings = []
         async for chunk in communicate.stream():
             if chunk["type"] == "audio":
-                audio_data += chunk["data"]
+                audio_chunks.append(chunk["data"])
+            elif chunk["type"] == "WordBoundary":
+                word_timings.append(word_timing_from_boundary(chunk))
+        audio_data = b"".join(audio_chunks)
         
         if not audio_data:
             raise HTTPException(status_code=500, detail="Failed to generate audio data")
         
+        # Exact duration from the MP3 frame headers, falling back to the last word boundary
+        duration_seconds = mp3_duration_seconds(audio_data)
+        if duration_seconds is None and word_timings:
+            duration_seconds = word_timings[-1].end
+        
         # Convert to base64 for frontend
         audio_base64 = base64.b64encode(audio_data).decode('utf-8')
         
         return AudioResponse(
             audio_base64=audio_base64,
             voice_used=request.voice_name,
-            duration_seconds=len(audio_data) / 16000  # Rough estimation
+            duration_seconds=duration_seconds,
+            word_timings=[WordTimingEntry(**timing.to_dict()) for timing in word_timings],
+            subtitles_srt=timings_to_srt(word_timings) if word_timings else None
         )
         
     except HTTPException:
@@ -2712,8 +2809,96 @@ async def generate_audio(request: TextToSpeechRequest):
         logger.error(f"Error generating audio: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating audio: {str(e)}")
 
+def _word_timings_payload(word_timings: Optional[List[WordTimingEntry]]) -> Optional[List[Dict[str, Any]]]:
+    """Convert request word timings into plain dicts for the render generators"""
+    if not word_timings:
+        return None
+    return [timing.dict() for timing in word_timings]
+
+def _render_queue_full_response(error: RenderQueueFull) -> HTTPException:
+    """429 telling the client when to retry a render the queue could not accept"""
+    logger.warning(f"Rejected render request: {str(error)}")
+    return HTTPException(
+        status_code=429,
+        detail="Video rendering is busy, please retry shortly",
+        headers={"Retry-After": str(error.retry_after_seconds)}
+    )
+
+def _validate_render_quality(quality: str):
+    if quality not in RENDER_QUALITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid quality, expected one of: {', '.join(RENDER_QUALITIES)}")
+
+def _file_hash_if_exists(path: Optional[str]) -> Optional[str]:
+    return file_sha256(Path(path)) if path and os.path.isfile(path) else None
+
+def _validate_job_id(job_id: Optional[str]):
+    if job_id is None:
+        return
+    if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id, expected 1-64 letters, digits, '-' or '_'")
+    status = render_scheduler.job_status(job_id)
+    if status and status["state"] in ["queued", "running"]:
+        raise HTTPException(status_code=409, detail="A render job with this id is already in progress")
+
+async def _render_while_connected(http_request: Request, render):
+    """
+    Await a render, cancelling it (and so stopping its worker and ffmpeg)
+    if the client disconnects before it finishes
+    """
+    task = asyncio.ensure_future(render)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=1.0)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                logger.info("Client disconnected, cancelling its render")
+                task.cancel()
+                raise asyncio.CancelledError()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+def _render_cancelled_response(error: RenderCancelled) -> HTTPException:
+    logger.info(f"Render cancelled: {str(error)}")
+    return HTTPException(status_code=409, detail="Render job was cancelled")
+
+@api_router.get("/lipsync-worker/health")
+async def get_lipsync_worker_health():
+    """Status of the persistent SadTalker worker (renders fall back to a subprocess while it is down)"""
+    health = await asyncio.to_thread(lipsync_worker_client.health)
+    return health or {"status": "down"}
+
+@api_router.get("/render-jobs/{job_id}")
+async def get_render_job(job_id: str):
+    """State and percent-complete of a render job, by the job_id given with the render request"""
+    status = render_scheduler.job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    return status
+
+@api_router.delete("/render-jobs/{job_id}")
+async def cancel_render_job(job_id: str):
+    """Cancel a queued or running render job; its request answers 409"""
+    status = render_scheduler.job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Render job not found")
+    if not render_scheduler.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Render job already {status['state']}")
+    return {"job_id": job_id, "cancelled": True}
+
+@api_router.get("/render-metrics")
+async def get_render_metrics():
+    """Render pool queue depth, utilisation and wait-time metrics, plus render cache hit rates"""
+    return {**render_scheduler.metrics(), "cache": render_cache.metrics()}
+
+@api_router.get("/write-behind-metrics")
+async def get_write_behind_metrics():
+    """Queue depth and write counts of the buffered analytics inserts"""
+    return write_behind.metrics()
+
 @api_router.post("/generate-avatar-video", response_model=AvatarVideoResponse)
-async def generate_avatar_video(request: AvatarVideoRequest):
+async def generate_avatar_video(request: AvatarVideoRequest, http_request: Request):
     """Generate an avatar video from audio using AI-powered lip sync"""
     try:
         logger.info("Starting avatar video generation")
@@ -2721,35 +2906,60 @@ async def generate_avatar_video(request: AvatarVideoRequest):
         if not request.audio_base64 or request.audio_base64.strip() == "":
             raise HTTPException(status_code=400, detail="Audio data is required")
         
-        # Generate avatar video in a separate thread to avoid blocking
-        import concurrent.futures
-        import asyncio
+        _validate_render_quality(request.quality)
+        _validate_job_id(request.job_id)
+        # Always an id, so requests coalesced onto this render can be aliased to it
+        job_id = request.job_id or uuid.uuid4().hex
+        
+        word_timings = _word_timings_payload(request.word_timings)
+        cache_key = request_key(
+            "avatar", request.audio_base64, asset_manifest.fingerprint(),
+            avatar_image_path=request.avatar_image_path,
+            avatar_image=_file_hash_if_exists(request.avatar_image_path),
+            word_timings=word_timings,
+            audio_duration_seconds=request.audio_duration_seconds,
+            quality=request.quality
+        )
         
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            result = await loop.run_in_executor(
-                executor, 
-                avatar_generator.generate_avatar_video,
+        # Identical requests are served from the render cache; otherwise render in the shared worker pool
+        result, cached = await render_cache.get_or_render(cache_key, lambda: _render_while_connected(
+            http_request, render_scheduler.submit(
+                render_avatar_video,
                 request.audio_base64,
-                request.avatar_image_path
+                request.avatar_image_path,
+                word_timings,
+                request.audio_duration_seconds,
+                request.quality,
+                job_id=job_id
             )
+        ), job_id=job_id, alias_job=render_scheduler.alias)
+        result = render_cache.with_base64(result, request.return_base64)
         
-        logger.info(f"Avatar video generation completed successfully. Video size: {len(result['video_base64'])} chars")
+        logger.info(f"Avatar video generation completed successfully (cached: {cached}). Video size: {result['video_size_bytes']} bytes")
         
         return AvatarVideoResponse(
+            video_id=result["video_id"],
+            video_url=result["video_url"],
+            video_size_bytes=result["video_size_bytes"],
             video_base64=result["video_base64"],
             duration_seconds=result["duration_seconds"],
-            request_id=result["request_id"]
+            request_id=result["request_id"],
+            quality=result["quality"],
+            cached=cached
         )
         
     except HTTPException:
         raise
+    except RenderQueueFull as e:
+        raise _render_queue_full_response(e)
+    except RenderCancelled as e:
+        raise _render_cancelled_response(e)
     except Exception as e:
         logger.error(f"Error generating avatar video: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating avatar video: {str(e)}")
 
 @api_router.post("/generate-enhanced-avatar-video", response_model=EnhancedAvatarVideoResponse)
-async def generate_enhanced_avatar_video(request: EnhancedAvatarVideoRequest):
+async def generate_enhanced_avatar_video(request: EnhancedAvatarVideoRequest, http_request: Request):
     """Generate an enhanced avatar video with realistic AI avatars and context-aware backgrounds"""
     try:
         logger.info("Starting enhanced avatar video generation")
@@ -2765,40 +2975,67 @@ async def generate_enhanced_avatar_video(request: EnhancedAvatarVideoRequest):
         if request.avatar_option == "upload" and not request.user_image_base64:
             raise HTTPException(status_code=400, detail="User image is required for upload option")
         
-        # Generate enhanced avatar video in a separate thread to avoid blocking
-        import concurrent.futures
-        import asyncio
+        _validate_render_quality(request.quality)
+        _validate_job_id(request.job_id)
+        # Always an id, so requests coalesced onto this render can be aliased to it
+        job_id = request.job_id or uuid.uuid4().hex
+        
+        word_timings = _word_timings_payload(request.word_timings)
+        user_image = request.user_image_base64 if request.avatar_option == "upload" else None
+        cache_key = request_key(
+            "enhanced", request.audio_base64, asset_manifest.fingerprint(),
+            avatar_option=request.avatar_option,
+            user_image=hashlib.sha256(user_image.encode('utf-8')).hexdigest() if user_image else None,
+            script_text=request.script_text or "",
+            word_timings=word_timings,
+            audio_duration_seconds=request.audio_duration_seconds,
+            quality=request.quality
+        )
         
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            result = await loop.run_in_executor(
-                executor, 
-                enhanced_avatar_generator.generate_enhanced_avatar_video,
+        # Identical requests are served from the render cache; otherwise render in the shared worker pool
+        result, cached = await render_cache.get_or_render(cache_key, lambda: _render_while_connected(
+            http_request, render_scheduler.submit(
+                render_enhanced_avatar_video,
                 request.audio_base64,
                 request.avatar_option,
                 request.user_image_base64,
-                request.script_text or ""
+                request.script_text or "",
+                word_timings,
+                request.audio_duration_seconds,
+                request.quality,
+                job_id=job_id
             )
+        ), job_id=job_id, alias_job=render_scheduler.alias)
+        result = render_cache.with_base64(result, request.return_base64)
         
-        logger.info(f"Enhanced avatar video generation completed successfully. Video size: {len(result['video_base64'])} chars")
+        logger.info(f"Enhanced avatar video generation completed successfully (cached: {cached}). Video size: {result['video_size_bytes']} bytes")
         
         return EnhancedAvatarVideoResponse(
+            video_id=result["video_id"],
+            video_url=result["video_url"],
+            video_size_bytes=result["video_size_bytes"],
             video_base64=result["video_base64"],
             duration_seconds=result["duration_seconds"],
             request_id=result["request_id"],
             avatar_option=result["avatar_option"],
             script_segments=result["script_segments"],
-            sadtalker_used=result["sadtalker_used"]
+            sadtalker_used=result["sadtalker_used"],
+            quality=result["quality"],
+            cached=cached
         )
         
     except HTTPException:
         raise
+    except RenderQueueFull as e:
+        raise _render_queue_full_response(e)
+    except RenderCancelled as e:
+        raise _render_cancelled_response(e)
     except Exception as e:
         logger.error(f"Error generating enhanced avatar video: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating enhanced avatar video: {str(e)}")
 
 @api_router.post("/generate-ultra-realistic-avatar-video", response_model=UltraRealisticAvatarVideoResponse)
-async def generate_ultra_realistic_avatar_video(request: UltraRealisticAvatarVideoRequest):
+async def generate_ultra_realistic_avatar_video(request: UltraRealisticAvatarVideoRequest, http_request: Request):
     """Generate ultra-realistic avatar video with AI-generated faces, perfect lip-sync, and dynamic backgrounds"""
     try:
         logger.info("Starting ultra-realistic avatar video generation")
@@ -2818,25 +3055,55 @@ async def generate_ultra_realistic_avatar_video(request: UltraRealisticAvatarVid
         if request.avatar_index not in [1, 2, 3]:
             raise HTTPException(status_code=400, detail="Invalid avatar index")
         
-        # Generate ultra-realistic avatar video in a separate thread to avoid blocking
-        import concurrent.futures
-        import asyncio
+        # Validate lip-sync model
+        if request.ai_model not in ["auto", "sadtalker", "wav2lip", "viseme", "basic"]:
+            raise HTTPException(status_code=400, detail="Invalid AI model")
+        
+        _validate_render_quality(request.quality)
+        _validate_job_id(request.job_id)
+        # Always an id, so requests coalesced onto this render can be aliased to it
+        job_id = request.job_id or uuid.uuid4().hex
+        
+        # Keyed on the renderer the model resolves to: models rendered the same way share one video
+        ai_model_used, renderer = ultra_realistic_renderer(request.ai_model, request.quality)
+        word_timings = _word_timings_payload(request.word_timings)
+        cache_key = request_key(
+            "ultra_realistic", request.audio_base64, asset_manifest.fingerprint(),
+            avatar_style=request.avatar_style,
+            gender=request.gender,
+            avatar_index=request.avatar_index,
+            script_text=request.script_text or "",
+            word_timings=word_timings,
+            audio_duration_seconds=request.audio_duration_seconds,
+            quality=request.quality,
+            renderer=renderer
+        )
         
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            result = await loop.run_in_executor(
-                executor, 
-                ultra_realistic_avatar_generator.generate_ultra_realistic_video,
+        # Identical requests are served from the render cache; otherwise render in the shared worker pool
+        result, cached = await render_cache.get_or_render(cache_key, lambda: _render_while_connected(
+            http_request, render_scheduler.submit(
+                render_ultra_realistic_video,
                 request.audio_base64,
                 request.avatar_style,
                 request.gender,
                 request.avatar_index,
-                request.script_text or ""
+                request.script_text or "",
+                word_timings,
+                request.audio_duration_seconds,
+                request.quality,
+                False,  # base64 is filled in from the video store
+                request.ai_model,
+                job_id=job_id
             )
+        ), job_id=job_id, alias_job=render_scheduler.alias)
+        result = render_cache.with_base64(result, request.return_base64)
         
-        logger.info(f"Ultra-realistic avatar video generation completed successfully. Video size: {len(result['video_base64'])} chars")
+        logger.info(f"Ultra-realistic avatar video generation completed successfully (cached: {cached}). Video size: {result['video_size_bytes']} bytes")
         
         return UltraRealisticAvatarVideoResponse(
+            video_id=result["video_id"],
+            video_url=result["video_url"],
+            video_size_bytes=result["video_size_bytes"],
             video_base64=result["video_base64"],
             duration_seconds=result["duration_seconds"],
             request_id=result["request_id"],
@@ -2845,16 +3112,82 @@ async def generate_ultra_realistic_avatar_video(request: UltraRealisticAvatarVid
             avatar_index=result["avatar_index"],
             script_segments=result["script_segments"],
             background_contexts=result["background_contexts"],
-            ai_model_used=result["ai_model_used"],
-            quality_level=result["quality_level"]
+            ai_model_used=ai_model_used,
+            quality_level=result["quality_level"],
+            quality=result["quality"],
+            cached=cached
         )
         
     except HTTPException:
         raise
+    except RenderQueueFull as e:
+        raise _render_queue_full_response(e)
+    except RenderCancelled as e:
+        raise _render_cancelled_response(e)
     except Exception as e:
         logger.error(f"Error generating ultra-realistic avatar video: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error generating ultra-realistic avatar video: {str(e)}")
 
+@api_router.post("/promote-render/{request_id}")
+async def promote_render_to_final(request_id: str, http_request: Request, return_base64: bool = False,
+                                  job_id: Optional[str] = None):
+    """Re-render a preview at final quality, reusing its decoded audio, timing and background plan"""
+    try:
+        if render_plan_store.load(request_id) is None:
+            raise HTTPException(status_code=404, detail="Preview render not found or expired")
+        _validate_job_id(job_id)
+        
+        result = await _render_while_connected(
+            http_request, render_scheduler.submit(promote_render, request_id, return_base64, job_id=job_id)
+        )
+        
+        logger.info(f"Promoted preview {request_id} to final quality. Video size: {result['video_size_bytes']} bytes")
+        return result
+        
+    except HTTPException:
+        raise
+    except RenderQueueFull as e:
+        raise _render_queue_full_response(e)
+    except RenderCancelled as e:
+        raise _render_cancelled_response(e)
+    except Exception as e:
+        logger.error(f"Error promoting render {request_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error promoting render: {str(e)}")
+
+@api_router.get("/videos/{video_id}")
+async def get_video(video_id: str, request: Request, download: bool = False):
+    """Stream a rendered video from the video store, with HTTP Range support for seeking"""
+    video_path = video_store.get(video_id)
+    if video_path is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    # Videos are content addressed, so a given URL never changes
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{video_id}"'
+    }
+    if download:
+        headers["Content-Disposition"] = f'attachment; filename="avatar-video-{video_id[:12]}.mp4"'
+    
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    
+    size = video_path.stat().st_size
+    try:
+        byte_range = parse_range_header(request.headers.get("range"), size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        return FileResponse(video_path, media_type="video/mp4", headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_file_range(video_path, start, end), status_code=206,
+                             media_type="video/mp4", headers=headers)
+
 # =============================================================================
 # PHASE 3: ADVANCED ANALYTICS AND VALIDATION ENDPOINTS
 # =============================================================================
@@ -3849,7 +4182,7 @@ async def manage_example_database(request: ExampleDatabaseRequest):
             result = await few_shot_generator.build_example_database()
             
             # Extract patterns
-            await few_shot_generator.extract_patterns()
+            await few_shot_generator.extract_patterns(force=True)
             
             status = "rebuilt"
         else:
@@ -3862,6 +4195,7 @@ async def manage_example_database(request: ExampleDatabaseRequest):
             for example_data in request.add_examples:
                 # Validate and add example
                 await few_shot_generator.examples_collection.insert_one(example_data)
+            await few_shot_generator.store.refresh()
             
         # Get final statistics
         stats = await few_shot_generator.get_system_stats()
@@ -3920,6 +4254,7 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include the router in the main app
@@ -3932,6 +4267,29 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_services():
+    voice_catalog.start()
+    # Idempotent; builds any index a component declared that the database does not have yet
+    index_registry.start(db)
+    # Cheap stat-only check; missing avatars/backgrounds are rendered on first use
+    asset_manifest.validate()
+    # Scratch directories left behind by renders that died with the previous process
+    render_workspaces.purge()
+    # Keep SadTalker loaded in its own process when it is installed
+    if os.environ.get("LIPSYNC_WORKER_AUTOSTART", "1") == "1":
+        lipsync_worker_client.start(ROOT_DIR)
+    # Few-shot selection reads examples and patterns from memory
+    few_shot_generator.store.start()
+    # Analytics inserts are written in batches after the response
+    write_behind.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await voice_catalog.stop()
+    await few_shot_generator.store.stop()
+    render_scheduler.shutdown()
+    lipsync_worker_client.stop()
+    # Write out buffered inserts before the Mongo client goes away
+    await write_behind.stop()
     client.close()
@@ -1486,7 +1486,8 @@ KEY RETENTION ELEMENTS:
         # Test Case 1: Basic avatar video generation
         try:
             avatar_payload = {
-                "audio_base64": audio_base64
+                "audio_base64": audio_base64,
+                "return_base64": True
                 # avatar_image_path is optional - should use default
             }
             
@@ -1691,7 +1692,8 @@ KEY RETENTION ELEMENTS:
             
             # Step 4: Generate avatar video from audio
             avatar_payload = {
-                "audio_base64": audio_base64
+                "audio_base64": audio_base64,
+                "return_base64": True
             }
             
             avatar_response = self.session.post(
@@ -34,6 +34,7 @@ const ScriptGenerator = () => {
   const [isGeneratingVideo, setIsGeneratingVideo] = useState(false);
   const [avatarVideoData, setAvatarVideoData] = useState(null);
   const [lastGeneratedAudio, setLastGeneratedAudio] = useState(null);
+  const [lastAudioTiming, setLastAudioTiming] = useState(null);
 
   // Enhanced avatar generation state
   const [avatarOption, setAvatarOption] = useState("default");
@@ -57,8 +58,11 @@ const ScriptGenerator = () => {
 
   const fetchScripts = async () => {
     try {
-      const response = await axios.get(`${API}/scripts`);
-      setScripts(response.data.slice(0, 5)); // Show only latest 5
+      // Only the latest 5, without their script bodies (loaded when one is opened)
+      const response = await axios.get(`${API}/scripts`, {
+        params: { limit: 5, fields: "original_prompt,video_type,duration" }
+      });
+      setScripts(response.data);
     } catch (err) {
       console.error("Error fetching scripts:", err);
     }
@@ -266,6 +270,10 @@ const ScriptGenerator = () => {
       
       setAudioData(audio);
       setLastGeneratedAudio(audioBase64); // Store for avatar video generation
+      setLastAudioTiming({
+        word_timings: response.data.word_timings,
+        audio_duration_seconds: response.data.duration_seconds
+      }); // Lets the avatar endpoints skip re-analysing the audio
       audio.play();
       
     } catch (err) {
@@ -328,24 +336,15 @@ const ScriptGenerator = () => {
 
     try {
       const response = await axios.post(`${API}/generate-avatar-video`, {
-        audio_base64: lastGeneratedAudio
+        audio_base64: lastGeneratedAudio,
+        ...lastAudioTiming
       });
 
-      // Convert base64 video to blob for download
-      const videoBase64 = response.data.video_base64;
-      const videoBytes = atob(videoBase64);
-      const videoArray = new Uint8Array(videoBytes.length);
-      
-      for (let i = 0; i < videoBytes.length; i++) {
-        videoArray[i] = videoBytes.charCodeAt(i);
-      }
-      
-      const videoBlob = new Blob([videoArray], { type: 'video/mp4' });
-      const videoUrl = URL.createObjectURL(videoBlob);
+      // The video is streamed from the backend's video store (supports seeking via Range requests)
+      const videoUrl = `${BACKEND_URL}${response.data.video_url}`;
       
       setAvatarVideoData({
         url: videoUrl,
-        blob: videoBlob,
         duration: response.data.duration_seconds,
         requestId: response.data.request_id
       });
@@ -393,24 +392,15 @@ const ScriptGenerator = () => {
         audio_base64: lastGeneratedAudio,
         avatar_option: avatarOption,
         user_image_base64: userImageBase64,
-        script_text: generatedScript
+        script_text: generatedScript,
+        ...lastAudioTiming
       });
 
-      // Convert base64 video to blob for download
-      const videoBase64 = response.data.video_base64;
-      const videoBytes = atob(videoBase64);
-      const videoArray = new Uint8Array(videoBytes.length);
-      
-      for (let i = 0; i < videoBytes.length; i++) {
-        videoArray[i] = videoBytes.charCodeAt(i);
-      }
-      
-      const videoBlob = new Blob([videoArray], { type: 'video/mp4' });
-      const videoUrl = URL.createObjectURL(videoBlob);
+      // The video is streamed from the backend's video store (supports seeking via Range requests)
+      const videoUrl = `${BACKEND_URL}${response.data.video_url}`;
       
       setAvatarVideoData({
         url: videoUrl,
-        blob: videoBlob,
         duration: response.data.duration_seconds,
         requestId: response.data.request_id,
         avatarOption: response.data.avatar_option,
@@ -443,24 +433,15 @@ const ScriptGenerator = () => {
         avatar_style: ultraAvatarStyle,
         gender: ultraAvatarGender,
         avatar_index: ultraAvatarIndex,
-        script_text: generatedScript
+        script_text: generatedScript,
+        ...lastAudioTiming
       });
 
-      // Convert base64 video to blob for download
-      const videoBase64 = response.data.video_base64;
-      const videoBytes = atob(videoBase64);
-      const videoArray = new Uint8Array(videoBytes.length);
-      
-      for (let i = 0; i < videoBytes.length; i++) {
-        videoArray[i] = videoBytes.charCodeAt(i);
-      }
-      
-      const videoBlob = new Blob([videoArray], { type: 'video/mp4' });
-      const videoUrl = URL.createObjectURL(videoBlob);
+      // The video is streamed from the backend's video store (supports seeking via Range requests)
+      const videoUrl = `${BACKEND_URL}${response.data.video_url}`;
       
       setAvatarVideoData({
         url: videoUrl,
-        blob: videoBlob,
         duration: response.data.duration_seconds,
         requestId: response.data.request_id,
         avatarStyle: response.data.avatar_style,
@@ -483,7 +464,7 @@ const ScriptGenerator = () => {
   const downloadAvatarVideo = () => {
     if (avatarVideoData) {
       const link = document.createElement('a');
-      link.href = avatarVideoData.url;
+      link.href = `${avatarVideoData.url}?download=true`;
       link.download = `avatar-video-${avatarVideoData.requestId}.mp4`;
       document.body.appendChild(link);
       link.click();
@@ -966,9 +947,14 @@ const ScriptGenerator = () => {
                 <div className="space-y-3 max-h-80 overflow-y-auto">
                   {scripts.map((script) => (
                     <div key={script.id} className="bg-white/5 p-4 rounded-lg border border-white/10 hover:bg-white/10 transition-colors cursor-pointer"
-                         onClick={() => {
-                           setGeneratedScript(script.generated_script);
-                           setGeneratedWithPrompt("saved");
+                         onClick={async () => {
+                           try {
+                             const response = await axios.get(`${API}/scripts/${script.id}`);
+                             setGeneratedScript(response.data.generated_script);
+                             setGeneratedWithPrompt("saved");
+                           } catch (err) {
+                             console.error("Error loading script:", err);
+                           }
                          }}>
                       <p className="text-gray-300 text-sm mb-2 line-clamp-2">{script.original_prompt}</p>
                       <div className="flex justify-between items-center text-xs text-gray-400">
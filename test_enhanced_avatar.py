@@ -87,7 +87,8 @@ class EnhancedAvatarTester:
             default_payload = {
                 "audio_base64": audio_base64,
                 "avatar_option": "default",
-                "script_text": "Welcome to our presentation. This is about technology and innovation in the modern world."
+                "script_text": "Welcome to our presentation. This is about technology and innovation in the modern world.",
+                "return_base64": True
             }
             
             print("Sending request to enhanced avatar video endpoint...")
@@ -161,7 +162,8 @@ class EnhancedAvatarTester:
             ai_payload = {
                 "audio_base64": audio_base64,
                 "avatar_option": "ai_generated",
-                "script_text": "This is a test of AI-generated avatar functionality."
+                "script_text": "This is a test of AI-generated avatar functionality.",
+                "return_base64": True
             }
             
             print("Testing AI generated avatar option...")